@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+import config
+from storage import storage
+
+
+def _timestamp(seconds: float) -> str:
+    """UTC, like the database's now(); a local time would shift the idle cutoff by the host's offset"""
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat(timespec='microseconds')
+
+
+class ActivityTracker:
+    """Keeps sessions' last activity in memory and writes it to storage in bulk.
+
+    Every chat message touches its session; the tracker only records the time,
+    and flushes each session at most once per flush_interval. Touches are
+    grouped into resolution-second windows, so one flush is a handful of bulk
+    updates however many sessions were active; each window is written with its
+    newest touch, so stored activity is never older than the real one. Reads
+    that list sessions merge in the touches not flushed yet.
+
+    The same loop runs the idle sweep: every sweep_interval, sessions with no
+    activity for idle_seconds are marked inactive in one update, instead of
+    deactivating a user's sessions in the request path when they switch
+    persona. Pending touches are flushed first so a session active here is
+    never expired. With enabled=False, for serverless deployments that freeze
+    between requests, touches go straight to storage and the sweep runs on
+    the request path instead: the first touch after sweep_interval has passed
+    runs it inline.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        flush_interval: float = 60.0,
+        resolution: float = 10.0,
+        idle_seconds: float = 1800.0,
+        sweep_interval: float = 300.0,
+    ):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.resolution = resolution
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        # session_id -> wall-clock time of its latest touch not yet written
+        self._pending: dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._last_sweep = time.monotonic()
+        self.touches = 0
+        self.written = 0
+        self.updates = 0
+        self.failures = 0
+        self.sweeps = 0
+        self.expired = 0
+
+    def _ensure_worker(self):
+        if self._task is None or self._task.done():
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def touch(self, session_id: str):
+        self.touches += 1
+        if not self.enabled:
+            await storage.touch_session(session_id)
+            # No background loop may run between requests, so requests take turns sweeping
+            if time.monotonic() - self._last_sweep >= self.sweep_interval:
+                await self.sweep()
+            return
+        self._ensure_worker()
+        self._pending[session_id] = time.time()
+
+    def last_activity(self, session_id: str) -> Optional[str]:
+        """A session's latest activity if it has not reached storage yet"""
+        touched = self._pending.get(session_id)
+        return _timestamp(touched) if touched is not None else None
+
+    def merge(self, sessions: list) -> list:
+        """Session rows with last_activity brought up to date from pending touches"""
+        for row in sessions:
+            touched = self.last_activity(row.get('id'))
+            if touched is not None and 'last_activity' in row:
+                row['last_activity'] = touched
+        return sessions
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() - self._last_sweep >= self.sweep_interval:
+                await self.sweep()
+
+    async def flush(self) -> bool:
+        """Write every pending touch; returns False if an update failed"""
+        if self._flush_lock is None:
+            return True
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            groups: dict[float, list] = {}
+            for session_id, touched in pending.items():
+                groups.setdefault(touched // self.resolution, []).append(session_id)
+            ok = True
+            for session_ids in groups.values():
+                when = max(pending[session_id] for session_id in session_ids)
+                try:
+                    await storage.touch_sessions(session_ids, _timestamp(when))
+                    self.written += len(session_ids)
+                    self.updates += 1
+                except Exception as e:
+                    print(f"Session activity flush error: {e}")
+                    self.failures += 1
+                    ok = False
+                    # Retried next flush, unless the session was touched again meanwhile
+                    for session_id in session_ids:
+                        self._pending.setdefault(session_id, pending[session_id])
+            return ok
+
+    async def sweep(self) -> list:
+        """Mark sessions idle for idle_seconds inactive; returns their ids"""
+        self._last_sweep = time.monotonic()
+        if not await self.flush():
+            # Stored activity may be stale, so nothing is safe to expire yet
+            return []
+        cutoff = _timestamp(time.time() - self.idle_seconds)
+        try:
+            expired = await storage.expire_idle_sessions(cutoff)
+        except Exception as e:
+            print(f"Idle session sweep error: {e}")
+            return []
+        self.sweeps += 1
+        self.expired += len(expired)
+        return expired
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "touches": self.touches,
+            "written": self.written,
+            "updates": self.updates,
+            "failures": self.failures,
+            "sweeps": self.sweeps,
+            "expired": self.expired
+        }
+
+
+activity_tracker = ActivityTracker(
+    enabled=os.environ.get(
+        "ACTIVITY_TRACKING", os.environ.get("WRITE_BEHIND", "0" if config.SERVERLESS else "1")
+    ) == "1",
+    flush_interval=float(os.environ.get("ACTIVITY_FLUSH_SECONDS", "60")),
+    idle_seconds=float(os.environ.get("SESSION_IDLE_SECONDS", "1800")),
+    sweep_interval=float(os.environ.get("SESSION_SWEEP_SECONDS", "300"))
+)
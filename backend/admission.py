@@ -0,0 +1,150 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+import metrics
+
+wait_seconds = metrics.registry.histogram(
+    "admission_wait_seconds", "Time requests spent queued for an LLM slot", ("outcome",)
+)
+rejections = metrics.registry.counter(
+    "admission_rejections_total", "Requests turned away by admission control", ("reason",)
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot get an LLM slot; carries the HTTP answer to send"""
+
+    def __init__(self, reason: str, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.reason = reason
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """One admitted request's slot; release() is safe to call more than once"""
+
+    def __init__(self, controller: 'AdmissionController', user: str):
+        self.controller = controller
+        self.user = user
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """Bounds concurrent LLM calls globally and per user, with a short FIFO wait queue.
+
+    A request that finds every slot busy waits in line for at most
+    queue_timeout seconds. When the line is already max_queue long, or the
+    wait runs out, it is rejected straight away with 503 and a Retry-After
+    estimated from recent slot hold times, instead of piling more load on
+    the upstream. A user already holding max_per_user slots (queued ones
+    included) gets 429.
+    """
+
+    def __init__(self, max_concurrent: int = 32, max_per_user: int = 2, max_queue: int = 100,
+                 queue_timeout: float = 5.0):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._per_user: dict[str, int] = {}
+        self._waiters: deque[tuple[asyncio.Future, Ticket]] = deque()
+        # Smoothed time a slot is held, for Retry-After estimates
+        self._hold_seconds = 5.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def _retry_after(self) -> int:
+        waves = (len(self._waiters) + 1) / max(1, self.max_concurrent)
+        return max(1, math.ceil(self._hold_seconds * waves))
+
+    def _reject(self, reason: str, status_code: int, detail: str) -> AdmissionRejected:
+        self.rejected += 1
+        rejections.inc(reason)
+        return AdmissionRejected(reason, status_code, detail, self._retry_after())
+
+    async def acquire(self, user: str) -> Ticket:
+        if self._per_user.get(user, 0) >= self.max_per_user:
+            raise self._reject("user_in_flight", 429, "Too many requests in progress")
+        ticket = Ticket(self, user)
+        if self.active < self.max_concurrent and not self._waiters:
+            self._admit(ticket)
+            wait_seconds.observe(0.0, "admitted")
+            return ticket
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject("queue_full", 503, "Server is busy, please retry shortly")
+
+        self._per_user[user] = self._per_user.get(user, 0) + 1
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, ticket)
+        self._waiters.append(entry)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the wait ended; give it back
+                ticket.release()
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+                self._drop_user(user)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            wait_seconds.observe(time.monotonic() - start, "timeout")
+            raise self._reject("queue_timeout", 503, "Server is busy, please retry shortly")
+        wait_seconds.observe(time.monotonic() - start, "admitted")
+        ticket.admitted_at = time.monotonic()
+        return ticket
+
+    def _admit(self, ticket: Ticket):
+        self.active += 1
+        self.admitted += 1
+        self._per_user[ticket.user] = self._per_user.get(ticket.user, 0) + 1
+
+    def _drop_user(self, user: str):
+        count = self._per_user.get(user, 0) - 1
+        if count > 0:
+            self._per_user[user] = count
+        else:
+            self._per_user.pop(user, None)
+
+    def _release(self, ticket: Ticket):
+        self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.monotonic() - ticket.admitted_at)
+        self.active -= 1
+        self._drop_user(ticket.user)
+        # Hand the slot straight to the longest waiter so nobody can jump the line
+        while self._waiters and self.active < self.max_concurrent:
+            future, _ = self._waiters.popleft()
+            if future.done():
+                continue
+            self.active += 1
+            self.admitted += 1
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "hold_seconds": self._hold_seconds
+        }
+
+
+admission = AdmissionController(
+    max_concurrent=int(os.environ.get("ADMISSION_MAX_CONCURRENT", "32")),
+    max_per_user=int(os.environ.get("ADMISSION_MAX_PER_USER", "2")),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", "100")),
+    queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "5"))
+)
@@ -1,99 +1,176 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
+import config  # noqa: F401  (loads .env before the modules below read settings)
+import hmac
 import os
-from dotenv import load_dotenv
-from datetime import datetime
-import google.generativeai as genai
-from personas import get_persona_prompt, get_all_personas
+import time
+import uuid
+from personas import get_persona_prompt, get_all_personas, get_output_budget
 from rate_limiter import RateLimiter
-from rate_limiter import supabase
-import json
+from request_context import request_context, RequestContext
+from storage import storage
+from history_cache import history_cache
+from persistence import write_behind
+from activity import activity_tracker
+from admission import admission, AdmissionRejected
+from prewarm import prewarmer
+from response_cache import response_cache
+from batch import BatchRunner, ScriptedConversation, TurnRejected
+from export import ENCODERS, ExportFilters, export_pages
+import metrics
+from context import create_assembler, summary_prompt, estimate_tokens
+from llm import (
+    model_registry, chat_pool, llm_breaker, WarmChat, OutputBudget, Deadline, CircuitOpenError,
+    iterate_within, close_stream
+)
+from sse import event_encoder, dumps
+from streams import stream_registry, Generation
+from pagination import (
+    Listing, SESSION_LISTING, CONVERSATION_LISTING, EXPORT_LISTING, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE,
+    fetch_page, iter_rows, ndjson_line
+)
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Optional
 import asyncio
+from contextlib import aclosing
 
 
-# Load environment variables from parent directory
-load_dotenv(dotenv_path="../.env")
-
-# Configure the Gemini API
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable is not set")
-genai.configure(api_key=GEMINI_API_KEY)
-
 # Define the Gemini model to use
 GEMINI_MODEL = "gemini-2.5-flash"
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "60"))
+
+# Per-request model time budget: the first chunk must arrive within
+# LLM_FIRST_TOKEN_TIMEOUT, and the non-streaming retry only runs if at least
+# LLM_FALLBACK_MIN_SECONDS of the deadline are left
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", "15"))
+LLM_FALLBACK_MIN_SECONDS = float(os.getenv("LLM_FALLBACK_MIN_SECONDS", "8"))
+
+# Admin-only endpoints (batch admin mode, bulk export) need X-Admin-Token to match ADMIN_TOKEN
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_BODY_BYTES = int(os.getenv("BATCH_MAX_BODY_BYTES", str(10 * 1024 * 1024)))
+
+
+async def summarize_turns(previous_summary: str, turns: list) -> str:
+    """Fold older turns into a session's rolling summary"""
+    if llm_breaker.rejecting():
+        raise RuntimeError("LLM circuit breaker is open, summary deferred")
+    model = model_registry.get(GEMINI_MODEL)
+    response = await model.generate_content_async(
+        summary_prompt(previous_summary, turns, SUMMARY_MAX_WORDS)
+    )
+    return response.text.strip()
+
+
+context_assembler = create_assembler(summarizer=summarize_turns)
+
+metrics.registry.register_collector("history_cache", history_cache.stats)
+metrics.registry.register_collector("chat_pool", chat_pool.stats)
+metrics.registry.register_collector("context", context_assembler.stats)
+metrics.registry.register_collector("write_behind", write_behind.stats)
+metrics.registry.register_collector("activity", activity_tracker.stats)
+metrics.registry.register_collector("admission", admission.stats)
+metrics.registry.register_collector("llm_breaker", llm_breaker.stats)
+metrics.registry.register_collector("sse", event_encoder.stats)
+metrics.registry.register_collector("streams", stream_registry.stats)
+metrics.registry.register_collector("prewarm", prewarmer.stats)
+metrics.registry.register_collector("response_cache", response_cache.stats)
+metrics.registry.register_collector("storage", storage.stats)
 
 app = FastAPI(title="Persona Chatbot API")
 
 # CORS middleware for local development and deployment
+ALLOWED_ORIGINS = [
+    "https://guardian-ai-git-master-vijaypal-singh-rathores-projects.vercel.app",
+    "http://localhost:3000",
+    "http://localhost:8000",
+    "http://127.0.0.1:8000"
+] # Added localhost:8000 for local development
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "https://guardian-ai-git-master-vijaypal-singh-rathores-projects.vercel.app",
-        "http://localhost:3000",
-        "http://localhost:8000",
-        "http://127.0.0.1:8000"
-    ], # Added localhost:8000 for local development
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["GET", "POST"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 class SessionManager:
     @staticmethod
-    def get_or_create_session(user_id: str, persona: str) -> str:
-        """Get active session or create new one for user and persona"""
-        try:
-            # Check for active session with this persona
-            active_session = supabase.table('chat_sessions').select('*').eq('user_id', user_id).eq('persona', persona).eq('is_active', True).execute()
-            
-            if active_session.data:
-                # Update last activity
-                session_id = active_session.data[0]['id']
-                supabase.table('chat_sessions').update({
-                    'last_activity': datetime.now().isoformat()
-                }).eq('id', session_id).execute()
-                return session_id
-            else:
-                # Deactivate any other active sessions for this user
-                supabase.table('chat_sessions').update({
-                    'is_active': False
-                }).eq('user_id', user_id).eq('is_active', True).execute()
-                
-                # Create new session
-                new_session = {
-                    'user_id': user_id,
-                    'persona': persona,
-                    'is_active': True
-                }
-                result = supabase.table('chat_sessions').insert(new_session).execute()
-                return result.data[0]['id']
-        except Exception as e:
-            print(f"Session manager error: {e}")
-            raise HTTPException(status_code=500, detail="Session management failed")
+    async def adopt_session(context: RequestContext):
+        """Apply the side effects of a session the context resolver found or created"""
+        session_id = context.session_id
+        if not context.session_created:
+            # Update last activity (flushed in bulk by the activity tracker)
+            await activity_tracker.touch(session_id)
+        if context.history is not None:
+            # Turns still queued for writing (or being written) may not be in storage yet
+            turns = write_behind.merge_pending(session_id, context.history)
+            history_cache.seed(session_id, SessionManager.to_history(turns))
     
     @staticmethod
-    def get_user_sessions(user_id: str):
-        """Get all sessions for a user"""
+    def prewarm(context: RequestContext, persona: str):
+        """Start preparing the session's first message in the background"""
+        if chat_pool.has(context.session_id) or not get_persona_prompt(persona):
+            return
+        prewarmer.start(
+            context.session_id, lambda: SessionManager.warm_up(context.session_id, persona)
+        )
+
+    @staticmethod
+    async def warm_up(session_id: str, persona: str):
+        """Load history, the model and a chat primed with the persona context before the first message"""
+        system_prompt = get_persona_prompt(persona)
+        output_budget = get_output_budget(persona)
+        await model_registry.preload()
+        chat_history = await SessionManager.get_session_history(session_id)
+        model = model_registry.get(GEMINI_MODEL, {"max_output_tokens": output_budget["max_output_tokens"]})
+        # Assembled without the message; with no history window to hold it the
+        # persona context becomes the prefix of the first message
+        context = context_assembler.assemble(session_id, system_prompt, chat_history, "", record=False)
+        chat_pool.offer(session_id, WarmChat(
+            model.start_chat(history=context.history),
+            context.metrics.prompt_tokens - estimate_tokens(context.message),
+            prefix=context.message,
+            prewarmed=True
+        ))
+
+    @staticmethod
+    async def get_user_sessions(user_id: str):
+        """Get all sessions for a user, with activity not yet flushed merged in"""
         try:
-            sessions = supabase.table('chat_sessions').select('*').eq('user_id', user_id).order('last_activity', desc=True).execute()
-            return sessions.data
+            return activity_tracker.merge(await storage.list_sessions(user_id))
         except Exception as e:
             print(f"Error getting user sessions: {e}")
             return []
     
     @staticmethod
-    def get_session_history(session_id: str):
-        """Get the conversation history for a session"""
+    def to_history(conversations: list) -> list:
+        """Conversation rows as Gemini chat history"""
+        history = []
+        for conv in conversations:
+            history.append({"role": "user", "parts": [conv['message']]})
+            history.append({"role": "model", "parts": [conv['response']]})
+        return history
+
+    @staticmethod
+    async def load_session_history(session_id: str):
+        """Read the full conversation history for a session, including turns not written yet"""
+        conversations = await storage.list_conversations(session_id, 'id,message,response')
+        return SessionManager.to_history(write_behind.merge_pending(session_id, conversations))
+
+    @staticmethod
+    async def get_session_history(session_id: str):
+        """Get the conversation history for a session, loading it once per cold session"""
         try:
-            conversations = supabase.table('conversations').select('message, response').eq('session_id', session_id).order('created_at').execute()
-            history = []
-            for conv in conversations.data:
-                history.append({"role": "user", "parts": [conv['message']]})
-                history.append({"role": "model", "parts": [conv['response']]})
-            return history
+            with metrics.span("history_load"):
+                return await history_cache.get_or_load(
+                    session_id, lambda: SessionManager.load_session_history(session_id)
+                )
         except Exception as e:
             print(f"Error getting session history: {e}")
             return []
@@ -107,181 +184,685 @@ async def read_root():
 async def get_personas():
     return get_all_personas()
 
-# This is the updated chat endpoint to use GET with query parameters
-@app.get("/chat")
-async def chat_with_persona(
-    message: str = Query(..., min_length=1),
-    persona: str = Query(..., min_length=1),
-    username: str = Query(..., min_length=1)
-):
-    # Rate limiting check
-    can_proceed, remaining = RateLimiter.check_and_update_user_limits(username)
+def resumable_response(generation: Generation, after: int = 0, resumed: bool = False):
+    """SSE response following a generation from the event after `after`"""
+    return StreamingResponse(
+        event_encoder.encode(stream_registry.attach(generation, after, resumed)),
+        media_type="text/event-stream"
+    )
+
+@dataclass
+class ChatConnection:
+    """What a WebSocket connection resolved once and keeps for its lifetime"""
+    username: str
+    persona: Optional[str] = None
+    user_id: Optional[str] = None
+    session_id: Optional[str] = None
+    remaining_messages: int = 0
+    # Set from a message frame until its reply's final frame goes out
+    replying: bool = False
+    # The reply this connection is streaming, for cancellation
+    generation: Optional[Generation] = None
+    # Set once the socket is going away, so nothing more is sent on it
+    closing: bool = False
+
+    async def select(self, persona: str):
+        """Resolve (creating if needed) the user and their session with persona"""
+        if not get_persona_prompt(persona):
+            raise HTTPException(status_code=400, detail="Invalid persona")
+        context = await request_context.resolve(self.username, persona, create_user=True, want_history=True)
+        if context.user_id is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        await SessionManager.adopt_session(context)
+        SessionManager.prewarm(context, persona)
+        self.persona = persona
+        self.user_id = context.user_id
+        self.session_id = context.session_id
+        self.remaining_messages = context.remaining_messages
+
+async def open_turn(
+    username: str,
+    persona: str,
+    message: str,
+    request_id: Optional[str] = None,
+    last_event_id: Optional[str] = None,
+    connection: Optional[ChatConnection] = None
+) -> tuple[Generation, int, bool]:
+    """Start (or find, for a retry) the reply to one chat message.
+
+    Returns the generation, the event id to follow it from and whether it
+    was resumed. Without a connection the user, session and history are
+    resolved for this request; an open connection already holds them, so
+    only the message is counted. Raises HTTPException when the turn cannot
+    start.
+    """
+    request_start = time.perf_counter()
+    
+    # An unknown persona must not count against the user's limits
+    system_prompt = get_persona_prompt(persona)
+    if not system_prompt:
+        raise HTTPException(status_code=400, detail="Invalid persona")
+    
+    # A reconnect (EventSource resends the same URL plus Last-Event-ID) resumes
+    # the reply that is running or just finished instead of starting another
+    stream_key = f"{username}:{request_id or uuid.uuid4()}"
+    generation = stream_registry.get(stream_key)
+    if generation is not None:
+        after = int(last_event_id) if last_event_id and last_event_id.isdigit() else 0
+        return generation, after, True
     
-    if not can_proceed:
-        raise HTTPException(status_code=429, detail="Daily message limit exceeded")
+    # Fail fast while the model is known to be down
+    if llm_breaker.rejecting():
+        raise HTTPException(
+            status_code=503, detail="AI service unavailable", headers={"Retry-After": str(llm_breaker.retry_after())}
+        )
     
+    generation = stream_registry.reserve(stream_key)
+    # The idempotency key is charged against the limits at most once
+    already_charged = stream_registry.was_charged(stream_key)
+    
+    # Shed load before any storage or model work once every LLM slot is taken
     try:
-        # Get user ID
-        user_data = supabase.table('users').select('id').eq('username', username).execute()
-        if not user_data.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = user_data.data[0]['id']
-        
-        # Get or create session
-        session_id = SessionManager.get_or_create_session(user_id, persona)
-        
-        # Get persona system prompt and session history
-        system_prompt = get_persona_prompt(persona)
-        if not system_prompt:
-            raise HTTPException(status_code=400, detail="Invalid persona")
+        ticket = await admission.acquire(username)
+    except AdmissionRejected as e:
+        stream_registry.discard(generation, e.detail)
+        raise HTTPException(
+            status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    def abort_setup(reason: str):
+        """Undo the slot and the reservation when the reply cannot be started"""
+        ticket.release()
+        stream_registry.discard(generation, reason)
+    
+    # User, rate limit (messages and prompt tokens), session and recent history in one round trip
+    try:
+        with metrics.span("resolve_context", persona):
+            if connection is None:
+                context = await request_context.resolve(
+                    username,
+                    persona,
+                    tokens=len(message.split()),
+                    count_message=not already_charged,
+                    create_user=True,
+                    want_history=True
+                )
+            else:
+                context = await request_context.count_turn(
+                    username, tokens=len(message.split()), count_message=not already_charged
+                )
+    except Exception as e:
+        print(f"Request context error: {e}")
+        abort_setup("Internal server error")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    except asyncio.CancelledError:
+        abort_setup("Cancelled")
+        raise
+    
+    remaining = context.remaining_messages
+    if not context.allowed:
+        detail = "Daily message limit exceeded" if remaining == 0 else "Daily token limit exceeded"
+        abort_setup(detail)
+        raise HTTPException(status_code=429, detail=detail)
+    stream_registry.mark_charged(stream_key)
+    
+    try:
+        if connection is None:
+            user_id = context.user_id
+            session_id = context.session_id
+            await SessionManager.adopt_session(context)
+        else:
+            user_id = connection.user_id
+            session_id = connection.session_id
+            connection.remaining_messages = remaining
+            # Update last activity (flushed in bulk by the activity tracker)
+            await activity_tracker.touch(session_id)
+        generation = await start_reply(
+            generation, ticket, username, persona, system_prompt, message, user_id, session_id,
+            remaining, request_start
+        )
+        return generation, 0, False
+    except HTTPException as e:
+        abort_setup(e.detail)
+        raise
+    except asyncio.CancelledError:
+        abort_setup("Cancelled")
+        raise
+    except Exception as e:
+        print(f"Chat error: {e}")
+        abort_setup("Internal server error")
+        raise HTTPException(status_code=500, detail="Internal server error")
 
+async def start_reply(
+    generation: Generation,
+    ticket,
+    username: str,
+    persona: str,
+    system_prompt: str,
+    message: str,
+    user_id: str,
+    session_id: str,
+    remaining: int,
+    request_start: float,
+    persist: bool = True,
+    charge: bool = True
+) -> Generation:
+    """Call the model for a turn whose limits and session are settled, running its events in generation.
+
+    Batch evaluation turns pass persist=False, which keeps the turn in memory
+    only and leaves the response cache alone, and charge=False in admin mode.
+    """
+    # Reply length limits: a hard token cap for the model, a word cap for the stream
+    output_budget = get_output_budget(persona)
+    budget = OutputBudget(output_budget["max_words"])
+    
+    # A warm-up started at persona selection is already doing this setup
+    await prewarmer.wait(session_id)
+    # Follow-ups go straight to the warm chat while it still fits the token budget
+    warm = chat_pool.checkout(session_id)
+    if warm is not None and warm.fits(message, context_assembler.token_budget):
+        warm_path = "prewarmed" if warm.prewarmed else "warm"
+        contextual_message = warm.prefix + message
+        prompt_tokens = warm.tokens + estimate_tokens(contextual_message)
+    else:
+        warm_path = "cold"
         # Get conversation history for the current session
-        chat_history = SessionManager.get_session_history(session_id)
+        chat_history = await SessionManager.get_session_history(session_id)
         
-        # Initialize a Gemini model without system_instruction (for compatibility)
-        model = genai.GenerativeModel(model_name=GEMINI_MODEL)
-        
-        # Prepare the message with context
-        if not chat_history:
-            # First message - include system prompt as context
-            contextual_message = f"System Context: {system_prompt}\n\nUser: {message}"
-            chat_history = []
-        else:
-            # Subsequent messages use existing context
-            contextual_message = message
+        # Reuse the process-wide model (no system_instruction, for compatibility)
+        model = model_registry.get(
+            GEMINI_MODEL, {"max_output_tokens": output_budget["max_output_tokens"]}
+        )
         
-        # Start a chat session with the existing history
-        chat_session = model.start_chat(history=chat_history)
+        # Fit the system prompt, a rolling summary and the newest turns into the token budget
+        with metrics.span("context_assembly", persona):
+            context = context_assembler.assemble(session_id, system_prompt, chat_history, message)
+        contextual_message = context.message
+        prompt_tokens = context.metrics.prompt_tokens
         
-        # Send message and get streaming response
+        # Start a chat session with the budgeted history
+        warm = WarmChat(
+            model.start_chat(history=context.history),
+            prompt_tokens - estimate_tokens(contextual_message)
+        )
+    chat_session = warm.chat
+    
+    async def finish_turn(full_response_text: str) -> dict:
+        """Persist the finished turn, keep the chat warm and build the complete event"""
+        # After streaming is complete, calculate token count (simplified)
+        token_count = len(contextual_message.split()) + len(full_response_text.split())
+
+        # Store conversation in the database
+        conversation_data = {
+            'user_id': user_id,
+            'session_id': session_id,
+            'persona': persona,
+            'message': message,
+            'response': full_response_text,
+            'token_count': token_count
+        }
+        with metrics.span("persist", persona):
+            if persist:
+                # Queued for a batched write so the complete event does not wait on storage
+                await write_behind.add_conversation(conversation_data)
+            history_cache.append(session_id, message, full_response_text)
+            # Keep the chat warm for the next message in this session
+            warm.commit_turn(contextual_message, full_response_text)
+            chat_pool.checkin(session_id, warm)
+            if charge:
+                await RateLimiter.record_tokens(username, len(full_response_text.split()))
+        metrics.observe_stage("chat_total", time.perf_counter() - request_start, persona)
+
+        # The text already went out in chunks; the final event only carries metadata
+        return {
+            "persona": persona,
+            "token_count": token_count,
+            "remaining_messages": remaining,
+            "session_id": session_id,
+            "prompt_tokens": prompt_tokens,
+            "type": "complete"
+        }
+    
+    # A session's opening message ("hi", "kaisi ho") may already have cached replies
+    cache_key = response_cache.key(persona, message) if persist and not warm.contents else None
+    cached_chunks = response_cache.lookup(cache_key) if cache_key is not None else None
+    if cached_chunks is not None:
+        metrics.chat_first_token_seconds.observe(time.perf_counter() - request_start, "cached")
+
+        async def replay_response():
+            for chunk_text in cached_chunks:
+                yield {'response': chunk_text, 'type': 'chunk'}
+            yield await finish_turn("".join(cached_chunks))
+
+        return stream_registry.start(generation, replay_response(), on_done=ticket.release)
+    
+    # Send message and get streaming response, all within the request's deadline
+    deadline = Deadline(LLM_DEADLINE_SECONDS)
+    try:
+        llm_breaker.allow()
+        # The SDK returns once the first chunk has arrived
+        with metrics.span("llm_first_token", persona):
+            response_stream = await asyncio.wait_for(
+                chat_session.send_message_async(contextual_message, stream=True),
+                timeout=deadline.budget(LLM_FIRST_TOKEN_TIMEOUT)
+            )
+        llm_breaker.record_success()
+        metrics.chat_first_token_seconds.observe(time.perf_counter() - request_start, warm_path)
+    except asyncio.CancelledError:
+        # The client went away mid-call; the breaker learned nothing about the model
+        llm_breaker.abandon()
+        raise
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503, detail="AI service unavailable", headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as api_error:
+        llm_breaker.record_failure()
+        # Retrying without streaming only helps if there is time left and the model is not down
+        if deadline.remaining() < LLM_FALLBACK_MIN_SECONDS or llm_breaker.rejecting():
+            print(f"Streaming failed, not enough deadline left to retry: {api_error!r}")
+            raise HTTPException(
+                status_code=503, detail="AI service unavailable",
+                headers={"Retry-After": str(llm_breaker.retry_after() if llm_breaker.rejecting() else 1)}
+            )
+        print(f"Streaming failed, trying non-streaming: {api_error!r}")
+        # Fallback to non-streaming if streaming fails
         try:
-            response_stream = chat_session.send_message(
-                contextual_message, 
-                stream=True
+            llm_breaker.allow()
+            response = await asyncio.wait_for(
+                chat_session.send_message_async(contextual_message), timeout=deadline.remaining()
             )
-        except Exception as api_error:
-            print(f"Streaming failed, trying non-streaming: {api_error}")
-            # Fallback to non-streaming if streaming fails
-            try:
-                response = chat_session.send_message(contextual_message)
-                if response.text:
-                    # Create a simple response for non-streaming
-                    def simple_response():
-                        response_text = response.text
-                        # Apply simple token limit for casual friend chat
-                        words = response_text.split()
-                        if len(words) > 30:
-                            response_text = ' '.join(words[:30]) + "..."
-                        
-                        yield f"data: {json.dumps({'response': response_text, 'type': 'chunk'})}\n\n"
-                        
-                        final_data = {
-                            "response": response_text,
-                            "persona": persona,
-                            "token_count": len(words[:30]),
-                            "remaining_messages": remaining,
-                            "session_id": session_id,
-                            "type": "complete"
-                        }
-                        yield f"data: {json.dumps(final_data)}\n\n"
+            llm_breaker.record_success()
+            if response.text:
+                # Create a simple response for non-streaming
+                async def simple_response():
+                    # Apply the persona's word limit for casual friend chat
+                    response_text = budget.take(response.text)
+                    if budget.exhausted and response_text != response.text.rstrip():
+                        response_text += "..."
                     
-                    return StreamingResponse(simple_response(), media_type="text/event-stream")
-                else:
-                    raise HTTPException(status_code=500, detail="No response from AI service")
-            except Exception as fallback_error:
-                print(f"Both streaming and non-streaming failed: {fallback_error}")
-                raise HTTPException(status_code=500, detail=f"AI service error: {str(fallback_error)}")
-        
-        def stream_response():
-            full_response_text = ""
+                    yield {'response': response_text, 'type': 'chunk'}
+                    
+                    final_data = {
+                        "persona": persona,
+                        "token_count": budget.words,
+                        "remaining_messages": remaining,
+                        "session_id": session_id,
+                        "prompt_tokens": prompt_tokens,
+                        "type": "complete"
+                    }
+                    yield final_data
+                
+                return stream_registry.start(generation, simple_response(), on_done=ticket.release)
+            else:
+                raise HTTPException(status_code=500, detail="No response from AI service")
+        except asyncio.CancelledError:
+            llm_breaker.abandon()
+            raise
+        except CircuitOpenError as e:
+            raise HTTPException(
+                status_code=503, detail="AI service unavailable", headers={"Retry-After": str(e.retry_after)}
+            )
+        except HTTPException:
+            raise
+        except Exception as fallback_error:
+            llm_breaker.record_failure()
+            print(f"Both streaming and non-streaming failed: {fallback_error!r}")
+            raise HTTPException(status_code=500, detail=f"AI service error: {str(fallback_error)}")
+    
+    async def stream_response():
+        full_response_text = ""
+        response_parts = []
+        stream_start = time.perf_counter()
+        upstream_done = False
+        try:
+            chunk_count = 0
+            # Cancelling the upstream call when the client disconnects
+            # (Starlette cancels this generator) stops the generation
+            chunks = aiter(response_stream)
             try:
-                chunk_count = 0
-                for chunk in response_stream:
+                async for chunk in iterate_within(deadline, chunks):
                     chunk_count += 1
                     try:
                         if chunk.text:
-                            chunk_text = chunk.text
-                            full_response_text += chunk_text
-                            
-                            # Simple token limit check for casual friend chat
-                            if len(full_response_text.split()) >= 30:
-                                # Truncate if approaching limit for casual chat
-                                words = full_response_text.split()[:30]
-                                full_response_text = ' '.join(words)
-                                chunk_text = chunk_text[:len(chunk_text)//2]  # Reduce current chunk
-                            
-                            yield f"data: {json.dumps({'response': chunk_text, 'type': 'chunk'})}\n\n"
+                            # Count words as they arrive and cut at the persona's limit
+                            chunk_text = budget.take(chunk.text)
+                            response_parts.append(chunk_text)
+                            yield {'response': chunk_text, 'type': 'chunk'}
                     except (IndexError, AttributeError) as chunk_error:
                         # Handle chunk parsing errors gracefully
                         print(f"Chunk parsing error: {chunk_error}")
                         continue
-                
-                # If no chunks were received, it might be an empty response
-                if chunk_count == 0:
-                    fallback_response = "I'm here to help! Could you please rephrase your question?"
-                    full_response_text = fallback_response
-                    yield f"data: {json.dumps({'response': fallback_response, 'type': 'chunk'})}\n\n"
-
-                # After streaming is complete, calculate token count (simplified)
-                token_count = len(contextual_message.split()) + len(full_response_text.split())
-
-                # Store conversation in the database
-                conversation_data = {
-                    'user_id': user_id,
-                    'session_id': session_id,
-                    'persona': persona,
-                    'message': message,
-                    'response': full_response_text,
-                    'token_count': token_count
-                }
-                supabase.table('conversations').insert(conversation_data).execute()
+                    if budget.exhausted:
+                        # Leaving the loop cancels the upstream call, so
+                        # generation (and billing) stops here
+                        break
+            finally:
+                await close_stream(response_stream, chunks)
+            # The upstream call is over; let the next request have the slot
+            upstream_done = True
+            ticket.release()
+            full_response_text = "".join(response_parts)
+            metrics.observe_stage("llm_stream", time.perf_counter() - stream_start, persona)
+            
+            # If no chunks were received, it might be an empty response
+            if chunk_count == 0:
+                fallback_response = "I'm here to help! Could you please rephrase your question?"
+                full_response_text = fallback_response
+                yield {'response': fallback_response, 'type': 'chunk'}
+            elif cache_key is not None:
+                response_cache.store(cache_key, response_parts)
 
-                # Send a final message with the full response details
+            yield await finish_turn(full_response_text)
+            
+        except StopAsyncIteration:
+            print("StopAsyncIteration error - empty response from Gemini API")
+            # Handle empty response gracefully
+            if not full_response_text:
+                fallback_response = "I apologize, but I'm having trouble generating a response right now. Please try again."
+                full_response_text = fallback_response
+                yield {'response': fallback_response, 'type': 'chunk'}
+                
+                # Send final data with fallback
                 final_data = {
-                    "response": full_response_text,
                     "persona": persona,
-                    "token_count": token_count,
+                    "token_count": len(full_response_text.split()),
                     "remaining_messages": remaining,
                     "session_id": session_id,
+                    "prompt_tokens": prompt_tokens,
                     "type": "complete"
                 }
-                yield f"data: {json.dumps(final_data)}\n\n"
+                yield final_data
                 
-            except StopIteration:
-                print("StopIteration error - empty response from Gemini API")
-                # Handle empty response gracefully
-                if not full_response_text:
-                    fallback_response = "I apologize, but I'm having trouble generating a response right now. Please try again."
-                    full_response_text = fallback_response
-                    yield f"data: {json.dumps({'response': fallback_response, 'type': 'chunk'})}\n\n"
-                    
-                    # Send final data with fallback
-                    final_data = {
-                        "response": full_response_text,
-                        "persona": persona,
-                        "token_count": len(full_response_text.split()),
-                        "remaining_messages": remaining,
-                        "session_id": session_id,
-                        "type": "complete"
-                    }
-                    yield f"data: {json.dumps(final_data)}\n\n"
-                    
-            except Exception as e:
-                print(f"Streaming error: {e}")
-                import traceback
-                traceback.print_exc()
-                error_data = {
-                    "error": f"Response generation failed: {str(e)}",
-                    "type": "error"
-                }
-                yield f"data: {json.dumps(error_data)}\n\n"
+        except Exception as e:
+            if not upstream_done:
+                llm_breaker.record_failure()
+            print(f"Streaming error: {e!r}")
+            import traceback
+            traceback.print_exc()
+            error_data = {
+                "error": f"Response generation failed: {str(e)}",
+                "type": "error"
+            }
+            yield error_data
+
+    # The reply runs detached from this connection so a reconnect can pick it up
+    return stream_registry.start(generation, stream_response(), on_done=ticket.release)
+
+# This is the updated chat endpoint to use GET with query parameters
+@app.get("/chat")
+async def chat_with_persona(
+    message: str = Query(..., min_length=1),
+    persona: str = Query(..., min_length=1),
+    username: str = Query(..., min_length=1),
+    request_id: Optional[str] = Query(None, max_length=64),
+    last_event_id: Optional[str] = Header(None)
+):
+    generation, after, resumed = await open_turn(username, persona, message, request_id, last_event_id)
+    return resumable_response(generation, after, resumed)
+
+async def relay_reply(websocket: WebSocket, connection: ChatConnection, frame: dict):
+    """Run one message frame's turn and send its events to the socket"""
+    request_id = str(frame.get('request_id') or uuid.uuid4())[:64]
 
-        return StreamingResponse(stream_response(), media_type="text/event-stream")
+    async def send_final(event: dict):
+        # The client may send its next message as soon as it sees this frame
+        connection.replying = False
+        connection.generation = None
+        await websocket.send_text(dumps({**event, "request_id": request_id}).decode())
 
+    try:
+        message = frame.get('message')
+        if not isinstance(message, str) or not message.strip():
+            await send_final({"type": "error", "status": 400, "error": "Message required"})
+            return
+        last_event_id = frame.get('last_event_id')
+        try:
+            generation, after, resumed = await open_turn(
+                connection.username, connection.persona, message, request_id,
+                str(last_event_id) if last_event_id is not None else None, connection
+            )
+        except HTTPException as e:
+            error = {"type": "error", "status": e.status_code, "error": e.detail}
+            if e.headers and "Retry-After" in e.headers:
+                error["retry_after"] = int(e.headers["Retry-After"])
+            await send_final(error)
+            return
+
+        connection.generation = generation
+        async with aclosing(event_encoder.coalesce(stream_registry.attach(generation, after, resumed))) as events:
+            async for item in events:
+                if item is None:
+                    # The WebSocket layer has its own pings
+                    continue
+                event_id, event = item
+                if event.get('type') in ('complete', 'error'):
+                    await send_final({**event, "id": event_id})
+                    return
+                await websocket.send_text(dumps({**event, "id": event_id, "request_id": request_id}).decode())
+        await send_final({"type": "cancelled"})
+    except asyncio.CancelledError:
+        # Cancelled before the reply started (admission, prewarm or first-token
+        # wait); the client still needs a final frame to unblock its next send
+        if not connection.closing:
+            await send_final({"type": "cancelled"})
+        raise
+    finally:
+        connection.replying = False
+        connection.generation = None
+
+@app.websocket("/ws/chat")
+async def chat_socket(
+    websocket: WebSocket,
+    username: str = Query(..., min_length=1),
+    persona: str = Query(..., min_length=1)
+):
+    """Multi-turn chat over one connection.
+
+    The user and session are resolved once on connect, so each message only
+    counts against the limits before going to the model. Client frames:
+    {"type": "message", "message", "request_id", "last_event_id"?} starts a
+    reply (or resumes one after a reconnect), {"type": "cancel"} stops the
+    reply in flight and {"type": "persona", "persona"} switches persona.
+    Server frames are the /chat events plus "id" and "request_id", and
+    "ready", "cancelled" and "error" frames.
+    """
+    # Browsers do not apply CORS to WebSockets, so check the origin here
+    origin = websocket.headers.get("origin")
+    if origin is not None and origin not in ALLOWED_ORIGINS:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    connection = ChatConnection(username)
+    reply: Optional[asyncio.Task] = None
+
+    async def select(persona: str) -> bool:
+        try:
+            await connection.select(persona)
+        except HTTPException as e:
+            await websocket.send_json({"type": "error", "status": e.status_code, "error": e.detail})
+            return False
+        except Exception as e:
+            print(f"WebSocket persona selection error: {e}")
+            await websocket.send_json({"type": "error", "status": 500, "error": "Failed to select persona"})
+            return False
+        await websocket.send_json({
+            "type": "ready",
+            "persona": connection.persona,
+            "session_id": connection.session_id,
+            "remaining_messages": connection.remaining_messages
+        })
+        return True
+
+    def cancel_reply():
+        if connection.generation is not None and connection.generation.task is not None:
+            # Stops the upstream call; the relay then reports the reply as cancelled
+            connection.generation.task.cancel()
+        elif reply is not None and not reply.done():
+            # Still waiting for a slot or the limits
+            reply.cancel()
+
+    try:
+        if not await select(persona):
+            await websocket.close(code=1008)
+            return
+        while True:
+            frame = await websocket.receive_json()
+            kind = frame.get('type') if isinstance(frame, dict) else None
+            if kind == 'message':
+                if connection.replying:
+                    await websocket.send_json({
+                        "type": "error", "status": 409, "error": "A reply is already in progress",
+                        "request_id": frame.get('request_id')
+                    })
+                    continue
+                connection.replying = True
+                reply = asyncio.create_task(relay_reply(websocket, connection, frame))
+            elif kind == 'cancel':
+                cancel_reply()
+            elif kind == 'persona':
+                cancel_reply()
+                await select(str(frame.get('persona') or ''))
+            else:
+                await websocket.send_json({"type": "error", "status": 400, "error": "Unknown frame type"})
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        print(f"Chat error: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+        print(f"WebSocket error: {e}")
+    finally:
+        connection.closing = True
+        # A reply left running can still be resumed by request_id until the registry gives up on it
+        if reply is not None and not reply.done():
+            reply.cancel()
+
+def batch_runner(username: str, admin: bool, concurrency: int) -> BatchRunner:
+    """A runner whose turns take the normal reply path, counted against username unless admin.
+
+    Each conversation gets a session that only exists in this process's
+    history cache and chat pool, so nothing is read from or written to
+    storage for it; both are dropped when the conversation ends.
+    """
+    run_id = uuid.uuid4().hex[:12]
+    if not admin:
+        # A user's turns share the per-user admission cap like their /chat messages
+        concurrency = min(concurrency, admission.max_per_user)
+
+    def session_of(conversation: ScriptedConversation) -> str:
+        return f"batch-{run_id}-{conversation.line}"
+
+    async def run_turn(conversation: ScriptedConversation, index: int) -> AsyncIterator[dict]:
+        request_start = time.perf_counter()
+        session_id = session_of(conversation)
+        message = conversation.turns[index]
+        if index == 0:
+            history_cache.put(session_id, [])
+        if llm_breaker.rejecting():
+            raise TurnRejected(503, "AI service unavailable", llm_breaker.retry_after(), retryable=True)
+
+        generation = stream_registry.reserve(f"{session_id}:{index}")
+        try:
+            # Admin conversations only share the global slots; a user's count against their own cap
+            ticket = await admission.acquire(session_id if admin else username)
+        except AdmissionRejected as e:
+            stream_registry.discard(generation, e.detail)
+            raise TurnRejected(e.status_code, e.detail, e.retry_after, retryable=True)
+
+        def abort_setup(reason: str):
+            ticket.release()
+            stream_registry.discard(generation, reason)
+
+        try:
+            remaining = 0
+            if not admin:
+                context = await request_context.count_turn(username, tokens=len(message.split()))
+                remaining = context.remaining_messages
+                if not context.allowed:
+                    raise TurnRejected(
+                        429, "Daily message limit exceeded" if remaining == 0 else "Daily token limit exceeded"
+                    )
+            generation = await start_reply(
+                generation, ticket, username, conversation.persona, get_persona_prompt(conversation.persona),
+                message, username, session_id, remaining, request_start, persist=False, charge=not admin
+            )
+        except TurnRejected as e:
+            abort_setup(e.detail)
+            raise
+        except HTTPException as e:
+            abort_setup(e.detail)
+            retry_after = int((e.headers or {}).get("Retry-After", 1))
+            raise TurnRejected(e.status_code, e.detail, retry_after, retryable=e.status_code == 503)
+        except asyncio.CancelledError:
+            abort_setup("Cancelled")
+            raise
+        except Exception as e:
+            print(f"Batch turn error: {e}")
+            abort_setup("Internal server error")
+            raise TurnRejected(500, "Internal server error")
+
+        async def events():
+            async for _, event in stream_registry.attach(generation):
+                yield event
+        return events()
+
+    def forget(conversation: ScriptedConversation):
+        session_id = session_of(conversation)
+        chat_pool.invalidate(session_id)
+        history_cache.invalidate(session_id)
+        context_assembler.forget(session_id)
+
+    return BatchRunner(run_turn, concurrency, on_conversation_done=forget)
+
+def require_admin(token: Optional[str]):
+    """Answer 403 unless the token matches ADMIN_TOKEN; admin access is off while it is empty"""
+    if not (token and ADMIN_TOKEN and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/batch/conversations")
+async def run_batch(
+    request: Request,
+    username: str = Query(..., min_length=1),
+    concurrency: int = Query(4, ge=1),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Run a JSONL body of scripted conversations and stream the results back as JSONL.
+
+    Every turn is counted against username's daily limits like a /chat
+    message, and runs at most the per-user admission cap at a time. With a
+    valid X-Admin-Token the limiter is bypassed and up to
+    BATCH_MAX_CONCURRENCY conversations run at once.
+    """
+    admin = x_admin_token is not None
+    if admin:
+        require_admin(x_admin_token)
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > BATCH_MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail="Batch too large")
+    try:
+        lines = body.decode().splitlines()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Batch must be UTF-8 JSONL")
+
+    concurrency = min(concurrency, BATCH_MAX_CONCURRENCY)
+    if not admin:
+        try:
+            user = await storage.get_user(username, 'id')
+        except Exception as e:
+            print(f"Batch user lookup error: {e}")
+            raise HTTPException(status_code=500, detail="Internal server error")
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+
+    async def results():
+        try:
+            async for record in batch_runner(username, admin, concurrency).run(lines):
+                yield ndjson_line(record)
+        except Exception as e:
+            print(f"Batch stream error: {e}")
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 @app.post("/persona/select")
 async def select_persona(data: dict):
@@ -293,66 +874,205 @@ async def select_persona(data: dict):
         raise HTTPException(status_code=400, detail="Username and persona required")
     
     try:
-        # Get user
-        user_data = supabase.table('users').select('id').eq('username', username).execute()
-        if not user_data.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = user_data.data[0]['id']
-        
-        # Create/get session
-        session_id = SessionManager.get_or_create_session(user_id, persona)
-        
-        return {
-            "success": True,
-            "session_id": session_id,
-            "persona": persona,
-            "message": f"Selected persona: {persona}"
-        }
-        
+        # Created like on a first /chat, so a new user's first message is prewarmed too; the
+        # session's recent history comes back in the same round trip
+        context = await request_context.resolve(username, persona, create_user=True, want_history=True)
     except Exception as e:
         print(f"Persona selection error: {e}")
         raise HTTPException(status_code=500, detail="Failed to select persona")
+    if context.user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    await SessionManager.adopt_session(context)
+    SessionManager.prewarm(context, persona)
+    
+    return {
+        "success": True,
+        "session_id": context.session_id,
+        "persona": persona,
+        "message": f"Selected persona: {persona}"
+    }
 
 @app.get("/user/{username}/stats")
 async def get_user_stats(username: str):
-    remaining = RateLimiter.get_remaining_messages(username)
+    try:
+        context = await request_context.resolve(username)
+        remaining, remaining_tokens = context.remaining_messages, context.remaining_tokens
+    except Exception as e:
+        print(f"Stats lookup error: {e}")
+        remaining, remaining_tokens = 0, 0
     return {
         "remaining_messages": remaining,
-        "daily_limit": RateLimiter.DAILY_MESSAGE_LIMIT
+        "daily_limit": RateLimiter.DAILY_MESSAGE_LIMIT,
+        "remaining_tokens": remaining_tokens,
+        "daily_token_limit": RateLimiter.TOKEN_LIMIT
     }
 
+def parse_listing_params(listing: Listing, fields: Optional[str], cursor: Optional[str]):
+    """Validate projection and cursor query parameters, answering 400 when they are malformed"""
+    try:
+        return listing.parse_fields(fields), listing.decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def stream_ndjson(rows, fields: list, extra_rows: Callable[[], list] = lambda: []):
+    """Emit each row as one JSON line as soon as its page arrives"""
+    async def lines():
+        try:
+            async for row in rows:
+                yield ndjson_line(Listing.project(row, fields))
+            for row in extra_rows():
+                yield ndjson_line(Listing.project(row, fields))
+        except Exception as e:
+            print(f"Listing stream error: {e}")
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.get("/user/{username}/sessions")
-async def get_user_chat_sessions(username: str):
-    """Get all chat sessions for a user"""
+async def get_user_chat_sessions(
+    username: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
+    """List a user's chat sessions, newest first, one keyset page at a time"""
+    fields, after = parse_listing_params(SESSION_LISTING, fields, cursor)
+    columns = SESSION_LISTING.select_columns(fields)
     try:
-        user_data = supabase.table('users').select('id').eq('username', username).execute()
-        if not user_data.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        user_id = user_data.data[0]['id']
-        sessions = SessionManager.get_user_sessions(user_id)
-        
-        return {
-            "sessions": sessions,
-            "total_sessions": len(sessions)
-        }
+        user = await storage.get_user(username, 'id')
     except Exception as e:
         print(f"Error getting sessions: {e}")
         raise HTTPException(status_code=500, detail="Failed to get sessions")
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    async def fetch(after, page_limit):
+        return await storage.list_sessions_page(user['id'], columns, page_limit, after)
+
+    # Pages and cursors follow the stored activity; the rows show touches not flushed yet
+    if format == "ndjson":
+        async def merged_rows():
+            async for row in iter_rows(SESSION_LISTING, fetch, after):
+                yield activity_tracker.merge([row])[0]
+        return stream_ndjson(merged_rows(), fields)
+    try:
+        sessions, next_cursor = await fetch_page(SESSION_LISTING, fetch, after, limit)
+    except Exception as e:
+        print(f"Error getting sessions: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get sessions")
+    activity_tracker.merge(sessions)
+    return {
+        "sessions": [Listing.project(row, fields) for row in sessions],
+        "count": len(sessions),
+        "next_cursor": next_cursor
+    }
 
 @app.get("/session/{session_id}/conversations")
-async def get_session_conversations(session_id: str):
-    """Get all conversations for a specific session"""
+async def get_session_conversations(
+    session_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
+    """List a session's conversations, oldest first, one keyset page at a time"""
+    fields, after = parse_listing_params(CONVERSATION_LISTING, fields, cursor)
+    columns = CONVERSATION_LISTING.select_columns(fields)
+
+    async def fetch(after, page_limit):
+        return await storage.list_conversations_page(session_id, columns, page_limit, after)
+
+    # Turns still in the write-behind queue come after everything stored
+    if format == "ndjson":
+        # Rows of a batch being inserted can be read from storage before the queue lets go of them
+        streamed_in_flight = []
+
+        async def stored_rows():
+            async for row in iter_rows(CONVERSATION_LISTING, fetch, after):
+                if write_behind.in_flight(row['id']):
+                    streamed_in_flight.append(row)
+                yield row
+        return stream_ndjson(
+            stored_rows(), fields,
+            lambda: write_behind.merge_pending(session_id, streamed_in_flight)[len(streamed_in_flight):]
+        )
     try:
-        conversations = supabase.table('conversations').select('*').eq('session_id', session_id).order('created_at').execute()
-        return {
-            "conversations": conversations.data,
-            "total_messages": len(conversations.data)
-        }
+        conversations, next_cursor = await fetch_page(CONVERSATION_LISTING, fetch, after, limit)
     except Exception as e:
         print(f"Error getting conversations: {e}")
         raise HTTPException(status_code=500, detail="Failed to get conversations")
+    if next_cursor is None:
+        conversations = write_behind.merge_pending(session_id, conversations)
+    return {
+        "conversations": [Listing.project(row, fields) for row in conversations],
+        "count": len(conversations),
+        "next_cursor": next_cursor
+    }
+
+@app.get("/export/conversations")
+async def export_conversations(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    username: Optional[str] = None,
+    persona: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    header: bool = True,
+    checkpoints: bool = False,
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Stream every conversation matching the filters, oldest first, as NDJSON or gzip CSV.
+
+    Rows are read in keyset pages of EXPORT_PAGE_SIZE and encoded a page at a
+    time. With checkpoints=1 an NDJSON export adds a {"checkpoint": cursor}
+    line after each page; passing the last one back as cursor resumes the
+    export after it (use header=0 to continue a CSV file).
+    """
+    require_admin(x_admin_token)
+    fields, after = parse_listing_params(EXPORT_LISTING, fields, cursor)
+    try:
+        filters = ExportFilters.parse(username, persona, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    encoder = ENCODERS[format](fields, header=header)
+    pages = export_pages(filters, fields, after, encoder)
+    # The first page is read before answering, so an unknown user or a storage error gets a status
+    try:
+        first = await anext(pages, None)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="User not found")
+    except Exception as e:
+        print(f"Export error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to export conversations")
+
+    async def body():
+        try:
+            page = first
+            while page is not None:
+                data, checkpoint, _ = page
+                yield data
+                if checkpoints and format == "ndjson":
+                    yield ndjson_line({"checkpoint": checkpoint}).encode()
+                page = await anext(pages, None)
+        except Exception as e:
+            print(f"Export stream error: {e}")
+        finally:
+            await pages.aclose()
+    return StreamingResponse(body(), media_type=encoder.media_type)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of latency histograms and component stats"""
+    return PlainTextResponse(
+        metrics.registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
+@app.on_event("shutdown")
+async def close_storage():
+    await write_behind.close()
+    await activity_tracker.close()
+    await RateLimiter.engine.close()
+    await storage.close()
 
 # For local development
 if __name__ == "__main__":
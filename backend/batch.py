@@ -0,0 +1,216 @@
+import asyncio
+import json
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional
+from personas import get_persona_prompt
+
+
+@dataclass
+class ScriptedConversation:
+    """One conversation of a batch file: a persona and the user messages to send it, in order"""
+    id: str
+    persona: str
+    turns: list
+    # Line of the input it came from; unique within a run even when ids repeat
+    line: int = 0
+
+
+class TurnRejected(Exception):
+    """A turn that could not start; retryable ones were turned away for load and may succeed later"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float = 1.0, retryable: bool = False):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+def parse_conversation(line: str, number: int) -> ScriptedConversation:
+    """Validate one input line; raises ValueError naming the line when it is malformed"""
+    # {"id": "c1", "persona": "kabir", "turns": ["hi", "kya kar raha hai?"]}
+    try:
+        data = json.loads(line)
+    except ValueError:
+        raise ValueError(f"Line {number}: invalid JSON")
+    if not isinstance(data, dict):
+        raise ValueError(f"Line {number}: expected an object")
+    persona = data.get('persona')
+    if not isinstance(persona, str) or not get_persona_prompt(persona):
+        raise ValueError(f"Line {number}: unknown persona {persona!r}")
+    turns = data.get('turns')
+    if (not isinstance(turns, list) or not turns
+            or not all(isinstance(turn, str) and turn.strip() for turn in turns)):
+        raise ValueError(f"Line {number}: turns must be a non-empty list of messages")
+    return ScriptedConversation(str(data.get('id') or f"line-{number}"), persona, turns, number)
+
+
+def percentile(samples: list, fraction: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+# run_turn(conversation, turn_index) starts the turn and returns its reply events
+TurnRunner = Callable[[ScriptedConversation, int], Awaitable[AsyncIterator[dict]]]
+
+
+class BatchRunner:
+    """Runs scripted conversations against the chat pipeline with bounded parallelism.
+
+    At most `concurrency` conversations are in flight; the turns of one
+    conversation run in order, since each reply becomes history for the
+    next. Results come out as they happen: a "turn" record per turn with
+    its reply and latencies, a "conversation" record when one finishes, an
+    "error" record for an input line that does not parse and a final
+    "summary" with per-persona latency percentiles. A turn turned away for
+    load is retried after its Retry-After up to max_retries times; any other
+    failure ends that conversation.
+    """
+
+    def __init__(self, run_turn: TurnRunner, concurrency: int = 4, max_retries: int = 5,
+                 on_conversation_done: Callable[[ScriptedConversation], None] = lambda conversation: None):
+        self.run_turn = run_turn
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.on_conversation_done = on_conversation_done
+
+    async def run(self, lines: Iterable[str]) -> AsyncIterator[dict]:
+        start = time.perf_counter()
+        results: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        source = iter(enumerate(lines, 1))
+        totals = {'conversations': 0, 'turns': 0, 'failed_turns': 0, 'invalid_lines': 0}
+        latencies: dict[str, tuple[list, list]] = {}
+
+        async def worker():
+            # Lines are taken one at a time, so the input is never held in memory at once
+            for number, line in source:
+                if not line.strip():
+                    continue
+                try:
+                    conversation = parse_conversation(line, number)
+                except ValueError as e:
+                    totals['invalid_lines'] += 1
+                    await results.put({"type": "error", "line": number, "error": str(e)})
+                    continue
+                await self._run_conversation(conversation, results, totals, latencies)
+
+        async def run_workers():
+            cancelled = False
+            try:
+                await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                # Only a consumer that has stopped reading cancels; a put into a full queue would never return
+                if not cancelled:
+                    await results.put(None)
+
+        task = asyncio.get_running_loop().create_task(run_workers())
+        try:
+            while (record := await results.get()) is not None:
+                yield record
+            await task
+        finally:
+            task.cancel()
+
+        personas = {}
+        for persona, (first_token, total) in sorted(latencies.items()):
+            personas[persona] = {
+                "turns": len(total),
+                "first_token_p50": percentile(first_token, 0.5),
+                "first_token_p95": percentile(first_token, 0.95),
+                "seconds_p50": percentile(total, 0.5),
+                "seconds_p95": percentile(total, 0.95)
+            }
+        yield {"type": "summary", **totals, "seconds": time.perf_counter() - start, "personas": personas}
+
+    async def _run_conversation(self, conversation: ScriptedConversation, results: asyncio.Queue,
+                                totals: dict, latencies: dict):
+        start = time.perf_counter()
+        completed = 0
+        try:
+            for index, message in enumerate(conversation.turns):
+                record = await self._run_turn(conversation, index, message)
+                totals['turns'] += 1
+                await results.put(record)
+                if 'error' in record:
+                    totals['failed_turns'] += 1
+                    break
+                completed += 1
+                first_token, total = latencies.setdefault(conversation.persona, ([], []))
+                if record['first_token_seconds'] is not None:
+                    first_token.append(record['first_token_seconds'])
+                total.append(record['seconds'])
+        finally:
+            self.on_conversation_done(conversation)
+        totals['conversations'] += 1
+        await results.put({
+            "type": "conversation",
+            "conversation": conversation.id,
+            "persona": conversation.persona,
+            "turns": len(conversation.turns),
+            "completed": completed,
+            "seconds": time.perf_counter() - start
+        })
+
+    async def _run_turn(self, conversation: ScriptedConversation, index: int, message: str) -> dict:
+        record = {
+            "type": "turn",
+            "conversation": conversation.id,
+            "persona": conversation.persona,
+            "turn": index,
+            "message": message
+        }
+        retries = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                events = await self.run_turn(conversation, index)
+                break
+            except TurnRejected as e:
+                if not e.retryable or retries >= self.max_retries:
+                    return {**record, "status": e.status_code, "error": e.detail, "retries": retries}
+                retries += 1
+                await asyncio.sleep(e.retry_after)
+
+        parts = []
+        first_token = None
+        async with aclosing(events):
+            async for event in events:
+                if event.get('type') == 'chunk':
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    parts.append(event['response'])
+                elif event.get('type') == 'complete':
+                    return {
+                        **record,
+                        "response": "".join(parts),
+                        "first_token_seconds": first_token,
+                        "seconds": time.perf_counter() - start,
+                        "prompt_tokens": event.get('prompt_tokens'),
+                        "token_count": event.get('token_count'),
+                        "retries": retries
+                    }
+                elif event.get('type') == 'error':
+                    return {**record, "error": event.get('error'), "retries": retries}
+        return {**record, "error": "Reply ended without completing", "retries": retries}
+
+
+def summarize(record: dict) -> str:
+    """One human-readable line for a summary record"""
+    lines = [f"{record['conversations']} conversations, {record['turns']} turns "
+             f"({record['failed_turns']} failed, {record['invalid_lines']} invalid lines) "
+             f"in {record['seconds']:.1f}s"]
+    for persona, stats in record['personas'].items():
+        first_token = stats['first_token_p50']
+        lines.append(
+            f"  {persona:<8} {stats['turns']:>5} turns  first token p50 "
+            f"{first_token * 1000 if first_token is not None else 0:.0f}ms  "
+            f"reply p50 {stats['seconds_p50'] * 1000:.0f}ms  p95 {stats['seconds_p95'] * 1000:.0f}ms"
+        )
+    return "\n".join(lines)
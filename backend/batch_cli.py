@@ -0,0 +1,68 @@
+"""Run scripted persona conversations from a JSONL file and write the results as JSONL.
+
+Each input line is one conversation: {"id": "c1", "persona": "kabir",
+"turns": ["hi", "kya kar raha hai?"]}. Turns go through the same context
+assembly and streaming code as /chat, nothing is stored, and every record
+is written as soon as it is ready; a summary with per-persona latencies is
+printed to stderr at the end. Without --admin each turn is counted against
+--username's daily limits. --dry-run swaps in the local fake LLM and a
+throwaway SQLite database, so nothing leaves the machine.
+
+    python batch_cli.py conversations.jsonl -o results.jsonl --admin --concurrency 8
+    python batch_cli.py conversations.jsonl --dry-run
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+
+async def run(args, output):
+    import app
+    from batch import summarize
+    from pagination import ndjson_line
+
+    try:
+        if not args.admin:
+            # Created if needed, like a first /chat, so the limits have a row to count in
+            await app.request_context.resolve(args.username, create_user=True)
+        runner = app.batch_runner(args.username, args.admin, args.concurrency)
+        with open(args.input, encoding='utf-8') as lines:
+            async for record in runner.run(lines):
+                if record['type'] == 'summary':
+                    print(summarize(record), file=sys.stderr)
+                output.write(ndjson_line(record))
+                output.flush()
+    finally:
+        await app.close_storage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='JSONL file of scripted conversations')
+    parser.add_argument('-o', '--output', help='results file (default: stdout)')
+    parser.add_argument('--concurrency', type=int, default=4, help='conversations in flight at once')
+    parser.add_argument('--username', default='batch-eval', help='user the turns are counted against')
+    parser.add_argument('--admin', action='store_true', help='bypass the rate limiter')
+    parser.add_argument('--dry-run', action='store_true', help='use the fake LLM and a temporary SQLite database')
+    parser.add_argument('--fake-first-token', type=float, default=0.2, help='fake LLM first-token latency (s)')
+    args = parser.parse_args()
+
+    if args.dry_run:
+        os.environ['STORAGE_BACKEND'] = 'sqlite'
+        os.environ['SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'batch.db')
+        os.environ.setdefault('GEMINI_API_KEY', 'dry-run')
+        from bench.fake_genai import FakeLLM
+        FakeLLM(first_token_latency=args.fake_first_token, chunk_latency=0.01, chunks=8).install_on_load()
+
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        asyncio.run(run(args, output))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
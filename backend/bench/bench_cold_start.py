@@ -0,0 +1,161 @@
+"""Cold-start time per endpoint, as a serverless function would see it.
+
+Every sample is a fresh interpreter started with `python -X importtime`
+that imports the app and serves exactly one request to one endpoint, with
+storage on a local fake PostgREST and the model on the fake LLM (the real
+SDK is still imported, so its cost shows up where the app pays it). The
+report has interpreter start-up, app import, first request, whether the
+Gemini SDK and httpx were loaded, and the heaviest imports of the sample.
+
+    python bench/bench_cold_start.py
+    python bench/bench_cold_start.py --repeat 5 --check
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = [
+    ('GET', '/', None),
+    ('GET', '/personas', None),
+    # /chat creates the user the endpoints after it look up
+    ('GET', '/chat?message=hi&persona=kabir&username=cold', None),
+    ('GET', '/user/cold/stats', None),
+    ('POST', '/persona/select', {'username': 'cold', 'persona': 'kabir'}),
+    ('GET', '/user/cold/sessions', None),
+]
+# Endpoints that must answer without the Gemini SDK
+NO_SDK = {'/', '/personas'}
+
+
+def probe(method: str, target: str, body: str):
+    """Runs in the child: import the app, serve one request, print timings as JSON"""
+    start = time.perf_counter()
+    sys.path.insert(0, BACKEND_DIR)
+    from bench.fake_genai import FakeLLM
+    import llm as llm_module
+    load_genai = llm_module.load_genai
+    fake = FakeLLM(first_token_latency=0, chunk_latency=0)
+
+    def load_fake_genai():
+        genai = load_genai()
+        fake.install(genai)
+        return genai
+
+    llm_module.load_genai = load_fake_genai
+    import app
+    imported = time.perf_counter()
+
+    path, _, query = target.partition('?')
+    payload = body.encode() if body else b''
+    result = {'status': None}
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal payload
+        if payload is None:
+            # Like a real client: the connection stays open until the response is complete
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+        chunk, payload = payload, None
+        return {'type': 'http.request', 'body': chunk, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            finished.set()
+
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': [(b'host', b'cold'), (b'content-type', b'application/json')],
+        'client': ('127.0.0.1', 1), 'server': ('cold', 80),
+    }
+    async def serve():
+        await app.app(scope, receive, send)
+        finished.set()
+
+    asyncio.run(serve())
+    done = time.perf_counter()
+    print(json.dumps({
+        'import_ms': (imported - start) * 1000,
+        'request_ms': (done - imported) * 1000,
+        'status': result['status'],
+        'genai': 'google.generativeai' in sys.modules,
+        'httpx': 'httpx' in sys.modules,
+    }))
+
+
+def heaviest_imports(stderr: str, count: int) -> list:
+    """Top-level imports of the sample with the largest cumulative time"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith(' ') or name.startswith('   '):
+            continue
+        entries.append((int(cumulative) / 1000, name.strip()))
+    return sorted(entries, reverse=True)[:count]
+
+
+def sample(method: str, target: str, body, env: dict) -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--probe', method, target,
+         json.dumps(body) if body else ''],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120
+    )
+    wall = (time.perf_counter() - start) * 1000
+    lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"{method} {target} probe failed:\n{proc.stdout}\n{proc.stderr[-2000:]}")
+    result = json.loads(lines[-1])
+    result['wall_ms'] = wall
+    result['heaviest'] = heaviest_imports(proc.stderr, 3)
+    return result
+
+
+def main(args):
+    sys.path.insert(0, BACKEND_DIR)
+    from bench.fake_postgrest import FakePostgrest
+    fake_db = FakePostgrest()
+    env = dict(os.environ, SUPABASE_URL=fake_db.start(), SUPABASE_KEY='bench-key',
+               GEMINI_API_KEY='bench-key', PYTHONDONTWRITEBYTECODE='0')
+
+    print(f"{'endpoint':<32}{'status':>7}{'wall':>9}{'import':>9}{'request':>9}  sdk   httpx  heaviest imports")
+    failures = []
+    for method, target, body in ENDPOINTS:
+        runs = [sample(method, target, body, env) for _ in range(args.repeat)]
+        median = {key: statistics.median(r[key] for r in runs) for key in ('wall_ms', 'import_ms', 'request_ms')}
+        last = runs[-1]
+        heaviest = ', '.join(f"{name} {ms:.0f}ms" for ms, name in last['heaviest'])
+        path = target.split('?')[0]
+        print(f"{method + ' ' + path:<32}{last['status']:>7}{median['wall_ms']:>7.0f}ms{median['import_ms']:>7.0f}ms"
+              f"{median['request_ms']:>7.0f}ms  {'yes' if last['genai'] else 'no ':<5} {'yes' if last['httpx'] else 'no ':<5}  {heaviest}")
+        if path in NO_SDK and last['genai']:
+            failures.append(f"{path} loaded the Gemini SDK")
+    fake_db.stop()
+
+    if args.check:
+        if failures:
+            print("\nFAIL: " + "; ".join(failures))
+            sys.exit(1)
+        print("\nOK: " + ", ".join(sorted(NO_SDK)) + " answer without loading the Gemini SDK")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--probe':
+        probe(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else '')
+    else:
+        parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+        parser.add_argument('--repeat', type=int, default=3, help='fresh processes per endpoint')
+        parser.add_argument('--check', action='store_true', help='fail if /personas or / loads the SDK')
+        main(parser.parse_args())
@@ -0,0 +1,114 @@
+"""Throughput and memory of the bulk conversation export against the per-session walk.
+
+A fake PostgREST is seeded with --users users, each with --sessions
+sessions of --turns conversations. The per-session walk is what exporting
+took with the listing endpoints alone: every user's sessions, then every
+session's conversations, page by page. The export reads all conversations
+in keyset pages of --page-size and encodes them as it goes. The report has
+the storage round trips, rows/s and peak traced memory of each, the export
+in both formats and at twice the rows, so a flat peak shows memory does not
+grow with the size of the export.
+
+    python bench/bench_export.py --users 50 --sessions 4 --turns 50 --latency 0.005
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_postgrest import FakePostgrest  # noqa: E402
+from db import PostgrestClient  # noqa: E402
+import export  # noqa: E402
+from export import ENCODERS, ExportFilters, export_pages  # noqa: E402
+from pagination import (  # noqa: E402
+    Listing, CONVERSATION_LISTING, SESSION_LISTING, EXPORT_LISTING, iter_rows, ndjson_line
+)
+from storage import SupabaseStorage  # noqa: E402
+
+
+def seed(fake: FakePostgrest, users: int, sessions: int, turns: int):
+    start = datetime(2025, 1, 1)
+    for table in fake.tables.values():
+        table.clear()
+    for u in range(users):
+        user_id = str(uuid.uuid4())
+        fake.tables['users'].append({'id': user_id, 'username': f"bench{u}"})
+        for s in range(sessions):
+            session_id = str(uuid.uuid4())
+            fake.tables['chat_sessions'].append({
+                'id': session_id, 'user_id': user_id, 'persona': 'kabir', 'is_active': True,
+                'session_start': start.isoformat(), 'last_activity': start.isoformat()
+            })
+            fake.tables['conversations'].extend({
+                'id': str(uuid.uuid4()), 'user_id': user_id, 'session_id': session_id, 'persona': 'kabir',
+                'message': 'yo kya scene hai', 'response': 'bas chill bro, tu bata 🔥', 'token_count': 12,
+                'created_at': (start + timedelta(seconds=(u * sessions + s) * turns + t)).isoformat()
+            } for t in range(turns))
+
+
+async def per_session_walk(store: SupabaseStorage, fake: FakePostgrest) -> int:
+    fields = list(CONVERSATION_LISTING.columns)
+    session_columns = SESSION_LISTING.select_columns(['id'])
+    columns = CONVERSATION_LISTING.select_columns(fields)
+    rows = 0
+    for user in [dict(row) for row in fake.tables['users']]:
+        sessions = iter_rows(SESSION_LISTING, lambda after, limit: store.list_sessions_page(
+            user['id'], session_columns, limit, after), None)
+        async for session in sessions:
+            conversations = iter_rows(CONVERSATION_LISTING, lambda after, limit: store.list_conversations_page(
+                session['id'], columns, limit, after), None)
+            async for row in conversations:
+                ndjson_line(Listing.project(row, fields))
+                rows += 1
+    return rows
+
+
+async def bulk_export(fmt: str, page_size: int) -> int:
+    fields = list(EXPORT_LISTING.columns)
+    rows = 0
+    async for _, _, count in export_pages(ExportFilters(), fields, None, ENCODERS[fmt](fields), page_size):
+        rows += count
+    return rows
+
+
+async def measure(label: str, fake: FakePostgrest, run) -> None:
+    before = fake.request_count
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = await run()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<24}{rows:>9}{fake.request_count - before:>12}{rows / seconds:>10.0f}{peak / 1024:>12.0f}")
+
+
+async def main(args):
+    fake = FakePostgrest(latency=args.latency)
+    store = SupabaseStorage(PostgrestClient(fake.start(), 'bench-key'))
+    # The export reads through the module's storage
+    export.storage = store
+    print(f"{'':<24}{'rows':>9}{'round trips':>12}{'rows/s':>10}{'peak KiB':>12}")
+    seed(fake, args.users, args.sessions, args.turns)
+    await measure('per-session walk', fake, lambda: per_session_walk(store, fake))
+    await measure('export ndjson', fake, lambda: bulk_export('ndjson', args.page_size))
+    await measure('export csv.gz', fake, lambda: bulk_export('csv', args.page_size))
+    seed(fake, args.users * 2, args.sessions, args.turns)
+    await measure('export ndjson (2x rows)', fake, lambda: bulk_export('ndjson', args.page_size))
+    await store.close()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--sessions', type=int, default=4, help='sessions per user')
+    parser.add_argument('--turns', type=int, default=50, help='conversations per session')
+    parser.add_argument('--page-size', type=int, default=1000, help='export page size')
+    parser.add_argument('--latency', type=float, default=0.005, help='added fake PostgREST latency (s)')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+"""First-message latency after persona selection, with and without prewarming.
+
+Each mode runs in a fresh process (PREWARM=1, then PREWARM=0) against the
+app served by uvicorn with fake storage and a fake LLM; the real Gemini
+SDK is still imported, so its cost lands where the app pays it. Every
+user selects a persona, "types" for --think seconds and sends one message.
+Users are returning ones with --history-turns earlier turns in their
+session, more than the context resolver returns, so a cold first message
+also has to load the full history. The report has time to the first chunk for the very first message of the
+process (which includes the SDK import) and for the rest, plus the
+server's chat_first_token_seconds counts by path.
+
+    python bench/bench_first_message.py --users 20 --think 0.3
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(fake_db, users: int, history_turns: int):
+    """Give every user an active raghav session with some history"""
+    for i in range(users):
+        user_id, session_id = f"first-user-{i}", f"first-session-{i}"
+        fake_db.tables['users'].append({
+            'id': user_id, 'username': f"first{i}", 'daily_message_count': 0,
+            'daily_token_count': 0, 'last_reset_date': None
+        })
+        fake_db.tables['chat_sessions'].append({
+            'id': session_id, 'user_id': user_id, 'persona': 'raghav', 'is_active': True,
+            'session_start': '2024-01-01T00:00:00', 'last_activity': '2024-01-01T00:00:00'
+        })
+        for turn in range(history_turns):
+            fake_db.tables['conversations'].append({
+                'id': f"first-conv-{i}-{turn}", 'user_id': user_id, 'session_id': session_id,
+                'persona': 'raghav', 'message': f"message {turn}", 'response': f"reply {turn}",
+                'token_count': 4, 'created_at': f"2024-01-01T00:{turn // 60:02d}:{turn % 60:02d}"
+            })
+
+
+async def first_message(client: httpx.AsyncClient, username: str, think: float) -> float:
+    response = await client.post('/persona/select', json={'username': username, 'persona': 'raghav'})
+    response.raise_for_status()
+    await asyncio.sleep(think)
+    start = time.perf_counter()
+    params = {'message': 'hey, how was school today?', 'persona': 'raghav', 'username': username}
+    ttft = None
+    async with client.stream('GET', '/chat', params=params) as response:
+        async for line in response.aiter_lines():
+            if ttft is None and '"chunk"' in line:
+                ttft = time.perf_counter() - start
+    if ttft is None:
+        raise RuntimeError(f"No reply for {username}: {response.status_code}")
+    return ttft
+
+
+def first_token_counts(metrics_text: str) -> dict:
+    counts = {}
+    for line in metrics_text.splitlines():
+        if line.startswith('guardian_chat_first_token_seconds_count'):
+            path = line.split('path="')[1].split('"')[0]
+            counts[path] = int(float(line.rsplit(' ', 1)[1]))
+    return counts
+
+
+async def run_mode(args):
+    from bench.fake_genai import FakeLLM
+    from bench.harness import ThreadedServer, boot_app
+
+    llm = FakeLLM(first_token_latency=args.first_token, chunk_latency=0.005, chunks=10)
+    app_module, fake_db, llm = boot_app(db_latency=args.db_latency, llm=llm)
+    seed(fake_db, args.users, args.history_turns)
+    server = ThreadedServer(app_module.app)
+    url = server.start()
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        samples = [await first_message(client, f"first{i}", args.think) for i in range(args.users)]
+        counts = first_token_counts((await client.get('/metrics')).text)
+    server.stop()
+    fake_db.stop()
+    print(json.dumps({'samples': samples, 'paths': counts}))
+
+
+def main(args):
+    print(f"{'mode':<12}{'first in process':>18}{'rest p50':>11}{'rest p95':>11}  first-token paths")
+    for mode in ('1', '0'):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run-mode', '--users', str(args.users),
+             '--think', str(args.think), '--first-token', str(args.first_token),
+             '--db-latency', str(args.db_latency), '--history-turns', str(args.history_turns)],
+            env=dict(os.environ, PREWARM=mode), capture_output=True, text=True, timeout=600
+        )
+        lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+        if proc.returncode != 0 or not lines:
+            raise RuntimeError(f"PREWARM={mode} run failed:\n{proc.stdout}\n{proc.stderr[-2000:]}")
+        result = json.loads(lines[-1])
+        first, rest = result['samples'][0], sorted(result['samples'][1:])
+        p95 = rest[max(0, int(len(rest) * 0.95) - 1)]
+        print(f"{'prewarm' if mode == '1' else 'no prewarm':<12}{first * 1000:>16.0f}ms"
+              f"{statistics.median(rest) * 1000:>9.0f}ms{p95 * 1000:>9.0f}ms  {result['paths']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--think', type=float, default=0.3, help='seconds between selection and message')
+    parser.add_argument('--first-token', type=float, default=0.1, help='fake LLM first-token latency (s)')
+    parser.add_argument('--db-latency', type=float, default=0.01, help='fake PostgREST latency (s)')
+    parser.add_argument('--history-turns', type=int, default=40, help='earlier turns per user session')
+    parser.add_argument('--run-mode', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_mode:
+        asyncio.run(run_mode(args))
+    else:
+        main(args)
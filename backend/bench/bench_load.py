@@ -0,0 +1,200 @@
+"""Load test for the API against in-process fakes for Supabase and Gemini.
+
+Boots the app under uvicorn with a fake PostgREST and a fake streaming LLM
+(both with configurable latency), drives each endpoint at the requested
+concurrency levels and reports throughput plus p50/p95/p99 time to first
+byte and total latency. Results can be saved as JSON and compared with a
+saved baseline to catch regressions.
+
+    python bench/bench_load.py --concurrency 1 10 50 --requests 200
+    python bench/bench_load.py --json results.json
+    python bench/bench_load.py --compare results.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_genai import FakeLLM  # noqa: E402
+from bench.harness import ThreadedServer, boot_app  # noqa: E402
+
+SCENARIOS = ('chat', 'persona_select', 'stats', 'sessions', 'conversations')
+PERSONAS = ('aarohi', 'kabir', 'meher', 'raghav', 'simran')
+# Stay under the daily message limit for every simulated user
+MESSAGES_PER_USER = 40
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def seed(fake_db, users: int, history_turns: int):
+    """Give every simulated user an active session with some history"""
+    for i in range(users):
+        user_id = f"load-user-{i}"
+        session_id = f"load-session-{i}"
+        persona = PERSONAS[i % len(PERSONAS)]
+        fake_db.tables['users'].append({
+            'id': user_id, 'username': f"load{i}", 'daily_message_count': 0,
+            'daily_token_count': 0, 'last_reset_date': None
+        })
+        fake_db.tables['chat_sessions'].append({
+            'id': session_id, 'user_id': user_id, 'persona': persona, 'is_active': True,
+            'session_start': '2024-01-01T00:00:00', 'last_activity': '2024-01-01T00:00:00'
+        })
+        for turn in range(history_turns):
+            fake_db.tables['conversations'].append({
+                'id': f"load-conv-{i}-{turn}", 'user_id': user_id, 'session_id': session_id,
+                'persona': persona, 'message': f"message {turn}", 'response': f"reply {turn} 😂",
+                'token_count': 4, 'created_at': f"2024-01-01T00:{turn // 60:02d}:{turn % 60:02d}"
+            })
+
+
+def build_request(scenario: str, i: int, users: int):
+    user = i % users
+    username = f"load{user}"
+    persona = PERSONAS[user % len(PERSONAS)]
+    if scenario == 'chat':
+        return 'GET', '/chat', {'params': {'message': f"hey whats up {i}", 'persona': persona, 'username': username}}
+    if scenario == 'persona_select':
+        return 'POST', '/persona/select', {'json': {'username': username, 'persona': persona}}
+    if scenario == 'stats':
+        return 'GET', f"/user/{username}/stats", {}
+    if scenario == 'sessions':
+        return 'GET', f"/user/{username}/sessions", {}
+    return 'GET', f"/session/load-session-{user}/conversations", {}
+
+
+async def timed_request(client: httpx.AsyncClient, method: str, path: str, kwargs: dict) -> tuple:
+    start = time.perf_counter()
+    first_byte = None
+    async with client.stream(method, path, **kwargs) as response:
+        async for _ in response.aiter_raw():
+            if first_byte is None:
+                first_byte = time.perf_counter()
+    end = time.perf_counter()
+    return response.status_code, (first_byte or end) - start, end - start
+
+
+async def run_level(client, scenario: str, concurrency: int, total: int, users: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def one(i):
+        async with semaphore:
+            results.append(await timed_request(client, *build_request(scenario, i, users)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+
+    ttfb = [r[1] for r in results]
+    latency = [r[2] for r in results]
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': sum(1 for r in results if r[0] >= 400),
+        'throughput': total / elapsed,
+        'ttfb_p50': percentile(ttfb, 50),
+        'ttfb_p95': percentile(ttfb, 95),
+        'ttfb_p99': percentile(ttfb, 99),
+        'latency_p50': percentile(latency, 50),
+        'latency_p95': percentile(latency, 95),
+        'latency_p99': percentile(latency, 99),
+    }
+
+
+def print_table(rows: list):
+    header = (f"{'scenario':<15}{'conc':>6}{'reqs':>6}{'err':>5}{'req/s':>9}"
+              f"{'ttfb p50':>10}{'p95':>8}{'p99':>8}{'total p50':>11}{'p95':>8}{'p99':>8}")
+    print(header)
+    print('-' * len(header))
+    for r in rows:
+        print(f"{r['scenario']:<15}{r['concurrency']:>6}{r['requests']:>6}{r['errors']:>5}{r['throughput']:>9.1f}"
+              f"{r['ttfb_p50'] * 1000:>8.1f}ms{r['ttfb_p95'] * 1000:>6.0f}ms{r['ttfb_p99'] * 1000:>6.0f}ms"
+              f"{r['latency_p50'] * 1000:>9.1f}ms{r['latency_p95'] * 1000:>6.0f}ms{r['latency_p99'] * 1000:>6.0f}ms")
+
+
+def compare(rows: list, baseline_path: str, tolerance: float) -> list:
+    """Return a description of every p95 latency or throughput that regressed past tolerance"""
+    with open(baseline_path) as f:
+        baseline = {(r['scenario'], r['concurrency']): r for r in json.load(f)['results']}
+    regressions = []
+    for r in rows:
+        base = baseline.get((r['scenario'], r['concurrency']))
+        if base is None:
+            continue
+        for key in ('ttfb_p95', 'latency_p95'):
+            if r[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{r['scenario']}@{r['concurrency']} {key}: "
+                                   f"{base[key] * 1000:.1f}ms -> {r[key] * 1000:.1f}ms")
+        if r['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}@{r['concurrency']} throughput: "
+                               f"{base['throughput']:.1f} -> {r['throughput']:.1f} req/s")
+    return regressions
+
+
+async def main(args):
+    llm = FakeLLM(first_token_latency=args.llm_first_token, chunk_latency=args.llm_chunk_latency,
+                  chunks=args.llm_chunks)
+    app_module, fake_db, llm = boot_app(db_latency=args.db_latency, llm=llm)
+    chat_requests = args.requests * len(args.concurrency) if 'chat' in args.scenarios else 0
+    users = max(args.users, -(-chat_requests // MESSAGES_PER_USER))
+    seed(fake_db, users, args.history_turns)
+
+    server = ThreadedServer(app_module.app)
+    url = server.start()
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    rows = []
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                rows.append(await run_level(client, scenario, concurrency, args.requests, users))
+    server.stop()
+    fake_db.stop()
+
+    print(f"db latency {args.db_latency * 1000:.0f} ms, llm first token {args.llm_first_token * 1000:.0f} ms, "
+          f"{args.llm_chunks} chunks every {args.llm_chunk_latency * 1000:.0f} ms, {users} users\n")
+    print_table(rows)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': rows}, f, indent=2)
+        print(f"\nresults written to {args.json}")
+
+    if args.compare:
+        regressions = compare(rows, args.compare, args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nno regressions beyond {args.tolerance:.0%} of {args.compare}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario and concurrency level')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--history-turns', type=int, default=20)
+    parser.add_argument('--db-latency', type=float, default=0.01)
+    parser.add_argument('--llm-first-token', type=float, default=0.3)
+    parser.add_argument('--llm-chunk-latency', type=float, default=0.03)
+    parser.add_argument('--llm-chunks', type=int, default=8)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='baseline JSON from a previous --json run')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,110 @@
+"""Opening-message latency and model calls with and without the response cache.
+
+Each mode runs in a fresh process (RESPONSE_CACHE=1, then RESPONSE_CACHE=0)
+against the app served by uvicorn with fake storage and a fake LLM. Every
+user is new: they select a persona and send one opener, picked with skewed
+weights from a list of common greetings plus some one-off questions that
+are never cacheable. The report has time to the first chunk, the number of
+model calls and the cache's hit rate.
+
+    python bench/bench_response_cache.py --users 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PERSONAS = ('kabir', 'raghav', 'aarohi', 'meher', 'simran')
+OPENERS = ('hi', 'hello', 'hey', 'Hiii!', 'kaisi ho', 'kya haal hai', 'hey bro', 'good morning')
+
+
+def pick_message(rng: random.Random, user: int) -> str:
+    if rng.random() < 0.2:
+        return f"can you help me plan my week, question {user}?"
+    # Earlier greetings are the common ones
+    return rng.choices(OPENERS, weights=[1 / (rank + 1) for rank in range(len(OPENERS))])[0]
+
+
+async def opener(client: httpx.AsyncClient, username: str, persona: str, message: str) -> float:
+    response = await client.post('/persona/select', json={'username': username, 'persona': persona})
+    response.raise_for_status()
+    start = time.perf_counter()
+    params = {'message': message, 'persona': persona, 'username': username}
+    ttft = None
+    async with client.stream('GET', '/chat', params=params) as response:
+        async for line in response.aiter_lines():
+            if ttft is None and '"chunk"' in line:
+                ttft = time.perf_counter() - start
+    if ttft is None:
+        raise RuntimeError(f"No reply for {username}: {response.status_code}")
+    return ttft
+
+
+async def run_mode(args):
+    from bench.fake_genai import FakeLLM
+    from bench.harness import ThreadedServer, boot_app
+
+    llm = FakeLLM(first_token_latency=args.first_token, chunk_latency=0.005, chunks=10)
+    app_module, fake_db, llm = boot_app(db_latency=args.db_latency, llm=llm, env={'PREWARM': '0'})
+    server = ThreadedServer(app_module.app)
+    url = server.start()
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(user: int) -> float:
+        async with semaphore:
+            persona = rng.choice(PERSONAS[:args.personas])
+            return await opener(client, f"opener{user}", persona, pick_message(rng, user))
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        samples = await asyncio.gather(*(one(user) for user in range(args.users)))
+    server.stop()
+    fake_db.stop()
+    print(json.dumps({'samples': samples, 'llm_calls': llm.calls, 'cache': app_module.response_cache.stats()}))
+
+
+def main(args):
+    print(f"{'mode':<10}{'mean':>9}{'p25':>9}{'p50':>9}{'p95':>9}{'llm calls':>11}{'hit rate':>10}")
+    for mode in ('1', '0'):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run-mode', '--users', str(args.users),
+             '--personas', str(args.personas), '--concurrency', str(args.concurrency),
+             '--first-token', str(args.first_token), '--db-latency', str(args.db_latency),
+             '--seed', str(args.seed)],
+            env=dict(os.environ, RESPONSE_CACHE=mode), capture_output=True, text=True, timeout=600
+        )
+        lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+        if proc.returncode != 0 or not lines:
+            raise RuntimeError(f"RESPONSE_CACHE={mode} run failed:\n{proc.stdout}\n{proc.stderr[-2000:]}")
+        result = json.loads(lines[-1])
+        samples = sorted(result['samples'])
+        p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+        p25 = samples[int(len(samples) * 0.25)]
+        print(f"{'cache' if mode == '1' else 'no cache':<10}{statistics.mean(samples) * 1000:>7.0f}ms"
+              f"{p25 * 1000:>7.0f}ms{statistics.median(samples) * 1000:>7.0f}ms"
+              f"{p95 * 1000:>7.0f}ms{result['llm_calls']:>11}{result['cache']['hit_rate']:>10.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--personas', type=int, default=5, choices=range(1, len(PERSONAS) + 1))
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--first-token', type=float, default=0.3, help='fake LLM first-token latency (s)')
+    parser.add_argument('--db-latency', type=float, default=0.005, help='fake PostgREST latency (s)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--run-mode', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_mode:
+        asyncio.run(run_mode(args))
+    else:
+        main(args)
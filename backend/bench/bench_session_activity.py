@@ -0,0 +1,70 @@
+"""Storage writes spent on session activity for a steady chat load.
+
+--sessions sessions each send a message every --gap seconds (with jitter)
+for --duration seconds, and every message touches its session the way
+/chat does. The activity tracker writes to a local fake PostgREST, first
+flushing every 0.5 s (the old write-behind touch cadence) and then with
+--flush-interval. The report has the activity updates issued and the
+session rows they wrote; stored activity trails the last touch by at most
+one flush interval.
+
+    python bench/bench_session_activity.py --sessions 200 --duration 30
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_postgrest import FakePostgrest  # noqa: E402
+from db import PostgrestClient  # noqa: E402
+import activity  # noqa: E402
+from storage import SupabaseStorage  # noqa: E402
+
+
+async def run(fake: FakePostgrest, store: SupabaseStorage, flush_interval: float, args) -> dict:
+    fake.tables['chat_sessions'].clear()
+    for i in range(args.sessions):
+        await store.create_session(f"user-{i}", 'kabir')
+    session_ids = [s['id'] for s in fake.tables['chat_sessions']]
+    tracker = activity.ActivityTracker(flush_interval=flush_interval, sweep_interval=3600)
+    rng = random.Random(1)
+    before = fake.request_count
+
+    async def chat(session_id: str):
+        deadline = time.monotonic() + args.duration
+        await asyncio.sleep(rng.uniform(0, args.gap))
+        while time.monotonic() < deadline:
+            await tracker.touch(session_id)
+            await asyncio.sleep(args.gap * rng.uniform(0.5, 1.5))
+
+    await asyncio.gather(*(chat(session_id) for session_id in session_ids))
+    await tracker.close()
+    return {'updates': fake.request_count - before, 'rows': tracker.written, 'touches': tracker.touches}
+
+
+async def main(args):
+    fake = FakePostgrest(latency=args.latency)
+    store = SupabaseStorage(PostgrestClient(fake.start(), 'bench-key'))
+    # The tracker writes through the module's storage
+    activity.storage = store
+    print(f"{'flush every':<14}{'touches':>9}{'updates':>9}{'rows written':>14}")
+    for flush_interval in (0.5, args.flush_interval):
+        result = await run(fake, store, flush_interval, args)
+        print(f"{flush_interval:>10.1f} s  {result['touches']:>9}{result['updates']:>9}"
+              f"{result['rows']:>14}")
+    await store.close()
+    fake.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--gap', type=float, default=2.0, help='mean seconds between a session\'s messages')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of traffic per run')
+    parser.add_argument('--flush-interval', type=float, default=10.0, help='tracker flush interval (s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='added fake PostgREST latency (s)')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,118 @@
+"""Per-operation latency of the Supabase and embedded SQLite storage backends.
+
+Both backends are seeded with the same users, sessions and turns, then run
+the storage calls a chat message makes: the request context resolve, a
+history page, a conversation insert and a session listing. Supabase runs
+against a local fake PostgREST, so its numbers are loopback HTTP plus
+--latency, a floor for a real network. A final pass issues concurrent
+inserts to show the SQLite writer folding them into shared transactions.
+
+    python bench/bench_storage_backends.py --ops 500 --latency 0.005
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_postgrest import FakePostgrest  # noqa: E402
+from db import PostgrestClient  # noqa: E402
+from storage import SupabaseStorage  # noqa: E402
+from sqlite_storage import SQLiteStorage  # noqa: E402
+
+
+async def seed(storage, users: int, turns: int):
+    today = str(date.today())
+    sessions = []
+    for i in range(users):
+        user = await storage.create_user({'username': f"bench{i}", 'daily_message_count': 0,
+                                          'last_reset_date': today})
+        session = await storage.create_session(user['id'], 'kabir')
+        sessions.append(session['id'])
+        await storage.insert_conversations([{
+            'user_id': user['id'], 'session_id': session['id'], 'persona': 'kabir',
+            'message': 'yo', 'response': 'bruh fr fr 🔥', 'token_count': 5
+        } for _ in range(turns)])
+    return sessions
+
+
+def operations(storage, sessions: list, users: int):
+    today = str(date.today())
+
+    async def resolve(i):
+        await storage.resolve_request_context(f"bench{i % users}", today, 'kabir', False, False,
+                                              50, 10 ** 9, 0, 20)
+
+    async def history_page(i):
+        await storage.list_conversations_page(sessions[i % users], 'message,response', 20)
+
+    async def insert(i):
+        await storage.insert_conversation({'session_id': sessions[i % users], 'persona': 'kabir',
+                                           'message': 'yo', 'response': 'ok', 'token_count': 2})
+
+    async def get_user(i):
+        await storage.get_user(f"bench{i % users}", 'id')
+
+    return {'get_user': get_user, 'resolve_context': resolve, 'history_page': history_page,
+            'insert_turn': insert}
+
+
+async def measure(storage, sessions: list, users: int, ops: int) -> dict:
+    results = {}
+    for name, operation in operations(storage, sessions, users).items():
+        samples = []
+        for i in range(ops):
+            start = time.perf_counter()
+            await operation(i)
+            samples.append((time.perf_counter() - start) * 1e6)
+        samples.sort()
+        results[name] = (statistics.median(samples), samples[int(len(samples) * 0.99) - 1])
+    return results
+
+
+async def concurrent_inserts(storage, sessions: list, count: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(storage.insert_conversation({
+        'session_id': sessions[i % len(sessions)], 'message': 'yo', 'response': 'ok', 'token_count': 2
+    }) for i in range(count)))
+    return count / (time.perf_counter() - start)
+
+
+async def main(args):
+    fake = FakePostgrest(latency=args.latency)
+    backends = {
+        'supabase': SupabaseStorage(PostgrestClient(fake.start(), 'bench-key')),
+        'sqlite': SQLiteStorage(os.path.join(tempfile.mkdtemp(), 'bench.db')),
+    }
+    report = {}
+    for name, storage in backends.items():
+        sessions = await seed(storage, args.users, args.turns)
+        report[name] = await measure(storage, sessions, args.users, args.ops)
+        report[name]['concurrent_inserts'] = await concurrent_inserts(storage, sessions, args.ops)
+        if isinstance(storage, SQLiteStorage):
+            print(f"sqlite writer: {storage.stats()}")
+        await storage.close()
+    fake.stop()
+
+    print(f"{'operation':<20}" + ''.join(f"{name + ' p50/p99 (µs)':>28}" for name in backends))
+    for operation in operations(None, [], 1):
+        print(f"{operation:<20}" + ''.join(
+            f"{report[name][operation][0]:>18.0f} /{report[name][operation][1]:>8.0f}" for name in backends
+        ))
+    print(f"{'concurrent inserts':<20}" + ''.join(
+        f"{report[name]['concurrent_inserts']:>22.0f} ops/s" for name in backends
+    ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ops', type=int, default=500, help='calls per operation')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--turns', type=int, default=40, help='seeded turns per session')
+    parser.add_argument('--latency', type=float, default=0.0, help='added fake PostgREST latency (s)')
+    asyncio.run(main(parser.parse_args()))
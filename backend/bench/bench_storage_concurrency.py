@@ -0,0 +1,117 @@
+"""Concurrency check for the async storage layer against a local fake PostgREST.
+
+Runs the per-message storage path (user lookup, session lookup, touch, history
+read) at increasing concurrency and reports throughput. With the pooled async
+client throughput should scale with concurrency until the pool is saturated;
+the blocking baseline shows what the old synchronous client did to the loop.
+
+    python bench/bench_storage_concurrency.py --latency 0.02 --requests 256 --check
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_postgrest import FakePostgrest  # noqa: E402
+from db import PostgrestClient  # noqa: E402
+from storage import SupabaseStorage  # noqa: E402
+
+
+def seed(fake: FakePostgrest, users: int):
+    for i in range(users):
+        user_id = f"user-{i}"
+        fake.tables['users'].append({'id': user_id, 'username': f"bench{i}",
+                                     'daily_message_count': 0, 'last_reset_date': None})
+        fake.tables['chat_sessions'].append({'id': f"session-{i}", 'user_id': user_id,
+                                             'persona': 'kabir', 'is_active': True,
+                                             'last_activity': '2024-01-01T00:00:00'})
+        for turn in range(10):
+            fake.tables['conversations'].append({
+                'id': f"conv-{i}-{turn}", 'session_id': f"session-{i}", 'user_id': user_id,
+                'persona': 'kabir', 'message': 'yo', 'response': 'bruh fr fr 🔥',
+                'created_at': f"2024-01-01T00:00:{turn:02d}",
+            })
+
+
+async def message_path(storage: SupabaseStorage, i: int):
+    user = await storage.get_user(f"bench{i}", 'id')
+    session = await storage.get_active_session(user['id'], 'kabir')
+    await storage.touch_session(session['id'])
+    await storage.list_conversations(session['id'], 'message,response')
+
+
+def blocking_message_path(client: httpx.Client, i: int):
+    client.get('/users', params={'select': 'id', 'username': f"eq.bench{i}"})
+    client.get('/chat_sessions', params={'user_id': f"eq.user-{i}", 'persona': 'eq.kabir', 'is_active': 'eq.true'})
+    client.patch('/chat_sessions', params={'id': f"eq.session-{i}"}, json={'last_activity': 'now'})
+    client.get('/conversations', params={'select': 'message,response', 'session_id': f"eq.session-{i}"})
+
+
+async def run_async(storage: SupabaseStorage, total: int, concurrency: int, users: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await message_path(storage, i % users)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def run_blocking(url: str, total: int, concurrency: int, users: int) -> float:
+    # Coroutines that call a synchronous client never yield, so they serialize
+    client = httpx.Client(base_url=f"{url}/rest/v1")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            blocking_message_path(client, i % users)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    client.close()
+    return total / (time.perf_counter() - start)
+
+
+async def main(args):
+    fake = FakePostgrest(latency=args.latency)
+    seed(fake, args.users)
+    url = fake.start()
+    storage = SupabaseStorage(PostgrestClient(url, 'bench-key', max_connections=args.pool))
+
+    print(f"fake PostgREST at {url}, latency {args.latency * 1000:.0f} ms, {args.requests} message paths per level")
+    print(f"{'concurrency':>12} {'async msg/s':>12} {'blocking msg/s':>15}")
+    results = {}
+    for concurrency in args.levels:
+        async_rate = await run_async(storage, args.requests, concurrency, args.users)
+        blocking_rate = await run_blocking(url, args.requests, concurrency, args.users) if not args.skip_blocking else 0.0
+        results[concurrency] = async_rate
+        print(f"{concurrency:>12} {async_rate:>12.1f} {blocking_rate:>15.1f}")
+
+    await storage.close()
+    fake.stop()
+
+    if args.check:
+        serial = results[min(args.levels)]
+        best = max(results.values())
+        print(f"best speedup over serial: {best / serial:.1f}x (need >= {args.min_speedup:.1f}x)")
+        if best / serial < args.min_speedup:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated per-request latency in seconds')
+    parser.add_argument('--requests', type=int, default=256)
+    parser.add_argument('--users', type=int, default=64)
+    parser.add_argument('--pool', type=int, default=50, help='max pooled connections')
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--skip-blocking', action='store_true')
+    parser.add_argument('--check', action='store_true', help='exit non-zero if throughput does not scale')
+    parser.add_argument('--min-speedup', type=float, default=4.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,79 @@
+"""Concurrent SSE stream capacity of /chat with a fake streaming LLM.
+
+Opens many /chat streams at once against the app served by uvicorn. Each
+fake generation takes first-token latency plus (chunks - 1) * chunk latency,
+so if the streams truly run concurrently the whole batch finishes in about
+one generation time, even with more streams than Starlette's default
+threadpool (40 threads).
+
+    python bench/bench_streaming.py --streams 200 --check
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import anyio
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_genai import FakeLLM  # noqa: E402
+from bench.harness import ThreadedServer, boot_app  # noqa: E402
+
+
+async def open_stream(client: httpx.AsyncClient, i: int) -> bool:
+    params = {'message': 'hi', 'persona': 'kabir', 'username': f"stream{i}"}
+    async with client.stream('GET', '/chat', params=params) as response:
+        body = b''.join([chunk async for chunk in response.aiter_bytes()])
+    return response.status_code == 200 and b'"complete"' in body
+
+
+async def main(args):
+    llm = FakeLLM(first_token_latency=args.first_token, chunk_latency=args.chunk_latency, chunks=args.chunks)
+    # Admission control would cap concurrency below what this measures
+    app_module, fake_db, llm = boot_app(db_latency=args.db_latency, llm=llm,
+                                        env={'ADMISSION_MAX_CONCURRENT': args.streams})
+    server = ThreadedServer(app_module.app)
+    url = server.start()
+
+    threads = anyio.to_thread.current_default_thread_limiter().total_tokens
+    generation = args.first_token + (args.chunks - 1) * args.chunk_latency
+    limits = httpx.Limits(max_connections=args.streams, max_keepalive_connections=args.streams)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(open_stream(client, i) for i in range(args.streams)))
+        elapsed = time.perf_counter() - start
+
+    server.stop()
+    fake_db.stop()
+
+    ok = sum(results)
+    print(f"default threadpool size:  {threads}")
+    print(f"streams opened:           {args.streams} ({ok} completed)")
+    print(f"peak concurrent streams:  {llm.peak_streams}")
+    print(f"upstream read to the end: {llm.completed_streams} (others were cut by the output budget)")
+    print(f"upstream calls cancelled: {llm.cancelled_streams}")
+    print(f"upstream calls left open: {llm.active_streams}")
+    print(f"one generation takes:     {generation:.2f} s")
+    print(f"all streams took:         {elapsed:.2f} s")
+    print(f"throughput:               {ok / elapsed:.1f} streams/s")
+
+    if args.check and (ok < args.streams or llm.peak_streams <= threads):
+        print("FAIL: streams did not run beyond the threadpool size")
+        sys.exit(1)
+    if args.check and llm.active_streams:
+        print("FAIL: upstream calls were left running after their replies ended")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=200)
+    parser.add_argument('--first-token', type=float, default=0.5)
+    parser.add_argument('--chunk-latency', type=float, default=0.1)
+    parser.add_argument('--chunks', type=int, default=10)
+    parser.add_argument('--db-latency', type=float, default=0.005)
+    parser.add_argument('--check', action='store_true', help='exit non-zero unless peak streams exceed the threadpool and every upstream call ended')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,200 @@
+"""Stand-in for google.generativeai's chat and streaming API with configurable latency"""
+import asyncio
+import random
+import time
+
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeCall:
+    """The streaming RPC: generates until it finishes or is cancelled.
+
+    Like a gRPC call it does not stop when whoever reads it stops reading;
+    only cancel() (or reaching the end) ends it, so a stream that is merely
+    closed stays counted in active_streams.
+    """
+
+    def __init__(self, llm: 'FakeLLM', chunks: list):
+        self.llm = llm
+        self.chunks = chunks
+        self.done = False
+        llm.active_streams += 1
+        llm.peak_streams = max(llm.peak_streams, llm.active_streams)
+
+    def _finish(self):
+        if not self.done:
+            self.done = True
+            self.llm.active_streams -= 1
+
+    def cancel(self) -> bool:
+        if self.done:
+            return False
+        self.llm.cancelled_streams += 1
+        self._finish()
+        return True
+
+    async def __aiter__(self):
+        for i, text in enumerate(self.chunks):
+            if self.done:
+                return
+            if i:
+                await asyncio.sleep(self.llm.chunk_latency)
+            self.llm.chunks_sent += 1
+            yield FakeChunk(text)
+        if not self.done:
+            self.llm.completed_streams += 1
+            self._finish()
+
+
+class FakeWrappedCall:
+    """google-api-core's wrapper: iterating it is an async generator method over the call"""
+
+    def __init__(self, call: FakeCall):
+        self._call = call
+        self._wrapped_async_generator = None
+
+    def cancel(self) -> bool:
+        return self._call.cancel()
+
+    async def _wrapped_aiter(self):
+        async for response in self._call:
+            yield response
+
+    def __aiter__(self):
+        if not self._wrapped_async_generator:
+            self._wrapped_async_generator = self._wrapped_aiter()
+        return self._wrapped_async_generator
+
+
+class FakeStream:
+    """Stands in for AsyncGenerateContentResponse with stream=True.
+
+    As in the SDK, __aiter__ is a generator reading from _iterator, which is
+    the wrapper's generator over the call; closing either leaves the call
+    itself running.
+    """
+
+    def __init__(self, llm: 'FakeLLM', chunks: list):
+        self._iterator = aiter(FakeWrappedCall(FakeCall(llm, chunks)))
+
+    async def __aiter__(self):
+        while True:
+            try:
+                item = await anext(self._iterator)
+            except StopAsyncIteration:
+                return
+            yield item
+
+
+class FakeSyncStream:
+    def __init__(self, llm: 'FakeLLM', chunks: list):
+        self.llm = llm
+        self.chunks = chunks
+
+    def __iter__(self):
+        for i, text in enumerate(self.chunks):
+            if i:
+                time.sleep(self.llm.chunk_latency)
+            self.llm.chunks_sent += 1
+            yield FakeChunk(text)
+
+
+class FakeChatSession:
+    def __init__(self, llm: 'FakeLLM', history=None):
+        self.llm = llm
+        self.history = list(history or [])
+
+    def _chunks(self) -> list:
+        words = self.llm.reply.split()
+        size = max(1, len(words) // self.llm.chunks)
+        return [' '.join(words[i:i + size]) + ' ' for i in range(0, len(words), size)]
+
+    async def send_message_async(self, content, stream: bool = False, **kwargs):
+        self.llm.calls += 1
+        await asyncio.sleep(self.llm.first_token_latency)
+        self.llm.maybe_fail()
+        if stream:
+            return FakeStream(self.llm, self._chunks())
+        return FakeResponse(self.llm.reply)
+
+    def send_message(self, content, stream: bool = False, **kwargs):
+        self.llm.calls += 1
+        time.sleep(self.llm.first_token_latency)
+        self.llm.maybe_fail()
+        if stream:
+            return FakeSyncStream(self.llm, self._chunks())
+        return FakeResponse(self.llm.reply)
+
+
+class FakeLLM:
+    """Counts calls and concurrent streams; installed in place of genai.GenerativeModel"""
+
+    def __init__(self, first_token_latency: float = 0.2, chunk_latency: float = 0.05,
+                 chunks: int = 8, reply: str = None, error_rate: float = 0.0):
+        self.first_token_latency = first_token_latency
+        self.chunk_latency = chunk_latency
+        self.chunks = chunks
+        self.reply = reply or "haha same bro that sounds fun, tell me more about it fr 🔥 " * 2
+        # Fraction of calls that fail after the first-token latency, like an upstream 5xx
+        self.error_rate = error_rate
+        self.errors = 0
+        self.calls = 0
+        self.chunks_sent = 0
+        self.completed_streams = 0
+        self.cancelled_streams = 0
+        self.active_streams = 0
+        self.peak_streams = 0
+        self.models_created = 0
+
+    def maybe_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            raise RuntimeError("503 upstream unavailable (injected)")
+
+    def model_class(self):
+        llm = self
+
+        class FakeGenerativeModel:
+            def __init__(self, model_name: str = None, generation_config=None, **kwargs):
+                llm.models_created += 1
+                self.model_name = model_name
+                self.generation_config = generation_config
+
+            def start_chat(self, history=None):
+                return FakeChatSession(llm, history)
+
+            async def generate_content_async(self, contents, **kwargs):
+                llm.calls += 1
+                await asyncio.sleep(llm.first_token_latency)
+                return FakeResponse("They chatted about school and weekend plans.")
+
+        return FakeGenerativeModel
+
+    def install(self, genai_module):
+        """Patch a google.generativeai module so the app talks to this fake"""
+        genai_module.GenerativeModel = self.model_class()
+        genai_module.configure = lambda **kwargs: None
+
+    def install_on_load(self):
+        """Install this fake when the app first loads the SDK.
+
+        The real import (and its cost) stays where the app would pay it. Must
+        run before the app has loaded the SDK.
+        """
+        import llm as llm_module
+        load_genai = llm_module.load_genai
+
+        def load_fake_genai():
+            genai = load_genai()
+            self.install(genai)
+            return genai
+
+        llm_module.load_genai = load_fake_genai
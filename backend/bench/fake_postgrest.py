@@ -0,0 +1,284 @@
+"""In-memory stand-in for Supabase's PostgREST API with configurable latency"""
+import asyncio
+import json
+import uuid
+from datetime import datetime, timezone
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from bench.server import ThreadedServer
+
+OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'gt': lambda a, b: a is not None and a > b,
+    'gte': lambda a, b: a is not None and a >= b,
+    'lt': lambda a, b: a is not None and a < b,
+    'lte': lambda a, b: a is not None and a <= b,
+    'is': lambda a, b: a is b,
+}
+
+RESERVED = {'select', 'order', 'limit', 'offset', 'on_conflict', 'or'}
+
+
+def _parse(raw: str):
+    if raw == 'true':
+        return True
+    if raw == 'false':
+        return False
+    if raw == 'null':
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        return raw
+
+
+def _split_top_level(raw: str) -> list:
+    """Split 'a,and(b,c),d' on commas outside parentheses and double quotes"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(raw):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+        elif not quoted and ch == ')':
+            depth -= 1
+        elif not quoted and ch == ',' and depth == 0:
+            parts.append(raw[start:i])
+            start = i + 1
+    parts.append(raw[start:])
+    return parts
+
+
+def _logic_tree(raw: str, combine=any):
+    """Compile a PostgREST or=(...) / and(...) tree into a row predicate"""
+    tests = []
+    for part in _split_top_level(raw[1:-1]):
+        if part.startswith('and('):
+            tests.append(_logic_tree(part[3:], all))
+        elif part.startswith('or('):
+            tests.append(_logic_tree(part[2:], any))
+        else:
+            column, op, value = part.split('.', 2)
+            value = _parse(value[1:-1]) if value.startswith('"') else _parse(value)
+            tests.append(lambda row, column=column, op=op, value=value: OPERATORS[op](row.get(column), value))
+    return lambda row: combine(test(row) for test in tests)
+
+
+class FakePostgrest:
+    """Serves users, chat_sessions and conversations from dicts in memory"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables = {'users': [], 'chat_sessions': [], 'conversations': []}
+        self.functions = {
+            'check_rate_limit': FakePostgrest.check_rate_limit,
+            'record_token_usage': FakePostgrest.record_token_usage,
+            'resolve_request_context': FakePostgrest.resolve_request_context,
+        }
+        self.request_count = 0
+        # Requests waiting out their latency at once, and the most there have been
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.app = Starlette(routes=[
+            Route('/rest/v1/rpc/{function}', self.rpc, methods=['POST']),
+            Route('/rest/v1/{table}', self.table, methods=['GET', 'POST', 'PATCH', 'DELETE']),
+        ])
+        self._server = None
+        self.url = None
+
+    # Query helpers
+    @staticmethod
+    def _filters(request: Request):
+        filters = []
+        for column, value in request.query_params.multi_items():
+            if column in RESERVED:
+                continue
+            op, _, raw = value.partition('.')
+            if op == 'in':
+                values = {_parse(v) for v in raw.strip('()').split(',')}
+                filters.append((column, lambda a, b, values=values: a in values, None))
+            else:
+                filters.append((column, OPERATORS[op], _parse(raw)))
+        logic = request.query_params.get('or')
+        if logic:
+            tree = _logic_tree(logic)
+            filters.append((None, lambda _, row: tree(row), None))
+        return filters
+
+    @staticmethod
+    def _matches(row: dict, filters) -> bool:
+        return all(
+            test(row.get(column), value) if column is not None else test(None, row)
+            for column, test, value in filters
+        )
+
+    @staticmethod
+    def _project(row: dict, columns: str) -> dict:
+        if not columns or columns == '*':
+            return dict(row)
+        return {c.strip(): row.get(c.strip()) for c in columns.split(',')}
+
+    def _defaults(self, table: str, row: dict) -> dict:
+        now = datetime.now(timezone.utc).isoformat(timespec='microseconds')
+        row = dict(row)
+        row.setdefault('id', str(uuid.uuid4()))
+        row.setdefault('created_at', now)
+        if table == 'chat_sessions':
+            row.setdefault('session_start', now)
+            row.setdefault('last_activity', now)
+        return row
+
+    async def _delay(self):
+        self.request_count += 1
+        if self.latency:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(self.latency)
+            finally:
+                self.in_flight -= 1
+
+    # Routes
+    async def table(self, request: Request):
+        await self._delay()
+        name = request.path_params['table']
+        rows = self.tables.setdefault(name, [])
+        filters = self._filters(request)
+        returning = 'return=representation' in request.headers.get('prefer', '')
+
+        if request.method == 'GET':
+            result = [r for r in rows if self._matches(r, filters)]
+            order = request.query_params.get('order')
+            if order:
+                for part in reversed(order.split(',')):
+                    column, _, direction = part.partition('.')
+                    result.sort(key=lambda r: (r.get(column) is None, r.get(column)),
+                                reverse=direction.startswith('desc'))
+            offset = int(request.query_params.get('offset', 0))
+            limit = request.query_params.get('limit')
+            result = result[offset:offset + int(limit)] if limit else result[offset:]
+            columns = request.query_params.get('select', '*')
+            return JSONResponse([self._project(r, columns) for r in result])
+
+        if request.method == 'POST':
+            payload = json.loads(await request.body())
+            payload = payload if isinstance(payload, list) else [payload]
+            conflict = request.query_params.get('on_conflict')
+            created = []
+            for row in payload:
+                existing = None
+                if conflict and 'merge-duplicates' in request.headers.get('prefer', ''):
+                    existing = next((r for r in rows if r.get(conflict) == row.get(conflict)), None)
+                if existing is not None:
+                    existing.update(row)
+                    created.append(dict(existing))
+                else:
+                    row = self._defaults(name, row)
+                    rows.append(row)
+                    created.append(row)
+            return JSONResponse(created, status_code=201) if returning else Response(status_code=201)
+
+        if request.method == 'PATCH':
+            values = json.loads(await request.body())
+            updated = []
+            for row in rows:
+                if self._matches(row, filters):
+                    row.update(values)
+                    updated.append(dict(row))
+            return JSONResponse(updated) if returning else Response(status_code=204)
+
+        kept = [r for r in rows if not self._matches(r, filters)]
+        self.tables[name] = kept
+        return Response(status_code=204)
+
+    async def rpc(self, request: Request):
+        await self._delay()
+        function = self.functions.get(request.path_params['function'])
+        if function is None:
+            return JSONResponse({'message': 'function not found'}, status_code=404)
+        params = json.loads(await request.body() or b'{}')
+        result = function(self, **params)
+        return JSONResponse(result) if result is not None else Response(status_code=204)
+
+    # Stored procedures from backend/sql
+    def check_rate_limit(self, p_username, p_today, p_message_limit, p_token_limit, p_tokens):
+        users = self.tables['users']
+        user = next((u for u in users if u['username'] == p_username), None)
+        if user is None:
+            user = self._defaults('users', {'username': p_username, 'daily_message_count': 0,
+                                            'daily_token_count': 0, 'last_reset_date': p_today})
+            users.append(user)
+        if user.get('last_reset_date') != p_today:
+            user.update(daily_message_count=0, daily_token_count=0, last_reset_date=p_today)
+        allowed = (user['daily_message_count'] < p_message_limit
+                   and user.get('daily_token_count', 0) < p_token_limit)
+        if allowed:
+            user['daily_message_count'] += 1
+            user['daily_token_count'] = user.get('daily_token_count', 0) + p_tokens
+        return [{'allowed': allowed, 'message_count': user['daily_message_count'],
+                 'token_count': user['daily_token_count']}]
+
+    def record_token_usage(self, p_username, p_today, p_tokens):
+        for user in self.tables['users']:
+            if user['username'] == p_username and user.get('last_reset_date') == p_today:
+                user['daily_token_count'] = user.get('daily_token_count', 0) + p_tokens
+        return None
+
+    def resolve_request_context(self, p_username, p_today, p_persona=None, p_create_user=False,
+                                p_count_message=False, p_message_limit=0, p_token_limit=0,
+                                p_tokens=0, p_history_turns=0):
+        users = self.tables['users']
+        user = next((u for u in users if u['username'] == p_username), None)
+        if user is None and p_create_user:
+            user = self._defaults('users', {'username': p_username, 'daily_message_count': 0,
+                                            'daily_token_count': 0, 'last_reset_date': p_today})
+            users.append(user)
+        allowed = True
+        if p_count_message:
+            allowed = self.check_rate_limit(p_username, p_today, p_message_limit,
+                                            p_token_limit, p_tokens)[0]['allowed']
+        if user is None:
+            return {'user_id': None, 'allowed': False}
+
+        session_id, created, history, complete = None, False, [], False
+        if allowed and p_persona is not None:
+            sessions = self.tables['chat_sessions']
+            session = next((s for s in sessions if s['user_id'] == user['id']
+                            and s['persona'] == p_persona and s['is_active']), None)
+            if session is None:
+                session = self._defaults('chat_sessions', {'user_id': user['id'], 'persona': p_persona,
+                                                           'is_active': True})
+                sessions.append(session)
+                created = complete = True
+            elif p_history_turns > 0:
+                turns = sorted((c for c in self.tables['conversations'] if c['session_id'] == session['id']),
+                               key=lambda c: (c['created_at'], c['id']))
+                complete = len(turns) <= p_history_turns
+                history = [{'id': c['id'], 'message': c['message'], 'response': c['response']}
+                           for c in turns[-p_history_turns:]]
+            session_id = session['id']
+
+        return {
+            'user_id': user['id'], 'allowed': allowed,
+            'message_count': user.get('daily_message_count', 0),
+            'token_count': user.get('daily_token_count', 0),
+            'last_reset_date': user.get('last_reset_date'),
+            'session_id': session_id, 'session_created': created,
+            'history': history, 'history_complete': complete
+        }
+
+    # Lifecycle
+    def start(self) -> str:
+        """Serve on a free localhost port from a background thread and return the base URL"""
+        self._server = ThreadedServer(self.app, lifespan='off')
+        self.url = self._server.start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stop()
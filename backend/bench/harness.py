@@ -0,0 +1,31 @@
+"""Boots the FastAPI app against local fakes for Supabase and Gemini"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from bench.fake_genai import FakeLLM  # noqa: E402
+from bench.fake_postgrest import FakePostgrest  # noqa: E402
+from bench.server import ThreadedServer  # noqa: E402,F401
+
+
+def boot_app(db_latency: float = 0.005, llm: FakeLLM = None, env: dict = None):
+    """Start a fake PostgREST, patch genai with a fake LLM and import the app.
+
+    Returns (app_module, fake_postgrest, fake_llm). Must run before anything
+    else imports app, storage or rate_limiter.
+    """
+    fake_db = FakePostgrest(latency=db_latency)
+    os.environ['SUPABASE_URL'] = fake_db.start()
+    os.environ['SUPABASE_KEY'] = 'bench-key'
+    os.environ.setdefault('GEMINI_API_KEY', 'bench-key')
+    for name, value in (env or {}).items():
+        os.environ[name] = str(value)
+
+    llm = llm or FakeLLM()
+    llm.install_on_load()
+
+    import app
+    return app, fake_db, llm
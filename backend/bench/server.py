@@ -0,0 +1,38 @@
+"""Threaded uvicorn server used by the fakes and benchmarks"""
+import socket
+import threading
+import time
+
+import uvicorn
+
+
+class ThreadedServer:
+    """Runs an ASGI app with uvicorn on a free localhost port in a daemon thread"""
+
+    def __init__(self, app, **config):
+        self.app = app
+        self.config = config
+        self.server = None
+        self.thread = None
+        self.url = None
+
+    def start(self) -> str:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Avoid Nagle/delayed-ACK stalls between header and body writes
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        config = uvicorn.Config(self.app, log_level='warning', backlog=2048, **self.config)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, kwargs={'sockets': [sock]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.should_exit = True
+            self.thread.join(timeout=10)
@@ -0,0 +1,11 @@
+"""Loads .env once, before any module reads its settings from the environment"""
+import os
+from dotenv import load_dotenv
+
+# Searches upward from backend/, so the repository-root .env is found as well
+load_dotenv()
+
+# Vercel (backend/vercel.json) freezes the function between requests, so
+# background flushes may never run and every instance has its own memory;
+# settings that rely on either default to their safe mode there
+SERVERLESS = os.environ.get("VERCEL") == "1"
@@ -0,0 +1,197 @@
+import asyncio
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token)"""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class ContextMetrics:
+    history_turns: int
+    kept_turns: int
+    summarized_turns: int
+    summary_tokens: int
+    prompt_tokens: int
+    unbounded_tokens: int
+
+
+@dataclass
+class PreparedContext:
+    history: list
+    message: str
+    metrics: ContextMetrics
+
+
+@dataclass
+class RollingSummary:
+    text: str = ""
+    covered_turns: int = 0
+
+
+class ContextAssembler:
+    """Fits a session's history into a token budget for the next Gemini call.
+
+    The persona system prompt and the newest turns are always sent verbatim.
+    Turns that no longer fit are folded into a per-session rolling summary.
+    Folding runs in the background and only covers the turns that fell out of
+    the window since the last fold, so a request never waits on it; until a
+    fold finishes the request uses the previous summary.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 1500,
+        min_recent_turns: int = 2,
+        fill_ratio: float = 1.0,
+        summarizer: Optional[Callable[[str, list], Awaitable[str]]] = None,
+        max_sessions: int = 1000,
+    ):
+        self.token_budget = token_budget
+        self.min_recent_turns = min_recent_turns
+        # A fresh context fills only part of the budget so a warm chat can
+        # take a few more turns before it has to be rebuilt
+        self.fill_ratio = fill_ratio
+        self.summarizer = summarizer
+        self.max_sessions = max_sessions
+        self._summaries: OrderedDict[str, RollingSummary] = OrderedDict()
+        self._folding: dict[str, asyncio.Task] = {}
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.unbounded_tokens = 0
+        self.folds = 0
+
+    @staticmethod
+    def _turns(history: list) -> list:
+        return [
+            (history[i]['parts'][0], history[i + 1]['parts'][0])
+            for i in range(0, len(history) - 1, 2)
+        ]
+
+    @staticmethod
+    def _with_context(system_prompt: str, summary: str, text: str) -> str:
+        context = f"System Context: {system_prompt}\n\n"
+        if summary:
+            context += f"Earlier in this conversation: {summary}\n\n"
+        return f"{context}User: {text}"
+
+    def assemble(self, session_id: str, system_prompt: str, history: list, message: str,
+                 record: bool = True) -> PreparedContext:
+        """Budgeted history and the text to send; record=False keeps a prewarm out of the stats"""
+        turns = self._turns(history)
+        summary = self._summaries.get(session_id)
+        if summary is not None:
+            self._summaries.move_to_end(session_id)
+        summary_text = summary.text if summary else ""
+
+        # Newest turns first, until the budget left after the fixed parts runs out
+        available = int(self.token_budget * self.fill_ratio) - estimate_tokens(system_prompt) \
+            - estimate_tokens(message) - estimate_tokens(summary_text)
+        kept = 0
+        used = 0
+        for user_text, model_text in reversed(turns):
+            cost = estimate_tokens(user_text) + estimate_tokens(model_text)
+            if kept >= self.min_recent_turns and used + cost > available:
+                break
+            kept += 1
+            used += cost
+        window = turns[len(turns) - kept:]
+        older = len(turns) - kept
+
+        if older > (summary.covered_turns if summary else 0):
+            self._schedule_fold(session_id, turns[:older])
+
+        assembled = []
+        for user_text, model_text in window:
+            assembled.append({"role": "user", "parts": [user_text]})
+            assembled.append({"role": "model", "parts": [model_text]})
+        if assembled:
+            assembled[0] = {
+                "role": "user",
+                "parts": [self._with_context(system_prompt, summary_text, window[0][0])]
+            }
+            contextual_message = message
+        else:
+            contextual_message = self._with_context(system_prompt, summary_text, message)
+
+        prompt_tokens = sum(estimate_tokens(entry['parts'][0]) for entry in assembled) \
+            + estimate_tokens(contextual_message)
+        unbounded_tokens = estimate_tokens(system_prompt) + estimate_tokens(message) + sum(
+            estimate_tokens(user_text) + estimate_tokens(model_text) for user_text, model_text in turns
+        )
+        if record:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.unbounded_tokens += unbounded_tokens
+
+        return PreparedContext(
+            history=assembled,
+            message=contextual_message,
+            metrics=ContextMetrics(
+                history_turns=len(turns),
+                kept_turns=kept,
+                summarized_turns=summary.covered_turns if summary else 0,
+                summary_tokens=estimate_tokens(summary_text),
+                prompt_tokens=prompt_tokens,
+                unbounded_tokens=unbounded_tokens
+            )
+        )
+
+    def _schedule_fold(self, session_id: str, older_turns: list):
+        if self.summarizer is None or session_id in self._folding:
+            return
+        task = asyncio.get_running_loop().create_task(self._fold(session_id, older_turns))
+        self._folding[session_id] = task
+
+    async def _fold(self, session_id: str, older_turns: list):
+        try:
+            summary = self._summaries.get(session_id) or RollingSummary()
+            new_turns = older_turns[summary.covered_turns:]
+            text = await self.summarizer(summary.text, new_turns)
+            self._summaries[session_id] = RollingSummary(text, len(older_turns))
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+            self.folds += 1
+        except Exception as e:
+            print(f"Summary fold error: {e}")
+        finally:
+            del self._folding[session_id]
+
+    def forget(self, session_id: str):
+        self._summaries.pop(session_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "unbounded_tokens": self.unbounded_tokens,
+            "saved_tokens": self.unbounded_tokens - self.prompt_tokens,
+            "summaries": len(self._summaries),
+            "folds": self.folds
+        }
+
+
+def summary_prompt(previous_summary: str, turns: list, max_words: int) -> str:
+    """Prompt asking the model to extend a running summary with new turns"""
+    lines = [f"User: {user_text}\nYou: {model_text}" for user_text, model_text in turns]
+    previous = previous_summary or "(nothing yet)"
+    return (
+        f"Summary so far: {previous}\n\n"
+        f"New messages:\n" + "\n".join(lines) + "\n\n"
+        f"Update the summary of this chat in at most {max_words} words. "
+        "Keep names, facts about the user and open topics. Reply with the summary only."
+    )
+
+
+def create_assembler(summarizer=None) -> ContextAssembler:
+    return ContextAssembler(
+        token_budget=int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500")),
+        min_recent_turns=int(os.environ.get("CONTEXT_MIN_RECENT_TURNS", "2")),
+        fill_ratio=float(os.environ.get("CONTEXT_FILL_RATIO", "0.75")),
+        summarizer=summarizer
+    )
@@ -0,0 +1,158 @@
+import asyncio
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    import httpx
+
+
+class PostgrestError(Exception):
+    """Raised when PostgREST answers with an error status"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"PostgREST error {status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class PostgrestClient:
+    """Async PostgREST client backed by a pooled keep-alive HTTP connection pool.
+
+    Filters are passed as a dict of column -> value. A plain value means
+    equality, a (operator, value) tuple maps to PostgREST's `column=op.value`
+    syntax, e.g. {'created_at': ('gt', '2024-01-01')}. The 'or' key takes a
+    raw PostgREST logic tree such as '(a.gt.1,and(a.eq.1,b.gt.2))'.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        max_connections: int = 50,
+        max_keepalive: int = 20,
+        timeout: float = 10.0,
+    ):
+        self.base_url = f"{(url or '').rstrip('/')}/rest/v1"
+        self.headers = {
+            'apikey': key or '',
+            'Authorization': f"Bearer {key or ''}",
+            'Content-Type': 'application/json',
+        }
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.timeout = timeout
+        self._client: Optional['httpx.AsyncClient'] = None
+        self._loop = None
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def client(self) -> 'httpx.AsyncClient':
+        # Pooled connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            # Imported here so cold starts that never query storage skip it
+            import httpx
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=30.0,
+                ),
+                timeout=httpx.Timeout(self.timeout),
+            )
+        return self._client
+
+    @staticmethod
+    def _encode(value: Any) -> str:
+        if value is None:
+            return 'null'
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return str(value)
+
+    def _params(
+        self,
+        filters: Optional[dict] = None,
+        columns: Optional[str] = None,
+        order: Optional[str] = None,
+        desc: bool = False,
+        limit: Optional[int] = None,
+    ) -> list:
+        params = []
+        if columns:
+            params.append(('select', columns))
+        for column, value in (filters or {}).items():
+            if column == 'or':
+                params.append(('or', value))
+                continue
+            if isinstance(value, list):
+                # Several conditions on one column, e.g. both ends of a range
+                params.extend((column, f"{op}.{self._encode(v)}") for op, v in value)
+                continue
+            if isinstance(value, tuple):
+                op, value = value
+            else:
+                op = 'is' if value is None else 'eq'
+            params.append((column, f"{op}.{self._encode(value)}"))
+        if order:
+            direction = 'desc' if desc else 'asc'
+            params.append(('order', ','.join(f"{column}.{direction}" for column in order.split(','))))
+        if limit is not None:
+            params.append(('limit', str(limit)))
+        return params
+
+    def _check(self, response: 'httpx.Response'):
+        self.requests += 1
+        if response.status_code >= 400:
+            self.errors += 1
+            raise PostgrestError(response.status_code, response.text)
+
+    async def select(
+        self,
+        table: str,
+        columns: str = '*',
+        filters: Optional[dict] = None,
+        order: Optional[str] = None,
+        desc: bool = False,
+        limit: Optional[int] = None,
+    ) -> list:
+        response = await self.client.get(
+            f"/{table}", params=self._params(filters, columns, order, desc, limit)
+        )
+        self._check(response)
+        return response.json()
+
+    async def insert(self, table: str, rows, returning: bool = True) -> list:
+        headers = {'Prefer': 'return=representation' if returning else 'return=minimal'}
+        response = await self.client.post(f"/{table}", json=rows, headers=headers)
+        self._check(response)
+        return response.json() if returning else []
+
+    async def upsert(self, table: str, rows, on_conflict: str, returning: bool = False) -> list:
+        prefer = 'return=representation' if returning else 'return=minimal'
+        headers = {'Prefer': f"resolution=merge-duplicates,{prefer}"}
+        response = await self.client.post(
+            f"/{table}", params={'on_conflict': on_conflict}, json=rows, headers=headers
+        )
+        self._check(response)
+        return response.json() if returning else []
+
+    async def update(self, table: str, values: dict, filters: dict, returning: bool = False) -> list:
+        headers = {'Prefer': 'return=representation' if returning else 'return=minimal'}
+        response = await self.client.patch(
+            f"/{table}", params=self._params(filters), json=values, headers=headers
+        )
+        self._check(response)
+        return response.json() if returning else []
+
+    async def rpc(self, function: str, params: Optional[dict] = None) -> Any:
+        response = await self.client.post(f"/rpc/{function}", json=params or {})
+        self._check(response)
+        return response.json() if response.content else None
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
@@ -0,0 +1,105 @@
+import csv
+import gzip
+import io
+import os
+from contextlib import aclosing
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from personas import get_persona_prompt
+from pagination import EXPORT_LISTING, Listing, iter_pages, ndjson_line
+from storage import storage
+
+# Rows per storage read; two pages are held at most
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+
+
+@dataclass
+class ExportFilters:
+    """Which conversations an export covers; since is inclusive and until exclusive"""
+    username: Optional[str] = None
+    persona: Optional[str] = None
+    since: Optional[str] = None
+    until: Optional[str] = None
+
+    @classmethod
+    def parse(cls, username: Optional[str] = None, persona: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None) -> 'ExportFilters':
+        """Validate filter values; raises ValueError for an unknown persona or a malformed date"""
+        if persona is not None and not get_persona_prompt(persona):
+            raise ValueError(f"Unknown persona: {persona}")
+        bounds = []
+        for name, value in (('since', since), ('until', until)):
+            try:
+                bounds.append(datetime.fromisoformat(value).isoformat() if value else None)
+            except ValueError:
+                raise ValueError(f"Invalid {name} date: {value}")
+        return cls(username or None, persona, *bounds)
+
+
+class NdjsonEncoder:
+    """One JSON object per line"""
+    media_type = "application/x-ndjson"
+
+    def __init__(self, fields: list, header: bool = True):
+        self.fields = fields
+
+    def encode(self, rows: list) -> bytes:
+        return "".join(ndjson_line(Listing.project(row, self.fields)) for row in rows).encode()
+
+
+class CsvGzipEncoder:
+    """CSV compressed page by page; each page is a complete gzip member.
+
+    Concatenated members are one valid gzip file, so a file cut off after any
+    page is readable as it is and an interrupted export can be continued by
+    appending.
+    """
+    media_type = "application/gzip"
+
+    def __init__(self, fields: list, header: bool = True):
+        self.fields = fields
+        self._header = header
+
+    def encode(self, rows: list) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if self._header:
+            writer.writerow(self.fields)
+            self._header = False
+        for row in rows:
+            writer.writerow(["" if row.get(field) is None else row.get(field) for field in self.fields])
+        return gzip.compress(buffer.getvalue().encode(), compresslevel=6, mtime=0)
+
+
+ENCODERS = {"ndjson": NdjsonEncoder, "csv": CsvGzipEncoder}
+
+
+async def export_pages(filters: ExportFilters, fields: list, after: Optional[tuple], encoder,
+                       page_size: int = EXPORT_PAGE_SIZE) -> AsyncIterator[tuple[bytes, Optional[str], int]]:
+    """Encoded pages of the export, each with the checkpoint cursor after it and its row count.
+
+    An export with no rows is still a valid file, e.g. a CSV with only its
+    header. Raises LookupError when the username filter names no user.
+    """
+    user_id = None
+    if filters.username is not None:
+        user = await storage.get_user(filters.username, 'id')
+        if not user:
+            raise LookupError(f"User not found: {filters.username}")
+        user_id = user['id']
+    columns = EXPORT_LISTING.select_columns(fields)
+
+    async def fetch(after, limit):
+        return await storage.list_conversations_export(
+            columns, limit, after, user_id=user_id, persona=filters.persona,
+            since=filters.since, until=filters.until
+        )
+
+    exported = False
+    async with aclosing(iter_pages(EXPORT_LISTING, fetch, after, page_size)) as pages:
+        async for rows in pages:
+            exported = True
+            yield encoder.encode(rows), EXPORT_LISTING.encode_cursor(rows[-1]), len(rows)
+    if not exported and (data := encoder.encode([])):
+        yield data, None, 0
@@ -0,0 +1,106 @@
+"""Export conversations straight from storage to an NDJSON or gzip CSV file.
+
+Reads the configured storage directly (no server needed) in keyset pages
+of EXPORT_PAGE_SIZE, oldest first, and writes each page as soon as it is
+encoded, so memory stays flat however large the export. With --checkpoint
+the file's length and the cursor after the last written page are saved
+after every page; running the same command again truncates the output to
+that length and continues from the cursor. The checkpoint is removed once
+the export completes.
+
+    python export_cli.py -o conversations.csv.gz --format csv --since 2025-01-01 --checkpoint export.ckpt
+    python export_cli.py --persona kabir --username priya > kabir.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+
+def load_checkpoint(path: str, settings: dict) -> dict:
+    """The saved progress for these settings; raises SystemExit when it is for a different export"""
+    if not os.path.exists(path):
+        return {"cursor": None, "offset": 0, "rows": 0, "settings": settings}
+    with open(path, encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('settings') != settings:
+        raise SystemExit(f"{path} is a checkpoint for a different export; remove it to start over")
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    # Written aside and renamed, so a crash leaves either the old checkpoint or the new one
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+
+async def run(args) -> int:
+    from export import ENCODERS, ExportFilters, export_pages
+    from pagination import EXPORT_LISTING
+    from storage import storage
+
+    try:
+        fields = EXPORT_LISTING.parse_fields(args.fields)
+        filters = ExportFilters.parse(args.username, args.persona, args.since, args.until)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    settings = {"format": args.format, "fields": fields, "filters": vars(filters)}
+    checkpoint = load_checkpoint(args.checkpoint, settings) if args.checkpoint else None
+    resumed = bool(checkpoint and checkpoint['cursor'])
+    after = EXPORT_LISTING.decode_cursor(checkpoint['cursor']) if resumed else None
+    encoder = ENCODERS[args.format](fields, header=not resumed)
+
+    if args.output:
+        output = open(args.output, 'r+b' if resumed else 'wb')
+        # Anything past the checkpoint is a page that was cut off
+        output.truncate(checkpoint['offset'] if resumed else 0)
+        output.seek(0, os.SEEK_END)
+    else:
+        output = sys.stdout.buffer
+    start = time.perf_counter()
+    rows = 0
+    try:
+        async for data, cursor, count in export_pages(filters, fields, after, encoder):
+            output.write(data)
+            output.flush()
+            rows += count
+            if checkpoint is not None:
+                checkpoint.update(cursor=cursor, offset=output.tell(), rows=checkpoint['rows'] + count)
+                save_checkpoint(args.checkpoint, checkpoint)
+    except LookupError as e:
+        raise SystemExit(str(e))
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+        await storage.close()
+
+    seconds = time.perf_counter() - start
+    total = checkpoint['rows'] if checkpoint is not None else rows
+    print(f"{rows} rows in {seconds:.1f}s ({rows / seconds if seconds else 0:.0f} rows/s)"
+          + (f", {total} in total" if resumed else ""), file=sys.stderr)
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson', help='csv is gzip-compressed')
+    parser.add_argument('--username', help='only this user\'s conversations')
+    parser.add_argument('--persona', help='only conversations with this persona')
+    parser.add_argument('--since', help='ISO date or time, inclusive')
+    parser.add_argument('--until', help='ISO date or time, exclusive')
+    parser.add_argument('--fields', help='comma-separated columns (default: all)')
+    parser.add_argument('--checkpoint', help='progress file to resume an interrupted export from')
+    args = parser.parse_args()
+    if args.checkpoint and not args.output:
+        parser.error('--checkpoint needs --output')
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
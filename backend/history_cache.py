@@ -0,0 +1,127 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+# Rough per-turn overhead of the dicts and lists around the text
+TURN_OVERHEAD_BYTES = 256
+
+
+class HistoryCache:
+    """LRU-bounded cache of Gemini chat history keyed by session_id.
+
+    A cold session is loaded from storage once; every finished turn is then
+    appended in place, so a long conversation is never re-read per message.
+    Entries are evicted least-recently-used when either the session count or
+    the approximate memory cap is exceeded. Assumes this process is the only
+    writer for the sessions it serves. Only used from the event loop, and no
+    method awaits while changing an entry, so it needs no lock.
+    """
+
+    def __init__(self, max_sessions: int = 1000, max_bytes: int = 32 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries: OrderedDict[str, tuple[list, int]] = OrderedDict()
+        self._loading: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _turn_size(message: str, response: str) -> int:
+        return len(message.encode()) + len(response.encode()) + TURN_OVERHEAD_BYTES
+
+    def get(self, session_id: str) -> Optional[list]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(session_id)
+        return list(entry[0])
+
+    def put(self, session_id: str, history: list):
+        size = sum(
+            self._turn_size(history[i]['parts'][0], history[i + 1]['parts'][0])
+            for i in range(0, len(history) - 1, 2)
+        )
+        self._remove(session_id)
+        self._entries[session_id] = (list(history), size)
+        self.total_bytes += size
+        self._evict()
+
+    def seed(self, session_id: str, history: list):
+        """Cache history fetched alongside other data, unless a fresher copy is already cached"""
+        if session_id in self._entries:
+            return
+        self.put(session_id, history)
+
+    def append(self, session_id: str, message: str, response: str):
+        """Add a finished turn to a cached session; uncached sessions load fresh later"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        history, size = entry
+        history.append({"role": "user", "parts": [message]})
+        history.append({"role": "model", "parts": [response]})
+        added = self._turn_size(message, response)
+        self._entries[session_id] = (history, size + added)
+        self.total_bytes += added
+        self._entries.move_to_end(session_id)
+        self._evict()
+
+    def invalidate(self, session_id: str):
+        self._remove(session_id)
+
+    async def get_or_load(self, session_id: str, loader: Callable[[], Awaitable[list]]) -> list:
+        """Return cached history, loading it once even if several requests miss together"""
+        history = self.get(session_id)
+        if history is not None:
+            return history
+        pending = self._loading.get(session_id)
+        if pending is not None:
+            return list(await pending)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[session_id] = future
+        try:
+            history = await loader()
+            self.put(session_id, history)
+            future.set_result(history)
+            return list(history)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._loading[session_id]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def _remove(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_sessions or self.total_bytes > self.max_bytes
+        ):
+            _, (_, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+
+history_cache = HistoryCache(
+    max_sessions=int(os.environ.get("HISTORY_CACHE_MAX_SESSIONS", "1000")),
+    max_bytes=int(os.environ.get("HISTORY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+)
@@ -0,0 +1,362 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Optional
+from context import estimate_tokens
+import metrics
+
+breaker_transitions = metrics.registry.counter(
+    "llm_breaker_transitions_total", "LLM circuit breaker state changes", ("state",)
+)
+
+
+_genai = None
+
+
+def load_genai():
+    """Import and configure the Gemini SDK on first use.
+
+    It is by far the slowest import in the app, so serverless cold starts for
+    endpoints that never call the model do not pay for it.
+    """
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY environment variable is not set")
+        genai.configure(api_key=api_key)
+        _genai = genai
+    return _genai
+
+
+class ModelRegistry:
+    """Process-wide cache of GenerativeModel objects keyed by name and generation config"""
+
+    def __init__(self):
+        self._models: dict[tuple, object] = {}
+
+    def get(self, model_name: str, generation_config: Optional[dict] = None):
+        key = (model_name, tuple(sorted((generation_config or {}).items())))
+        model = self._models.get(key)
+        if model is None:
+            model = load_genai().GenerativeModel(model_name=model_name, generation_config=generation_config)
+            self._models[key] = model
+        return model
+
+    async def preload(self):
+        """Import the SDK in a worker thread, so the first model call does not block the event loop"""
+        await asyncio.to_thread(load_genai)
+
+
+WORD = re.compile(r'\S+')
+
+
+class OutputBudget:
+    """Counts reply words incrementally as chunks arrive.
+
+    take() returns the part of a chunk that fits; once the cap is reached the
+    caller should stop reading the upstream stream. When the last allowed
+    word ends a chunk it may continue in the next one, so the budget is only
+    exhausted once that word is known to be whole.
+    """
+
+    def __init__(self, max_words: int):
+        self.max_words = max_words
+        self.words = 0
+        self._in_word = False
+        self._done = False
+
+    @property
+    def exhausted(self) -> bool:
+        return self._done
+
+    def take(self, text: str) -> str:
+        if self._done:
+            return ""
+        if self.words >= self.max_words:
+            # Only the rest of the last allowed word still fits
+            match = WORD.match(text) if self._in_word else None
+            if match is not None and match.end() == len(text):
+                return text
+            self._done = True
+            return match.group() if match is not None else ""
+        for match in WORD.finditer(text):
+            # A chunk can start in the middle of the previous chunk's last word
+            if match.start() == 0 and self._in_word:
+                continue
+            self.words += 1
+            if self.words >= self.max_words and match.end() < len(text):
+                self._done = True
+                return text[:match.end()]
+        if text:
+            self._in_word = not text[-1].isspace()
+        return text
+
+
+class WarmChat:
+    """A live ChatSession plus the bookkeeping needed to keep it in sync with storage.
+
+    A chat prepared ahead of its first message may carry a prefix (the
+    persona context, when there is no history to hold it) that has to be
+    sent in front of that message.
+    """
+
+    def __init__(self, chat, tokens: int, prefix: str = "", prewarmed: bool = False):
+        self.chat = chat
+        self.tokens = tokens
+        self.prefix = prefix
+        self.prewarmed = prewarmed
+        self.contents = list(chat.history)
+        self.last_used = time.monotonic()
+
+    def fits(self, message: str, token_budget: int) -> bool:
+        return self.tokens + estimate_tokens(self.prefix + message) <= token_budget
+
+    def commit_turn(self, sent: str, response: str):
+        """Record the turn as stored, replacing whatever the SDK buffered for it"""
+        self.chat.history = self.contents + [
+            {"role": "user", "parts": [sent]},
+            {"role": "model", "parts": [response]}
+        ]
+        self.contents = list(self.chat.history)
+        self.tokens += estimate_tokens(sent) + estimate_tokens(response)
+        self.prefix = ""
+        self.prewarmed = False
+
+
+class ChatPool:
+    """LRU pool of warm chat sessions keyed by session_id, with idle-time eviction.
+
+    A request checks a chat out for the length of one turn and checks it back
+    in after the turn is persisted, so two concurrent requests for the same
+    session never share a ChatSession.
+    """
+
+    def __init__(self, max_sessions: int = 500, idle_seconds: float = 900.0):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._chats: OrderedDict[str, WarmChat] = OrderedDict()
+
+    def checkout(self, session_id: str) -> Optional[WarmChat]:
+        self._evict_idle()
+        warm = self._chats.pop(session_id, None)
+        if warm is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return warm
+
+    def checkin(self, session_id: str, warm: WarmChat):
+        warm.last_used = time.monotonic()
+        self._chats[session_id] = warm
+        self._chats.move_to_end(session_id)
+        while len(self._chats) > self.max_sessions:
+            self._chats.popitem(last=False)
+            self.evictions += 1
+
+    def offer(self, session_id: str, warm: WarmChat) -> bool:
+        """Pool a chat prepared ahead of time, unless the session already has one"""
+        if session_id in self._chats:
+            return False
+        self.checkin(session_id, warm)
+        return True
+
+    def has(self, session_id: str) -> bool:
+        return session_id in self._chats
+
+    def invalidate(self, session_id: str):
+        self._chats.pop(session_id, None)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._chats:
+            session_id, warm = next(iter(self._chats.items()))
+            if warm.last_used > cutoff:
+                break
+            del self._chats[session_id]
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._chats),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+class Deadline:
+    """A request's total time budget for talking to the model"""
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, cap: float) -> float:
+        """Timeout for one step: its own cap, but never past the deadline"""
+        return min(cap, self.remaining())
+
+
+async def iterate_within(deadline: Deadline, iterator) -> AsyncIterator:
+    """Yield from an async iterator, raising TimeoutError if the deadline passes mid-stream"""
+    while True:
+        try:
+            item = await asyncio.wait_for(iterator.__anext__(), timeout=deadline.remaining())
+        except StopAsyncIteration:
+            return
+        yield item
+
+
+# Set once a response did not have the shape _upstream_call expects
+_upstream_shape_warned = False
+
+
+def _upstream_call(iterator):
+    """The cancellable RPC behind an SDK response's iterator, or None if it cannot be found.
+
+    This reads private internals of google-generativeai 0.3 and
+    google-api-core (see requirements.txt), so any other shape is logged
+    once and the reply is left to finish upstream as before.
+    """
+    global _upstream_shape_warned
+    if hasattr(iterator, 'cancel'):
+        return iterator
+    try:
+        # google-api-core wraps the gRPC call in an async generator method
+        # (_wrapped_aiter); the call is that generator's `self`
+        frame = iterator.ag_frame
+        if frame is None:
+            # The generator has finished, and the call with it
+            return None
+        owner = frame.f_locals['self']
+        if hasattr(owner, 'cancel'):
+            return owner
+    except (AttributeError, KeyError):
+        pass
+    if not _upstream_shape_warned:
+        _upstream_shape_warned = True
+        print(f"Upstream cancel unavailable: unexpected SDK stream iterator {type(iterator).__name__}")
+    return None
+
+
+async def close_stream(response, chunks=None):
+    """Stop a streaming reply upstream, so generation (and billing) ends now.
+
+    Closing the iterator from aiter(response) only closes the SDK's wrapper
+    generator; the RPC under response._iterator keeps running until it is
+    garbage-collected. The call is cancelled explicitly, then both iterators
+    are closed. Cancelling a call that already finished does nothing.
+    """
+    iterator = getattr(response, '_iterator', None)
+    call = _upstream_call(iterator)
+    if call is not None:
+        call.cancel()
+    for it in (chunks, iterator):
+        if hasattr(it, 'aclose'):
+            try:
+                await it.aclose()
+            except Exception as e:
+                print(f"Stream close error: {e!r}")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the breaker is open"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("LLM circuit breaker is open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling the model after repeated failures, then probes before closing again.
+
+    After failure_threshold consecutive failures the breaker opens and every
+    call fails fast for reset_seconds. It then goes half-open and lets up to
+    half_open_probes calls through; one success closes it, a failure opens
+    it for another reset_seconds. A call that ends neither way (cancelled)
+    must call abandon(), or its probe slot stays taken.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0, half_open_probes: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.short_circuited = 0
+
+    def _transition(self, state: str):
+        if state != self.state:
+            self.state = state
+            breaker_transitions.inc(state)
+
+    def retry_after(self) -> int:
+        return max(1, int(self.opened_at + self.reset_seconds - time.monotonic()) + 1)
+
+    def rejecting(self) -> bool:
+        """True while calls would fail fast; does not take a probe slot"""
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_seconds
+
+    def allow(self):
+        """Take permission for one call; raises CircuitOpenError when the call must not be made"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                self.short_circuited += 1
+                raise CircuitOpenError(self.retry_after())
+            self._transition(self.HALF_OPEN)
+            self.probes = 0
+        if self.state == self.HALF_OPEN:
+            if self.probes >= self.half_open_probes:
+                self.short_circuited += 1
+                raise CircuitOpenError(1)
+            self.probes += 1
+
+    def abandon(self):
+        """Give back a call's probe slot without counting a result, e.g. when it was cancelled"""
+        if self.state == self.HALF_OPEN and self.probes > 0:
+            self.probes -= 1
+
+    def record_success(self):
+        self.failures = 0
+        self.probes = 0
+        self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.probes = 0
+            self._transition(self.OPEN)
+
+    def stats(self) -> dict:
+        return {
+            "state_code": {self.CLOSED: 0, self.HALF_OPEN: 1, self.OPEN: 2}[self.state],
+            "consecutive_failures": self.failures,
+            "short_circuited": self.short_circuited
+        }
+
+
+model_registry = ModelRegistry()
+llm_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES", "5")),
+    reset_seconds=float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30")),
+    half_open_probes=int(os.environ.get("LLM_BREAKER_PROBES", "1"))
+)
+chat_pool = ChatPool(
+    max_sessions=int(os.environ.get("CHAT_POOL_MAX_SESSIONS", "500")),
+    idle_seconds=float(os.environ.get("CHAT_POOL_IDLE_SECONDS", "900"))
+)
@@ -0,0 +1,173 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+
+# Seconds; covers sub-millisecond cache hits up to slow LLM generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels_text(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(34), "")}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed label set, rendered in Prometheus text format"""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [bucket counts..., sum, count]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _labels_text(self.labels + ("le",), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels_text(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            labels = _labels_text(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_labels_text(self.labels, label_values)} {value}")
+        return lines
+
+
+class Registry:
+    """Holds the process's metrics plus callbacks that report component stats as gauges"""
+
+    def __init__(self, prefix: str = "guardian"):
+        self.prefix = prefix
+        self._metrics: list = []
+        self._collectors: dict[str, Callable[[], dict]] = {}
+
+    def histogram(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.prefix}_{name}", help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: tuple = ()) -> Counter:
+        metric = Counter(f"{self.prefix}_{name}", help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, name: str, collect: Callable[[], dict]):
+        """Expose every numeric value of collect() as a gauge named <prefix>_<name>_<key>"""
+        self._collectors[name] = collect
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, collect in self._collectors.items():
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Metrics collector {name} error: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric_name = f"{self.prefix}_{name}_{key}"
+                lines.append(f"# TYPE {metric_name} gauge")
+                lines.append(f"{metric_name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_seconds = registry.histogram(
+    "http_request_duration_seconds", "Total request time including streaming", ("endpoint", "method", "status")
+)
+request_ttfb_seconds = registry.histogram(
+    "http_time_to_first_byte_seconds", "Time until the first response body bytes", ("endpoint", "method")
+)
+stage_seconds = registry.histogram(
+    "stage_duration_seconds", "Time spent in each stage of request handling", ("stage", "persona")
+)
+# path: cold (chat built for the request), prewarmed (built at persona selection), warm (a follow-up),
+# cached (an opener replayed from the response cache)
+chat_first_token_seconds = registry.histogram(
+    "chat_first_token_seconds", "Time from a chat request to the first model chunk", ("path",)
+)
+
+
+@contextmanager
+def span(stage: str, persona: str = ""):
+    """Time a block of request handling into stage_duration_seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage, persona)
+
+
+def observe_stage(stage: str, seconds: float, persona: str = ""):
+    stage_seconds.observe(seconds, stage, persona)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-endpoint latency and time to first byte"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        state = {"status": 500, "first_byte": None}
+
+        async def timed_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            elif message["type"] == "http.response.body" and state["first_byte"] is None:
+                state["first_byte"] = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            # The router stores the matched endpoint in the scope
+            endpoint = scope.get("endpoint")
+            name = getattr(endpoint, "__name__", "unmatched")
+            method = scope.get("method", "")
+            request_seconds.observe(time.perf_counter() - start, name, method, state["status"])
+            if state["first_byte"] is not None:
+                request_ttfb_seconds.observe(state["first_byte"] - start, name, method)
@@ -0,0 +1,122 @@
+import asyncio
+import base64
+import json
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+# Largest page a client may ask for; NDJSON streams use it as the fetch size
+MAX_PAGE_SIZE = 500
+DEFAULT_PAGE_SIZE = 50
+
+
+class Listing:
+    """Describes a keyset-paginated listing: its columns and the column it is ordered by"""
+
+    def __init__(self, cursor_column: str, columns: tuple, default_columns: tuple):
+        self.cursor_column = cursor_column
+        self.columns = columns
+        self.default_columns = default_columns
+
+    def parse_fields(self, fields: Optional[str]) -> list:
+        """Validate a comma-separated field list; raises ValueError for unknown columns"""
+        if not fields:
+            return list(self.default_columns)
+        requested = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in requested if f not in self.columns]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return requested
+
+    def select_columns(self, fields: list) -> str:
+        """Requested columns plus the ones the cursor is built from"""
+        needed = list(fields)
+        for column in (self.cursor_column, 'id'):
+            if column not in needed:
+                needed.append(column)
+        return ','.join(needed)
+
+    def encode_cursor(self, row: dict) -> str:
+        raw = json.dumps([row[self.cursor_column], row['id']], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor: Optional[str]) -> Optional[tuple]:
+        """Turn an opaque cursor back into (value, id); raises ValueError if it is malformed"""
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            value, row_id = json.loads(raw)
+        except Exception:
+            raise ValueError("Invalid cursor")
+        return value, row_id
+
+    @staticmethod
+    def project(row: dict, fields: list) -> dict:
+        return {field: row.get(field) for field in fields}
+
+
+SESSION_LISTING = Listing(
+    cursor_column='last_activity',
+    columns=('id', 'user_id', 'persona', 'is_active', 'session_start', 'last_activity'),
+    default_columns=('id', 'persona', 'is_active', 'session_start', 'last_activity'),
+)
+CONVERSATION_LISTING = Listing(
+    cursor_column='created_at',
+    columns=('id', 'user_id', 'session_id', 'persona', 'message', 'response', 'token_count', 'created_at'),
+    default_columns=('id', 'persona', 'message', 'response', 'token_count', 'created_at'),
+)
+# Every conversation across sessions, for the bulk export
+EXPORT_LISTING = Listing(
+    cursor_column='created_at',
+    columns=CONVERSATION_LISTING.columns,
+    default_columns=CONVERSATION_LISTING.columns,
+)
+
+# fetch(after, limit) returns the next rows of a listing
+PageFetcher = Callable[[Optional[tuple], int], Awaitable[list]]
+
+
+async def fetch_page(listing: Listing, fetch: PageFetcher, after: Optional[tuple], limit: int) -> tuple:
+    """One page and the cursor of the page after it (None on the last page)"""
+    # One extra row tells whether another page exists without a second request
+    rows = await fetch(after, limit + 1)
+    next_cursor = listing.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+async def iter_pages(listing: Listing, fetch: PageFetcher, after: Optional[tuple],
+                     page_size: int = MAX_PAGE_SIZE) -> AsyncIterator[list]:
+    """Every page past the cursor, fetching the next one while the current one is consumed.
+
+    At most two pages are held at a time, so memory does not grow with the
+    length of the listing.
+    """
+    pending = asyncio.ensure_future(fetch(after, page_size))
+    try:
+        while pending is not None:
+            rows = await pending
+            pending = None
+            if len(rows) == page_size:
+                last = rows[-1]
+                pending = asyncio.ensure_future(
+                    fetch((last[listing.cursor_column], last['id']), page_size)
+                )
+            if rows:
+                yield rows
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def iter_rows(listing: Listing, fetch: PageFetcher, after: Optional[tuple],
+                    page_size: int = MAX_PAGE_SIZE) -> AsyncIterator[dict]:
+    """Every row past the cursor, one prefetched page at a time"""
+    async with aclosing(iter_pages(listing, fetch, after, page_size)) as pages:
+        async for rows in pages:
+            for row in rows:
+                yield row
+
+
+def ndjson_line(row: dict) -> str:
+    return json.dumps(row, default=str) + "\n"
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Optional
+import config
+from storage import storage
+
+
+class WriteBehindQueue:
+    """Batches conversation inserts into bulk writes.
+
+    Writes are queued in memory and flushed when max_batch rows are waiting or
+    flush_interval seconds have passed, whichever comes first. A failed batch
+    goes back to the front of the queue and is retried with backoff. Everything
+    still queued is flushed on shutdown. Queued rows get their id up front and
+    stay visible to readers until their insert has committed, including while
+    it is in flight. With enabled=False every write goes
+    straight to storage, which is what serverless deployments that freeze
+    between requests need.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_batch: int = 50,
+        flush_interval: float = 0.5,
+        max_retries: int = 5,
+        max_pending: int = 10000,
+    ):
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self._conversations: list[tuple[float, dict]] = []
+        # The batch being inserted; its rows may or may not be in storage yet
+        self._in_flight: list[tuple[float, dict]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._failures = 0
+        self.inserted = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+
+    def _ensure_worker(self):
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def add_conversation(self, conversation: dict):
+        if not self.enabled:
+            await storage.insert_conversation(conversation)
+            return
+        self._ensure_worker()
+        # Lets readers tell a queued row from the same row once it is stored
+        conversation.setdefault('id', str(uuid.uuid4()))
+        if len(self._conversations) >= self.max_pending:
+            self._conversations.pop(0)
+            self.dropped += 1
+            print("Write-behind queue full, dropping oldest conversation")
+        self._conversations.append((time.monotonic(), conversation))
+        if len(self._conversations) >= self.max_batch:
+            self._wake.set()
+
+    def pending_conversations(self, session_id: str) -> list:
+        """Rows for a session not known to be stored yet, oldest first, so reads can see them"""
+        return [row for _, row in self._in_flight + self._conversations if row.get('session_id') == session_id]
+
+    def in_flight(self, row_id: str) -> bool:
+        """Whether a row is in the batch being inserted, so may be both stored and pending"""
+        return any(row['id'] == row_id for _, row in self._in_flight)
+
+    def merge_pending(self, session_id: str, stored: list) -> list:
+        """Stored rows (with ids) followed by the session's rows that did not make it into them"""
+        seen = {row.get('id') for row in stored}
+        return stored + [row for row in self.pending_conversations(session_id) if row['id'] not in seen]
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not await self.flush() and self._failures:
+                # Back off while storage is failing
+                await asyncio.sleep(min(30.0, self.flush_interval * 2 ** self._failures))
+
+    async def flush(self) -> bool:
+        """Write everything queued so far; returns False if a batch failed"""
+        if self._flush_lock is None:
+            return True
+        async with self._flush_lock:
+            ok = True
+            while self._conversations:
+                batch = self._conversations[:self.max_batch]
+                del self._conversations[:self.max_batch]
+                self._in_flight = batch
+                try:
+                    await storage.insert_conversations([row for _, row in batch])
+                    self.inserted += len(batch)
+                    self.batches += 1
+                    self._failures = 0
+                except Exception as e:
+                    ok = self._retry(batch, e)
+                    break
+                finally:
+                    self._in_flight = []
+            return ok
+
+    def _retry(self, batch: list, error: Exception) -> bool:
+        self._failures += 1
+        if self._failures > self.max_retries:
+            print(f"Write-behind giving up on {len(batch)} conversations after {self.max_retries} retries: {error}")
+            self.dropped += len(batch)
+            self._failures = 0
+            return False
+        print(f"Write-behind insert error (attempt {self._failures}), retrying: {error}")
+        self.retries += 1
+        self._conversations[:0] = batch
+        return False
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        # Give a failing store a few chances before shutdown completes
+        for _ in range(self.max_retries + 1):
+            if await self.flush():
+                break
+
+    def stats(self) -> dict:
+        oldest = self._conversations[0][0] if self._conversations else None
+        return {
+            "queue_depth": len(self._conversations),
+            "oldest_seconds": time.monotonic() - oldest if oldest is not None else 0.0,
+            "inserted": self.inserted,
+            "batches": self.batches,
+            "retries": self.retries,
+            "dropped": self.dropped
+        }
+
+
+write_behind = WriteBehindQueue(
+    enabled=os.environ.get("WRITE_BEHIND", "0" if config.SERVERLESS else "1") == "1",
+    max_batch=int(os.environ.get("WRITE_BEHIND_BATCH", "50")),
+    flush_interval=float(os.environ.get("WRITE_BEHIND_INTERVAL", "0.5"))
+)
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable
+import metrics
+
+prewarm_seconds = metrics.registry.histogram(
+    "prewarm_duration_seconds", "Time taken to warm a session after persona selection", ("outcome",)
+)
+
+
+class Prewarmer:
+    """Runs a session's first-message setup in the background once its persona is selected.
+
+    At most one warm-up runs per session, and at most max_pending in total;
+    beyond that selections simply are not prewarmed. A chat request for a
+    session that is still warming waits for it, up to wait_seconds, rather
+    than repeating the same history load and model setup alongside it.
+    """
+
+    def __init__(self, enabled: bool = True, wait_seconds: float = 2.0, max_pending: int = 100):
+        self.enabled = enabled
+        self.wait_seconds = wait_seconds
+        self.max_pending = max_pending
+        self._pending: dict[str, asyncio.Task] = {}
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.waited = 0
+
+    def start(self, session_id: str, warm_up: Callable[[], Awaitable[None]]) -> bool:
+        if not self.enabled or session_id in self._pending:
+            return False
+        if len(self._pending) >= self.max_pending:
+            self.skipped += 1
+            return False
+        self.started += 1
+        self._pending[session_id] = asyncio.get_running_loop().create_task(self._run(session_id, warm_up))
+        return True
+
+    async def _run(self, session_id: str, warm_up: Callable[[], Awaitable[None]]):
+        start = time.perf_counter()
+        try:
+            await warm_up()
+            self.completed += 1
+            prewarm_seconds.observe(time.perf_counter() - start, "completed")
+        except Exception as e:
+            self.failed += 1
+            prewarm_seconds.observe(time.perf_counter() - start, "failed")
+            print(f"Prewarm error: {e}")
+        finally:
+            del self._pending[session_id]
+
+    async def wait(self, session_id: str):
+        """Let a warm-up already running for the session finish first"""
+        task = self._pending.get(session_id)
+        if task is None:
+            return
+        self.waited += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=self.wait_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "waited": self.waited
+        }
+
+
+prewarmer = Prewarmer(
+    enabled=os.environ.get("PREWARM", "1") == "1",
+    wait_seconds=float(os.environ.get("PREWARM_WAIT_SECONDS", "2"))
+)
@@ -1,76 +1,272 @@
+import asyncio
 import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
-from datetime import date, datetime
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
 from models import User
+import config
+from storage import storage
 
-# Load environment and create supabase client directly
-load_dotenv()
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
 
-class RateLimiter:
-    DAILY_MESSAGE_LIMIT = 50
-    TOKEN_LIMIT = 1000
-    
-    @staticmethod
-    def check_and_update_user_limits(username: str) -> tuple[bool, int]:
+@dataclass
+class UserLimits:
+    """Per-user counters for the current day"""
+    username: str
+    day: str
+    message_count: int = 0
+    token_count: int = 0
+    dirty: bool = False
+
+    def roll_over(self, today: str):
+        if self.day != today:
+            self.day = today
+            self.message_count = 0
+            self.token_count = 0
+            self.dirty = True
+
+    @classmethod
+    def from_row(cls, username: str, user: dict) -> 'UserLimits':
+        return cls(
+            username,
+            str(user.get('last_reset_date')),
+            user.get('daily_message_count') or 0,
+            user.get('daily_token_count') or 0
+        )
+
+    def to_row(self) -> dict:
+        return {
+            'username': self.username,
+            'daily_message_count': self.message_count,
+            'daily_token_count': self.token_count,
+            'last_reset_date': self.day
+        }
+
+
+class MemoryLimiterEngine:
+    """Keeps counters in process and writes them back to storage in periodic batches.
+
+    Check-and-increment happens without awaiting, so concurrent requests from
+    one user cannot both pass the limit. Only correct when a single process
+    serves all traffic for a user; use the atomic engine otherwise.
+    The window is the calendar day, not a sliding window or token bucket:
+    the quota is "messages per day", shown to users as what is left today,
+    and both engines share the users table's daily counters. So a user
+    can spend one day's allowance just before midnight and the next
+    day's just after.
+    """
+
+    counts_in_storage = False
+
+    def __init__(self, message_limit: int, token_limit: int, sync_interval: float = 5.0):
+        self.message_limit = message_limit
+        self.token_limit = token_limit
+        self.sync_interval = sync_interval
+        self.users: dict[str, UserLimits] = {}
+        self._loading: dict[str, asyncio.Future] = {}
+        self._sync_task: Optional[asyncio.Task] = None
+
+    async def _load(self, username: str) -> UserLimits:
+        limits = self.users.get(username)
+        if limits is not None:
+            return limits
+        # Concurrent first requests for a user share one storage lookup
+        pending = self._loading.get(username)
+        if pending is not None:
+            return await pending
+        future = asyncio.get_running_loop().create_future()
+        self._loading[username] = future
         try:
-            # Get or create user
-            user_data = supabase.table('users').select('*').eq('username', username).execute()
-            
-            if not user_data.data:
-                # Create new user
-                new_user = {
-                    'username': username,
-                    'daily_message_count': 1,
-                    'last_reset_date': str(date.today())
-                }
-                supabase.table('users').insert(new_user).execute()
-                return True, RateLimiter.DAILY_MESSAGE_LIMIT - 1
-            
-            user = user_data.data[0]
             today = str(date.today())
-            
-            # Reset daily count if new day
-            if user['last_reset_date'] != today:
-                supabase.table('users').update({
-                    'daily_message_count': 1,
+            user = await storage.get_user(username)
+            if not user:
+                await storage.create_user({
+                    'username': username,
+                    'daily_message_count': 0,
                     'last_reset_date': today
-                }).eq('username', username).execute()
-                return True, RateLimiter.DAILY_MESSAGE_LIMIT - 1
-            
-            # Check if limit exceeded
-            if user['daily_message_count'] >= RateLimiter.DAILY_MESSAGE_LIMIT:
-                return False, 0
-            
-            # Increment count
-            new_count = user['daily_message_count'] + 1
-            supabase.table('users').update({
-                'daily_message_count': new_count
-            }).eq('username', username).execute()
-            
-            remaining = RateLimiter.DAILY_MESSAGE_LIMIT - new_count
-            return True, remaining
-            
+                })
+                limits = UserLimits(username, today)
+            else:
+                limits = UserLimits.from_row(username, user)
+            self.users[username] = limits
+            future.set_result(limits)
+            return limits
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be awaiting; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            del self._loading[username]
+
+    def _ensure_sync_task(self):
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.get_running_loop().create_task(self._sync_loop())
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write every changed counter back to storage in one bulk upsert"""
+        dirty = [limits for limits in self.users.values() if limits.dirty]
+        if not dirty:
+            return
+        for limits in dirty:
+            limits.dirty = False
+        try:
+            await storage.save_user_limits([limits.to_row() for limits in dirty])
         except Exception as e:
-            print(f"Rate limiter error: {e}")
-            return False, 0
-    
+            print(f"Rate limiter sync error: {e}")
+            for limits in dirty:
+                limits.dirty = True
+
+    async def check_and_increment(self, username: str, tokens: int) -> Optional[UserLimits]:
+        self._ensure_sync_task()
+        limits = await self._load(username)
+        limits.roll_over(str(date.today()))
+        if limits.message_count >= self.message_limit or limits.token_count >= self.token_limit:
+            return None
+        limits.message_count += 1
+        limits.token_count += tokens
+        limits.dirty = True
+        return limits
+
+    async def record_tokens(self, username: str, tokens: int):
+        limits = await self._load(username)
+        limits.roll_over(str(date.today()))
+        limits.token_count += tokens
+        limits.dirty = True
+
+    def peek(self, username: str) -> Optional[UserLimits]:
+        """Counters already held in memory, without touching storage"""
+        limits = self.users.get(username)
+        if limits is not None:
+            limits.roll_over(str(date.today()))
+        return limits
+
+    def prime(self, username: str, user: dict):
+        """Adopt counters read by another query; local counts stay authoritative once loaded"""
+        if username not in self.users:
+            self.users[username] = UserLimits.from_row(username, user)
+
+    async def get_limits(self, username: str) -> UserLimits:
+        limits = self.users.get(username)
+        if limits is None:
+            # Read-only lookups should not create users
+            user = await storage.get_user(username)
+            if not user:
+                return UserLimits(username, str(date.today()))
+            limits = self.users.setdefault(username, UserLimits.from_row(username, user))
+        limits.roll_over(str(date.today()))
+        return limits
+
+    async def close(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+        await self.flush()
+
+
+class AtomicLimiterEngine:
+    """Delegates check-and-increment to one storage-side atomic call per message.
+
+    Safe across processes. The last result for each user is mirrored locally
+    so remaining-message lookups do not need another query.
+    """
+
+    counts_in_storage = True
+
+    def __init__(self, message_limit: int, token_limit: int):
+        self.message_limit = message_limit
+        self.token_limit = token_limit
+        self.users: dict[str, UserLimits] = {}
+
+    def _remember(self, username: str, today: str, result: dict) -> UserLimits:
+        limits = UserLimits(username, today, result['message_count'], result['token_count'])
+        self.users[username] = limits
+        return limits
+
+    async def check_and_increment(self, username: str, tokens: int) -> Optional[UserLimits]:
+        today = str(date.today())
+        result = await storage.check_rate_limit(
+            username, today, self.message_limit, self.token_limit, tokens
+        )
+        limits = self._remember(username, today, result)
+        return limits if result['allowed'] else None
+
+    async def record_tokens(self, username: str, tokens: int):
+        today = str(date.today())
+        await storage.record_token_usage(username, today, tokens)
+        limits = self.users.get(username)
+        if limits is not None and limits.day == today:
+            limits.token_count += tokens
+
+    def peek(self, username: str) -> Optional[UserLimits]:
+        limits = self.users.get(username)
+        if limits is not None:
+            limits.roll_over(str(date.today()))
+        return limits
+
+    def prime(self, username: str, user: dict):
+        """Mirror counters returned by storage, which always has the latest count"""
+        self.users[username] = UserLimits.from_row(username, user)
+
+    async def get_limits(self, username: str) -> UserLimits:
+        today = str(date.today())
+        limits = self.users.get(username)
+        if limits is None:
+            user = await storage.get_user(username)
+            if not user:
+                return UserLimits(username, today)
+            limits = UserLimits.from_row(username, user)
+            self.users[username] = limits
+        limits.roll_over(today)
+        return limits
+
+    async def close(self):
+        pass
+
+
+def create_engine(name: str, message_limit: int, token_limit: int):
+    """Build the limiter engine selected by RATE_LIMIT_ENGINE"""
+    if name == 'atomic':
+        return AtomicLimiterEngine(message_limit, token_limit)
+    if name == 'memory':
+        return MemoryLimiterEngine(
+            message_limit,
+            token_limit,
+            sync_interval=float(os.environ.get("RATE_LIMIT_SYNC_INTERVAL", "5"))
+        )
+    raise ValueError(f"Unknown rate limit engine: {name}")
+
+
+class RateLimiter:
+    DAILY_MESSAGE_LIMIT = 50
+    # Tokens are words of messages and replies; a turn is about 40, so the default lets the message limit bind
+    TOKEN_LIMIT = int(os.environ.get("DAILY_TOKEN_LIMIT", "2500"))
+    # Per-instance counters would multiply the limit by the number of serverless instances
+    engine = create_engine(
+        os.environ.get("RATE_LIMIT_ENGINE", "atomic" if config.SERVERLESS else "memory"),
+        DAILY_MESSAGE_LIMIT, TOKEN_LIMIT
+    )
+
     @staticmethod
-    def get_remaining_messages(username: str) -> int:
+    def has_room(limits: UserLimits) -> bool:
+        return (limits.message_count < RateLimiter.DAILY_MESSAGE_LIMIT
+                and limits.token_count < RateLimiter.TOKEN_LIMIT)
+
+    @staticmethod
+    def remaining(limits: Optional[UserLimits]) -> tuple[int, int]:
+        """Messages and tokens left today; a user with no counters has the full allowance"""
+        if limits is None:
+            return RateLimiter.DAILY_MESSAGE_LIMIT, RateLimiter.TOKEN_LIMIT
+        return (max(0, RateLimiter.DAILY_MESSAGE_LIMIT - limits.message_count),
+                max(0, RateLimiter.TOKEN_LIMIT - limits.token_count))
+
+    @staticmethod
+    async def record_tokens(username: str, tokens: int):
+        """Add response tokens to the user's daily token usage"""
         try:
-            user_data = supabase.table('users').select('*').eq('username', username).execute()
-            if not user_data.data:
-                return RateLimiter.DAILY_MESSAGE_LIMIT
-            
-            user = user_data.data[0]
-            today = str(date.today())
-            
-            if user['last_reset_date'] != today:
-                return RateLimiter.DAILY_MESSAGE_LIMIT
-            
-            return max(0, RateLimiter.DAILY_MESSAGE_LIMIT - user['daily_message_count'])
-        except:
-            return 0
+            await RateLimiter.engine.record_tokens(username, tokens)
+        except Exception as e:
+            print(f"Rate limiter token record error: {e}")
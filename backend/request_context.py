@@ -0,0 +1,159 @@
+import os
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+from rate_limiter import RateLimiter
+from storage import storage
+
+
+@dataclass
+class RequestContext:
+    """Everything a request needs to know about its user before doing real work"""
+    user_id: Optional[str]
+    allowed: bool
+    remaining_messages: int
+    remaining_tokens: int
+    session_id: Optional[str] = None
+    session_created: bool = False
+    # Stored turns ({id, message, response}), oldest first; None unless the session's whole history was returned
+    history: Optional[list] = None
+
+
+class RequestContextResolver:
+    """Resolves user, daily limits, active session and recent history in one storage call.
+
+    With use_rpc the work is a single resolve_request_context() call (see
+    sql/request_context.sql); otherwise, the default, the same answer is
+    assembled from sequential queries, so a database without the function
+    keeps working until the migration is applied.
+    The memory limiter engine keeps counting locally: storage only seeds its
+    counters, and a user already known to be over the limit is rejected
+    without any storage call at all.
+    """
+
+    def __init__(self, use_rpc: bool = False, history_turns: int = 20):
+        self.use_rpc = use_rpc
+        self.history_turns = history_turns
+
+    async def resolve(
+        self,
+        username: str,
+        persona: Optional[str] = None,
+        tokens: int = 0,
+        count_message: bool = False,
+        create_user: bool = False,
+        want_history: bool = False,
+    ) -> RequestContext:
+        engine = RateLimiter.engine
+        cached = engine.peek(username)
+        if cached is not None and not engine.counts_in_storage:
+            if count_message and not RateLimiter.has_room(cached):
+                return RequestContext(None, False, *RateLimiter.remaining(cached))
+            if persona is None and not count_message:
+                # Limit lookups for a known user need nothing from storage
+                return RequestContext(None, True, *RateLimiter.remaining(cached))
+
+        count_in_storage = count_message and engine.counts_in_storage
+        params = dict(
+            username=username,
+            today=str(date.today()),
+            persona=persona,
+            create_user=create_user,
+            count_message=count_in_storage,
+            message_limit=RateLimiter.DAILY_MESSAGE_LIMIT,
+            token_limit=RateLimiter.TOKEN_LIMIT,
+            tokens=tokens,
+            history_turns=self.history_turns if want_history else 0
+        )
+        if self.use_rpc:
+            row = await storage.resolve_request_context(**params)
+        else:
+            row = await self._resolve_sequential(**params)
+
+        if row['user_id'] is None:
+            return RequestContext(None, False, *RateLimiter.remaining(None))
+
+        engine.prime(username, {
+            'daily_message_count': row['message_count'],
+            'daily_token_count': row['token_count'],
+            'last_reset_date': row['last_reset_date']
+        })
+        allowed = row['allowed']
+        if count_message and not count_in_storage:
+            allowed = await engine.check_and_increment(username, tokens) is not None
+
+        history = None
+        if row.get('history_complete') and row.get('history') is not None:
+            history = list(row['history'])
+
+        return RequestContext(
+            row['user_id'],
+            allowed,
+            *RateLimiter.remaining(engine.peek(username)),
+            session_id=row.get('session_id'),
+            session_created=bool(row.get('session_created')),
+            history=history
+        )
+
+    @staticmethod
+    async def count_turn(username: str, tokens: int = 0, count_message: bool = True) -> RequestContext:
+        """Limits for a turn whose user and session are already known, e.g. on an open WebSocket.
+
+        Only the message is counted: the memory engine does that locally and
+        the atomic engine with a single check_rate_limit() call.
+        """
+        engine = RateLimiter.engine
+        allowed = True
+        if count_message:
+            allowed = await engine.check_and_increment(username, tokens) is not None
+        limits = engine.peek(username)
+        if limits is None:
+            limits = await engine.get_limits(username)
+        return RequestContext(None, allowed, *RateLimiter.remaining(limits))
+
+    @staticmethod
+    async def _resolve_sequential(username: str, today: str, persona: Optional[str], create_user: bool,
+                                  count_message: bool, message_limit: int, token_limit: int,
+                                  tokens: int, history_turns: int) -> dict:
+        """The RPC's answer built from individual queries; history is left to the caller"""
+        allowed = True
+        if count_message:
+            result = await storage.check_rate_limit(username, today, message_limit, token_limit, tokens)
+            allowed = result['allowed']
+        user = await storage.get_user(username)
+        if not user and create_user:
+            user = await storage.create_user({
+                'username': username,
+                'daily_message_count': 0,
+                'last_reset_date': today
+            })
+        if not user:
+            return {'user_id': None, 'allowed': False}
+
+        session_id = None
+        session_created = False
+        if allowed and persona is not None:
+            session = await storage.get_active_session(user['id'], persona)
+            if session:
+                session_id = session['id']
+            else:
+                session_id = (await storage.create_session(user['id'], persona))['id']
+                session_created = True
+
+        return {
+            'user_id': user['id'],
+            'allowed': allowed,
+            'message_count': user.get('daily_message_count') or 0,
+            'token_count': user.get('daily_token_count') or 0,
+            'last_reset_date': user.get('last_reset_date'),
+            'session_id': session_id,
+            'session_created': session_created,
+            'history': [] if session_created else None,
+            'history_complete': session_created
+        }
+
+
+request_context = RequestContextResolver(
+    use_rpc=os.environ.get("REQUEST_CONTEXT_RPC", "0") == "1",
+    history_turns=int(os.environ.get("REQUEST_CONTEXT_HISTORY_TURNS", "20"))
+)
@@ -0,0 +1,116 @@
+import os
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+import metrics
+
+lookups = metrics.registry.counter(
+    "response_cache_lookups_total", "First-turn response cache lookups", ("persona", "outcome")
+)
+
+_REPEATS = re.compile(r"(\w)\1{2,}")
+
+
+class ResponseCache:
+    """Replies to a session's opening message, keyed by persona and normalized message.
+
+    Only the first turn of a session is cached: with no history its prompt is
+    just the persona context plus the message, so the reply holds nothing
+    about the user. Each key collects up to `variants` real replies before it
+    starts serving them, and a hit picks one of them (never the one served
+    last) so openers do not read as canned. Replies expire after ttl_seconds
+    one by one, which lets a key refill from the model gradually; keys are
+    evicted least-recently-used beyond max_entries.
+    """
+
+    def __init__(self, enabled: bool = True, max_entries: int = 500, variants: int = 3,
+                 ttl_seconds: float = 3600.0, max_words: int = 5):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.variants = variants
+        self.ttl_seconds = ttl_seconds
+        self.max_words = max_words
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.expired = 0
+        self.evictions = 0
+        # key -> (replies as [(expires_at, chunks)], index served last)
+        self._entries: OrderedDict[tuple, list] = OrderedDict()
+
+    def key(self, persona: str, message: str) -> Optional[tuple]:
+        """Cache key for an opener, or None for a message too long to be a greeting"""
+        if not self.enabled:
+            return None
+        words = re.findall(r"\w+", unicodedata.normalize("NFKC", message).casefold())
+        if not words or len(words) > self.max_words:
+            return None
+        # "heyyy" and "hey" are the same opener
+        return persona, " ".join(_REPEATS.sub(r"\1", word) for word in words)
+
+    def lookup(self, key: tuple) -> Optional[list]:
+        """A cached reply's chunks, once the key has its full set of variants"""
+        entry = self._entries.get(key)
+        replies = self._live_replies(entry) if entry is not None else []
+        if len(replies) < self.variants:
+            self.misses += 1
+            lookups.inc(key[0], "miss")
+            return None
+        choices = [i for i in range(len(replies)) if i != entry[1]] or [0]
+        entry[1] = random.choice(choices)
+        self._entries.move_to_end(key)
+        self.hits += 1
+        lookups.inc(key[0], "hit")
+        return list(replies[entry[1]][1])
+
+    def store(self, key: tuple, chunks: list):
+        """Add a reply the model produced for the key, up to the variant limit"""
+        if not "".join(chunks).strip():
+            return
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [[], None]
+        replies = self._live_replies(entry)
+        if len(replies) >= self.variants:
+            return
+        replies.append((time.monotonic() + self.ttl_seconds, list(chunks)))
+        self.fills += 1
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _live_replies(self, entry: list) -> list:
+        now = time.monotonic()
+        replies = entry[0]
+        live = [reply for reply in replies if reply[0] > now]
+        if len(live) != len(replies):
+            self.expired += len(replies) - len(live)
+            entry[0] = live
+            entry[1] = None
+        return entry[0]
+
+    def stats(self) -> dict:
+        lookups_total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "replies": sum(len(entry[0]) for entry in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "fills": self.fills,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups_total if lookups_total else 0.0
+        }
+
+
+response_cache = ResponseCache(
+    enabled=os.environ.get("RESPONSE_CACHE", "1") == "1",
+    max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "500")),
+    variants=int(os.environ.get("RESPONSE_CACHE_VARIANTS", "3")),
+    ttl_seconds=float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+    max_words=int(os.environ.get("RESPONSE_CACHE_MAX_WORDS", "5"))
+)
@@ -0,0 +1,9 @@
+-- Indexes for the bulk conversation export (export.py), which pages through
+-- every conversation in (created_at, id) order, optionally for one user.
+-- Apply once in the Supabase SQL editor.
+
+create index if not exists conversations_created_id_idx
+    on conversations (created_at, id);
+
+create index if not exists conversations_user_created_id_idx
+    on conversations (user_id, created_at, id);
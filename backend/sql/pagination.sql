@@ -0,0 +1,10 @@
+-- Indexes for the keyset-paginated session and conversation listings.
+-- Apply once in the Supabase SQL editor.
+
+-- Each index matches a listing's filter plus its (cursor column, id) order, so
+-- every page is an index range scan however deep the cursor is.
+create index if not exists conversations_session_created_id_idx
+    on conversations (session_id, created_at, id);
+
+create index if not exists chat_sessions_user_activity_id_idx
+    on chat_sessions (user_id, last_activity desc, id desc);
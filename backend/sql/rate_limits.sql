@@ -0,0 +1,51 @@
+-- Daily limits used by RATE_LIMIT_ENGINE=atomic and the memory engine's batch sync.
+-- Apply once in the Supabase SQL editor.
+
+alter table users add column if not exists daily_token_count integer not null default 0;
+create unique index if not exists users_username_key on users (username);
+
+-- Count one message (and its prompt tokens) in a single statement. The row lock
+-- taken by the UPDATE makes concurrent calls for the same user serialize, so
+-- two requests can never both take the last slot.
+create or replace function check_rate_limit(
+    p_username text,
+    p_today date,
+    p_message_limit integer,
+    p_token_limit integer,
+    p_tokens integer
+)
+returns table (allowed boolean, message_count integer, token_count integer)
+language plpgsql
+as $$
+begin
+    insert into users (username, daily_message_count, daily_token_count, last_reset_date)
+    values (p_username, 0, 0, p_today)
+    on conflict (username) do nothing;
+
+    return query
+    update users u set
+        daily_message_count = case when u.last_reset_date is distinct from p_today
+                                   then 1 else u.daily_message_count + 1 end,
+        daily_token_count = case when u.last_reset_date is distinct from p_today
+                                 then p_tokens else u.daily_token_count + p_tokens end,
+        last_reset_date = p_today
+    where u.username = p_username
+      and (u.last_reset_date is distinct from p_today
+           or (u.daily_message_count < p_message_limit and u.daily_token_count < p_token_limit))
+    returning true, u.daily_message_count, u.daily_token_count;
+
+    if not found then
+        return query
+        select false, u.daily_message_count, u.daily_token_count
+        from users u where u.username = p_username;
+    end if;
+end;
+$$;
+
+create or replace function record_token_usage(p_username text, p_today date, p_tokens integer)
+returns void
+language sql
+as $$
+    update users set daily_token_count = daily_token_count + p_tokens
+    where username = p_username and last_reset_date = p_today;
+$$;
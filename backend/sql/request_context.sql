@@ -0,0 +1,101 @@
+-- One round trip per request for the user, their daily limits, the active
+-- session and its newest turns. Used by request_context.py when
+-- REQUEST_CONTEXT_RPC=1. Apply once in the Supabase SQL editor, after
+-- rate_limits.sql.
+create or replace function resolve_request_context(
+    p_username text,
+    p_today date,
+    p_persona text default null,
+    p_create_user boolean default false,
+    p_count_message boolean default false,
+    p_message_limit integer default 0,
+    p_token_limit integer default 0,
+    p_tokens integer default 0,
+    p_history_turns integer default 0
+)
+returns json
+language plpgsql
+as $$
+declare
+    v_user users%rowtype;
+    v_allowed boolean := true;
+    v_session_id uuid;
+    v_session_created boolean := false;
+    v_history json := '[]'::json;
+    -- Only true once the history was read, or the session was just created and so has none
+    v_history_complete boolean := false;
+begin
+    if p_create_user then
+        insert into users (username, daily_message_count, daily_token_count, last_reset_date)
+        values (p_username, 0, 0, p_today)
+        on conflict (username) do nothing;
+    end if;
+
+    if p_count_message then
+        -- Same single-statement check as check_rate_limit()
+        update users u set
+            daily_message_count = case when u.last_reset_date is distinct from p_today
+                                       then 1 else u.daily_message_count + 1 end,
+            daily_token_count = case when u.last_reset_date is distinct from p_today
+                                     then p_tokens else u.daily_token_count + p_tokens end,
+            last_reset_date = p_today
+        where u.username = p_username
+          and (u.last_reset_date is distinct from p_today
+               or (u.daily_message_count < p_message_limit and u.daily_token_count < p_token_limit))
+        returning u.* into v_user;
+        v_allowed := found;
+    end if;
+
+    if v_user.id is null then
+        select * into v_user from users where username = p_username;
+    end if;
+    if v_user.id is null then
+        return json_build_object('user_id', null, 'allowed', false);
+    end if;
+
+    if v_allowed and p_persona is not null then
+        select id into v_session_id from chat_sessions
+        where user_id = v_user.id and persona = p_persona and is_active
+        limit 1;
+
+        if v_session_id is null then
+            -- Other personas' sessions stay active until the idle sweep expires them
+            insert into chat_sessions (user_id, persona, is_active)
+            values (v_user.id, p_persona, true)
+            returning id into v_session_id;
+            v_session_created := true;
+            v_history_complete := true;
+        elsif p_history_turns > 0 then
+            -- One extra row tells the caller whether older turns exist
+            select coalesce(json_agg(json_build_object('id', t.id, 'message', t.message, 'response', t.response)
+                                     order by t.created_at, t.id), '[]'::json),
+                   count(*) <= p_history_turns
+            into v_history, v_history_complete
+            from (
+                select id, message, response, created_at from conversations
+                where session_id = v_session_id
+                order by created_at desc, id desc
+                limit p_history_turns + 1
+            ) t;
+            if not v_history_complete then
+                -- Drop the probe row, which is the oldest
+                select json_agg(a.e order by a.n) into v_history
+                from json_array_elements(v_history) with ordinality as a(e, n)
+                where a.n > 1;
+            end if;
+        end if;
+    end if;
+
+    return json_build_object(
+        'user_id', v_user.id,
+        'allowed', v_allowed,
+        'message_count', v_user.daily_message_count,
+        'token_count', v_user.daily_token_count,
+        'last_reset_date', v_user.last_reset_date,
+        'session_id', v_session_id,
+        'session_created', v_session_created,
+        'history', v_history,
+        'history_complete', v_history_complete
+    );
+end;
+$$;
@@ -0,0 +1,7 @@
+-- Index for the idle-session sweep in activity.py, which marks active
+-- sessions with no recent activity inactive in one update.
+-- Apply once in the Supabase SQL editor.
+
+-- Only active sessions are ever swept, so the index leaves the rest out.
+create index if not exists chat_sessions_active_activity_idx
+    on chat_sessions (last_activity) where is_active;
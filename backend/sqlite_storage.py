@@ -0,0 +1,518 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+SCHEMA = """
+create table if not exists users (
+    id text primary key,
+    username text not null unique,
+    daily_message_count integer not null default 0,
+    daily_token_count integer not null default 0,
+    last_reset_date text,
+    created_at text not null
+);
+create table if not exists chat_sessions (
+    id text primary key,
+    user_id text not null,
+    persona text not null,
+    is_active integer not null default 1,
+    session_start text not null,
+    last_activity text not null,
+    created_at text not null
+);
+create table if not exists conversations (
+    id text primary key,
+    user_id text,
+    session_id text not null,
+    persona text,
+    message text,
+    response text,
+    token_count integer,
+    created_at text not null
+);
+create index if not exists conversations_session_created_idx on conversations (session_id, created_at, id);
+create index if not exists conversations_created_idx on conversations (created_at, id);
+create index if not exists conversations_user_created_idx on conversations (user_id, created_at, id);
+create index if not exists chat_sessions_user_active_idx on chat_sessions (user_id, is_active);
+create index if not exists chat_sessions_active_activity_idx on chat_sessions (is_active, last_activity);
+create index if not exists chat_sessions_user_activity_idx on chat_sessions (user_id, last_activity, id);
+"""
+
+COLUMNS = {
+    'users': ('id', 'username', 'daily_message_count', 'daily_token_count', 'last_reset_date', 'created_at'),
+    'chat_sessions': ('id', 'user_id', 'persona', 'is_active', 'session_start', 'last_activity', 'created_at'),
+    'conversations': ('id', 'user_id', 'session_id', 'persona', 'message', 'response', 'token_count',
+                      'created_at'),
+}
+
+LIMIT_UPDATE = """
+update users set
+    daily_message_count = case when last_reset_date is not :today then 1 else daily_message_count + 1 end,
+    daily_token_count = case when last_reset_date is not :today then :tokens else daily_token_count + :tokens end,
+    last_reset_date = :today
+where username = :username
+  and (last_reset_date is not :today
+       or (daily_message_count < :message_limit and daily_token_count < :token_limit))
+"""
+
+
+_clock_lock = threading.Lock()
+_last_stamp = ''
+
+
+def _now() -> str:
+    """Strictly increasing UTC timestamp, so rows written in one batch keep their order"""
+    global _last_stamp
+    with _clock_lock:
+        stamp = datetime.now(timezone.utc).isoformat(timespec='microseconds')
+        if stamp <= _last_stamp:
+            stamp = (datetime.fromisoformat(_last_stamp) + timedelta(microseconds=1)).isoformat(
+                timespec='microseconds')
+        _last_stamp = stamp
+        return stamp
+
+
+def _select(table: str, columns: str) -> str:
+    """Validated select list; column names come from callers, so they are checked, never trusted"""
+    if columns == '*':
+        return ', '.join(COLUMNS[table])
+    names = [name.strip() for name in columns.split(',')]
+    unknown = [name for name in names if name not in COLUMNS[table]]
+    if unknown:
+        raise ValueError(f"Unknown {table} columns: {', '.join(unknown)}")
+    return ', '.join(names)
+
+
+def _row(cursor: sqlite3.Cursor, values: tuple) -> dict:
+    row = {column[0]: value for column, value in zip(cursor.description, values)}
+    if 'is_active' in row:
+        row['is_active'] = bool(row['is_active'])
+    return row
+
+
+def _settle(future: asyncio.Future, result, error: Optional[BaseException]):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class SQLiteStorage:
+    """Embedded implementation of the Storage interface, for single-node deployments.
+
+    The database runs in WAL mode, so reads never wait for the writer.
+    Reads run on a small pool of reader threads, each with its own
+    connection, so a slow query or a page of a large export never blocks
+    the event loop. Every write goes to one dedicated writer thread. It
+    drains whatever is queued into a single transaction, with a savepoint
+    per write so one failure does not undo its neighbours. Because there
+    is a single writer, read-modify-write operations such as the rate
+    limit check are atomic without locks. SQL text is constant and
+    parameterised, so sqlite3's per-connection statement cache serves
+    prepared statements. Nothing is opened until the first query.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256, synchronous: str = 'NORMAL', readers: int = 4):
+        self.path = path
+        self.batch_size = batch_size
+        self.synchronous = synchronous
+        self.readers = readers
+        self._reader_pool: Optional[ThreadPoolExecutor] = None
+        self._jobs: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: Optional[threading.Thread] = None
+        self._readers = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.transactions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               cached_statements=256)
+        conn.execute('pragma journal_mode=wal')
+        conn.execute(f'pragma synchronous={self.synchronous}')
+        conn.execute('pragma busy_timeout=5000')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _open(self):
+        with self._lock:
+            if self._writer is not None:
+                return
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.execute('pragma journal_mode=wal')
+            conn.executescript(SCHEMA)
+            conn.close()
+            self._writer = threading.Thread(target=self._run_writer, name='sqlite-writer', daemon=True)
+            self._writer.start()
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._readers, 'conn', None)
+        if conn is None:
+            self._open()
+            conn = self._readers.conn = self._connect()
+        return conn
+
+    async def _in_reader(self, job: Callable, *args):
+        """Run job(connection, *args) on a reader thread, with that thread's connection"""
+        if self._reader_pool is None:
+            self._reader_pool = ThreadPoolExecutor(self.readers, thread_name_prefix='sqlite-reader')
+        self.reads += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self._reader_pool, lambda: job(self._reader(), *args)
+        )
+
+    @staticmethod
+    def _query(conn: sqlite3.Connection, sql: str, params) -> list:
+        cursor = conn.execute(sql, params)
+        return [_row(cursor, values) for values in cursor.fetchall()]
+
+    async def _read(self, sql: str, params=()) -> list:
+        return await self._in_reader(self._query, sql, params)
+
+    async def _write(self, job: Callable, *args):
+        """Run job(connection, *args) on the writer thread and wait for it to commit"""
+        self._open()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._jobs.put((job, args, loop, future))
+        return await future
+
+    def _run_writer(self):
+        conn = self._connect()
+        while True:
+            batch = [self._jobs.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            if stopping:
+                batch.pop()
+            if batch:
+                try:
+                    self._commit(conn, batch)
+                except Exception as e:
+                    # Could not even open a transaction; fail the whole batch rather than the thread
+                    print(f"SQLite writer error: {e}")
+                    for _, _, loop, future in batch:
+                        loop.call_soon_threadsafe(_settle, future, None, e)
+            if stopping:
+                return
+
+    def _commit(self, conn: sqlite3.Connection, batch: list):
+        outcomes = []
+        conn.execute('begin immediate')
+        for job, args, loop, future in batch:
+            conn.execute('savepoint job')
+            try:
+                result = job(conn, *args)
+                conn.execute('release job')
+                outcomes.append((loop, future, result, None))
+            except Exception as e:
+                conn.execute('rollback to job')
+                conn.execute('release job')
+                outcomes.append((loop, future, None, e))
+        try:
+            conn.execute('commit')
+        except Exception as e:
+            print(f"SQLite commit error: {e}")
+            conn.execute('rollback')
+            outcomes = [(loop, future, None, e) for loop, future, _, _ in outcomes]
+        self.writes += len(batch)
+        self.transactions += 1
+        for loop, future, result, error in outcomes:
+            try:
+                loop.call_soon_threadsafe(_settle, future, result, error)
+            except RuntimeError:
+                # The caller's event loop has already closed
+                pass
+
+    # Users
+    async def get_user(self, username: str, columns: str = '*') -> Optional[dict]:
+        rows = await self._read(f"select {_select('users', columns)} from users where username = ? limit 1",
+                                (username,))
+        return rows[0] if rows else None
+
+    @staticmethod
+    def _create_user(conn: sqlite3.Connection, user: dict) -> dict:
+        conn.execute(
+            "insert into users (id, username, daily_message_count, daily_token_count, last_reset_date,"
+            " created_at) values (?, ?, ?, ?, ?, ?) on conflict (username) do nothing",
+            (user.get('id') or str(uuid.uuid4()), user['username'], user.get('daily_message_count', 0),
+             user.get('daily_token_count', 0), user.get('last_reset_date'), _now())
+        )
+        cursor = conn.execute(f"select {_select('users', '*')} from users where username = ?",
+                              (user['username'],))
+        return _row(cursor, cursor.fetchone())
+
+    async def create_user(self, user: dict) -> dict:
+        return await self._write(self._create_user, user)
+
+    async def update_user(self, username: str, values: dict):
+        # Validates the column names before they go into the SQL text
+        _select('users', ','.join(values))
+        assignments = ', '.join(f"{column} = ?" for column in values)
+        await self._write(lambda conn: conn.execute(
+            f"update users set {assignments} where username = ?", (*values.values(), username)
+        ))
+
+    async def save_user_limits(self, rows: list):
+        """Bulk write daily counters, keyed by username"""
+        params = [(str(uuid.uuid4()), row['username'], row['daily_message_count'],
+                   row['daily_token_count'], row['last_reset_date'], _now()) for row in rows]
+        await self._write(lambda conn: conn.executemany(
+            "insert into users (id, username, daily_message_count, daily_token_count, last_reset_date,"
+            " created_at) values (?, ?, ?, ?, ?, ?) on conflict (username) do update set"
+            " daily_message_count = excluded.daily_message_count,"
+            " daily_token_count = excluded.daily_token_count,"
+            " last_reset_date = excluded.last_reset_date", params
+        ))
+
+    @staticmethod
+    def _count_message(conn: sqlite3.Connection, username: str, today: str, message_limit: int,
+                       token_limit: int, tokens: int) -> bool:
+        cursor = conn.execute(LIMIT_UPDATE, {
+            'username': username, 'today': today, 'tokens': tokens,
+            'message_limit': message_limit, 'token_limit': token_limit
+        })
+        return cursor.rowcount > 0
+
+    @classmethod
+    def _check_rate_limit(cls, conn: sqlite3.Connection, username: str, today: str, message_limit: int,
+                          token_limit: int, tokens: int) -> dict:
+        cls._create_user(conn, {'username': username, 'last_reset_date': today})
+        allowed = cls._count_message(conn, username, today, message_limit, token_limit, tokens)
+        count, token_count = conn.execute(
+            "select daily_message_count, daily_token_count from users where username = ?", (username,)
+        ).fetchone()
+        return {'allowed': allowed, 'message_count': count, 'token_count': token_count}
+
+    async def check_rate_limit(self, username: str, today: str, message_limit: int,
+                               token_limit: int, tokens: int) -> dict:
+        """Atomically count a message against the user's limits"""
+        return await self._write(self._check_rate_limit, username, today, message_limit, token_limit, tokens)
+
+    async def record_token_usage(self, username: str, today: str, tokens: int):
+        await self._write(lambda conn: conn.execute(
+            "update users set daily_token_count = daily_token_count + ?"
+            " where username = ? and last_reset_date = ?", (tokens, username, today)
+        ))
+
+    @classmethod
+    def _resolve_request_context(cls, conn: sqlite3.Connection, username: str, today: str,
+                                 persona: Optional[str], create_user: bool, count_message: bool,
+                                 message_limit: int, token_limit: int, tokens: int,
+                                 history_turns: int) -> dict:
+        """The same answer as sql/request_context.sql, computed inside one write transaction"""
+        if create_user:
+            cls._create_user(conn, {'username': username, 'last_reset_date': today})
+        allowed = True
+        if count_message:
+            allowed = cls._count_message(conn, username, today, message_limit, token_limit, tokens)
+        user = conn.execute(
+            "select id, daily_message_count, daily_token_count, last_reset_date from users where username = ?",
+            (username,)
+        ).fetchone()
+        if user is None:
+            return {'user_id': None, 'allowed': False}
+        user_id = user[0]
+
+        session_id = None
+        session_created = False
+        history = []
+        # Only complete once the history was read, or the session is new and so has none
+        history_complete = False
+        if allowed and persona is not None:
+            row = conn.execute(
+                "select id from chat_sessions where user_id = ? and is_active = 1 and persona = ? limit 1",
+                (user_id, persona)
+            ).fetchone()
+            if row is None:
+                session_id = cls._create_session(conn, user_id, persona)['id']
+                session_created = history_complete = True
+            else:
+                session_id = row[0]
+                if history_turns > 0:
+                    # One extra row tells the caller whether older turns exist
+                    turns = conn.execute(
+                        "select id, message, response from conversations where session_id = ?"
+                        " order by created_at desc, id desc limit ?", (session_id, history_turns + 1)
+                    ).fetchall()
+                    history_complete = len(turns) <= history_turns
+                    history = [{'id': i, 'message': m, 'response': r} for i, m, r in reversed(turns[:history_turns])]
+
+        return {
+            'user_id': user_id,
+            'allowed': allowed,
+            'message_count': user[1],
+            'token_count': user[2],
+            'last_reset_date': user[3],
+            'session_id': session_id,
+            'session_created': session_created,
+            'history': history,
+            'history_complete': history_complete
+        }
+
+    async def resolve_request_context(self, username: str, today: str, persona: Optional[str],
+                                      create_user: bool, count_message: bool, message_limit: int,
+                                      token_limit: int, tokens: int, history_turns: int) -> dict:
+        """User, limits, active session and newest turns in one call"""
+        args = (username, today, persona, create_user, count_message, message_limit, token_limit,
+                tokens, history_turns)
+        if create_user or count_message or persona is not None:
+            return await self._write(self._resolve_request_context, *args)
+        return await self._in_reader(self._resolve_request_context, *args)
+
+    # Chat sessions
+    async def get_active_session(self, user_id: str, persona: str) -> Optional[dict]:
+        rows = await self._read(
+            f"select {_select('chat_sessions', '*')} from chat_sessions"
+            " where user_id = ? and is_active = 1 and persona = ? limit 1", (user_id, persona)
+        )
+        return rows[0] if rows else None
+
+    async def touch_session(self, session_id: str):
+        await self.touch_sessions([session_id], _now())
+
+    async def touch_sessions(self, session_ids: list, when: str):
+        """Set last_activity on many sessions in one transaction"""
+        await self._write(lambda conn: conn.executemany(
+            "update chat_sessions set last_activity = ? where id = ?",
+            [(when, session_id) for session_id in session_ids]
+        ))
+
+    async def expire_idle_sessions(self, cutoff: str) -> list:
+        """Mark active sessions with no activity since cutoff inactive; returns their ids"""
+        rows = await self._write(lambda conn: conn.execute(
+            "update chat_sessions set is_active = 0 where is_active = 1 and last_activity < ? returning id",
+            (cutoff,)
+        ).fetchall())
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _create_session(conn: sqlite3.Connection, user_id: str, persona: str) -> dict:
+        now = _now()
+        session = {
+            'id': str(uuid.uuid4()), 'user_id': user_id, 'persona': persona, 'is_active': True,
+            'session_start': now, 'last_activity': now, 'created_at': now
+        }
+        conn.execute(
+            "insert into chat_sessions (id, user_id, persona, is_active, session_start, last_activity,"
+            " created_at) values (:id, :user_id, :persona, :is_active, :session_start, :last_activity,"
+            " :created_at)", session
+        )
+        return session
+
+    async def create_session(self, user_id: str, persona: str) -> dict:
+        return await self._write(self._create_session, user_id, persona)
+
+    async def list_sessions(self, user_id: str) -> list:
+        return await self._read(
+            f"select {_select('chat_sessions', '*')} from chat_sessions where user_id = ?"
+            " order by last_activity desc", (user_id,)
+        )
+
+    async def list_sessions_page(self, user_id: str, columns: str, limit: int,
+                                 after: Optional[tuple] = None) -> list:
+        """Newest sessions first, resuming after a (last_activity, id) cursor"""
+        select = _select('chat_sessions', columns)
+        if after is None:
+            return await self._read(
+                f"select {select} from chat_sessions where user_id = ?"
+                " order by last_activity desc, id desc limit ?", (user_id, limit)
+            )
+        value, row_id = after
+        return await self._read(
+            f"select {select} from chat_sessions where user_id = ?"
+            " and (last_activity < ? or (last_activity = ? and id < ?))"
+            " order by last_activity desc, id desc limit ?", (user_id, value, value, row_id, limit)
+        )
+
+    # Conversations
+    async def list_conversations(self, session_id: str, columns: str = '*') -> list:
+        return await self._read(
+            f"select {_select('conversations', columns)} from conversations where session_id = ?"
+            " order by created_at", (session_id,)
+        )
+
+    async def list_conversations_page(self, session_id: str, columns: str, limit: int,
+                                      after: Optional[tuple] = None) -> list:
+        """Oldest turns first, resuming after a (created_at, id) cursor"""
+        select = _select('conversations', columns)
+        if after is None:
+            return await self._read(
+                f"select {select} from conversations where session_id = ?"
+                " order by created_at, id limit ?", (session_id, limit)
+            )
+        value, row_id = after
+        return await self._read(
+            f"select {select} from conversations where session_id = ?"
+            " and (created_at > ? or (created_at = ? and id > ?))"
+            " order by created_at, id limit ?", (session_id, value, value, row_id, limit)
+        )
+
+    async def list_conversations_export(self, columns: str, limit: int, after: Optional[tuple] = None,
+                                        user_id: Optional[str] = None, persona: Optional[str] = None,
+                                        since: Optional[str] = None, until: Optional[str] = None) -> list:
+        """Conversations across all sessions, oldest first, resuming after a (created_at, id) cursor"""
+        clauses, params = [], []
+        for condition, value in (('user_id = ?', user_id), ('persona = ?', persona),
+                                 ('created_at >= ?', since), ('created_at < ?', until)):
+            if value is not None:
+                clauses.append(condition)
+                params.append(value)
+        if after is not None:
+            value, row_id = after
+            clauses.append("(created_at > ? or (created_at = ? and id > ?))")
+            params += [value, value, row_id]
+        where = f" where {' and '.join(clauses)}" if clauses else ""
+        return await self._read(
+            f"select {_select('conversations', columns)} from conversations{where}"
+            " order by created_at, id limit ?", (*params, limit)
+        )
+
+    async def insert_conversation(self, conversation: dict):
+        await self.insert_conversations([conversation])
+
+    async def insert_conversations(self, conversations: list):
+        params = [(c.get('id') or str(uuid.uuid4()), c.get('user_id'), c['session_id'], c.get('persona'), c.get('message'),
+                   c.get('response'), c.get('token_count'), c.get('created_at') or _now())
+                  for c in conversations]
+        await self._write(lambda conn: conn.executemany(
+            "insert into conversations (id, user_id, session_id, persona, message, response, token_count,"
+            " created_at) values (?, ?, ?, ?, ?, ?, ?, ?)", params
+        ))
+
+    def stats(self) -> dict:
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            "transactions": self.transactions,
+            "writes_per_transaction": self.writes / self.transactions if self.transactions else 0.0
+        }
+
+    async def close(self):
+        if self._writer is not None:
+            self._jobs.put(None)
+            await asyncio.to_thread(self._writer.join)
+            self._writer = None
+        if self._reader_pool is not None:
+            await asyncio.to_thread(self._reader_pool.shutdown)
+            self._reader_pool = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._readers = threading.local()
+
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data) -> bytes:
+    """Compact UTF-8 JSON; uses orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def frame(data: dict, event_id: Optional[int] = None) -> bytes:
+    prefix = f"id: {event_id}\n".encode() if event_id is not None else b""
+    return prefix + b"data: " + dumps(data) + b"\n\n"
+
+
+HEARTBEAT = b": keep-alive\n\n"
+
+
+class EventEncoder:
+    """Turns a stream of event dicts into SSE frames (or coalesced events for other transports).
+
+    Consecutive 'chunk' events are merged until window seconds have passed
+    since the first one was buffered or max_bytes of text is waiting, so a
+    fast model produces a few larger writes instead of one frame per token.
+    Any other event flushes the buffer and is sent as is. Events may come as
+    (event_id, event) pairs; a merged frame carries the id of the last chunk
+    in it, so a client resuming from that id misses nothing. When nothing has
+    been written for heartbeat seconds a comment line is sent, which keeps
+    proxies from closing an idle stream and is ignored by EventSource.
+    """
+
+    def __init__(self, window: float = 0.03, max_bytes: int = 512, heartbeat: float = 15.0):
+        self.window = window
+        self.max_bytes = max_bytes
+        self.heartbeat = heartbeat
+        self.frames = 0
+        self.chunks = 0
+        self.heartbeats = 0
+
+    async def encode(self, events) -> AsyncIterator[bytes]:
+        async with aclosing(self.coalesce(events)) as items:
+            async for item in items:
+                yield HEARTBEAT if item is None else frame(item[1], item[0])
+
+    async def coalesce(self, events) -> AsyncIterator[Optional[tuple]]:
+        """(event_id, event) pairs with chunks merged; None where a heartbeat is due"""
+        source = aiter(events)
+        pending = None
+        buffer = []
+        buffered = 0
+        buffered_since = 0.0
+        buffer_id = None
+        last_write = time.monotonic()
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(anext(source))
+                now = time.monotonic()
+                if buffer:
+                    timeout = max(0.0, buffered_since + self.window - now)
+                else:
+                    timeout = max(0.0, last_write + self.heartbeat - now)
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+                if not done:
+                    if buffer:
+                        yield self._flush(buffer, buffer_id)
+                        buffer, buffered = [], 0
+                    else:
+                        self.heartbeats += 1
+                        yield None
+                    last_write = time.monotonic()
+                    continue
+
+                try:
+                    event = pending.result()
+                except StopAsyncIteration:
+                    pending = None
+                    break
+                pending = None
+                event_id = None
+                if isinstance(event, tuple):
+                    event_id, event = event
+
+                if event.get('type') == 'chunk':
+                    self.chunks += 1
+                    if not buffer:
+                        buffered_since = time.monotonic()
+                    buffer.append(event['response'])
+                    buffered += len(event['response'])
+                    buffer_id = event_id
+                    if buffered < self.max_bytes:
+                        continue
+                    yield self._flush(buffer, buffer_id)
+                    buffer, buffered = [], 0
+                else:
+                    if buffer:
+                        yield self._flush(buffer, buffer_id)
+                        buffer, buffered = [], 0
+                    self.frames += 1
+                    yield event_id, event
+                last_write = time.monotonic()
+
+            if buffer:
+                yield self._flush(buffer, buffer_id)
+        finally:
+            if pending is not None:
+                pending.cancel()
+                try:
+                    await pending
+                except (asyncio.CancelledError, StopAsyncIteration, Exception):
+                    pass
+            if hasattr(source, 'aclose'):
+                await source.aclose()
+
+    def _flush(self, buffer: list, event_id: Optional[int]) -> tuple:
+        self.frames += 1
+        return event_id, {'response': ''.join(buffer), 'type': 'chunk'}
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "chunks": self.chunks,
+            "heartbeats": self.heartbeats,
+            "chunks_per_frame": self.chunks / self.frames if self.frames else 0.0
+        }
+
+
+event_encoder = EventEncoder(
+    window=float(os.environ.get("SSE_COALESCE_MS", "30")) / 1000,
+    max_bytes=int(os.environ.get("SSE_COALESCE_BYTES", "512")),
+    heartbeat=float(os.environ.get("SSE_HEARTBEAT_SECONDS", "15"))
+)
@@ -0,0 +1,236 @@
+import os
+from datetime import datetime, timezone
+from typing import Optional, Protocol
+import config  # noqa: F401
+from db import PostgrestClient
+
+
+def _keyset_filter(column: str, after: tuple, desc: bool) -> str:
+    """PostgREST logic tree selecting rows past (value, id) in (column, id) order"""
+    op = 'lt' if desc else 'gt'
+    value, row_id = (str(part).replace('"', '') for part in after)
+    return f'({column}.{op}."{value}",and({column}.eq."{value}",id.{op}."{row_id}"))'
+
+
+class Storage(Protocol):
+    """The storage interface the rest of the app codes against.
+
+    SupabaseStorage below and SQLiteStorage in sqlite_storage.py implement
+    it. Rows are plain dicts keyed by column name; listings take a
+    comma-separated column list and a (value, id) keyset cursor.
+    """
+
+    # Users
+    async def get_user(self, username: str, columns: str = '*') -> Optional[dict]: ...
+    async def create_user(self, user: dict) -> dict: ...
+    async def update_user(self, username: str, values: dict): ...
+    async def save_user_limits(self, rows: list): ...
+    async def check_rate_limit(self, username: str, today: str, message_limit: int,
+                               token_limit: int, tokens: int) -> dict: ...
+    async def record_token_usage(self, username: str, today: str, tokens: int): ...
+    async def resolve_request_context(self, username: str, today: str, persona: Optional[str],
+                                      create_user: bool, count_message: bool, message_limit: int,
+                                      token_limit: int, tokens: int, history_turns: int) -> dict: ...
+
+    # Chat sessions
+    async def get_active_session(self, user_id: str, persona: str) -> Optional[dict]: ...
+    async def touch_session(self, session_id: str): ...
+    async def touch_sessions(self, session_ids: list, when: str): ...
+    async def expire_idle_sessions(self, cutoff: str) -> list: ...
+    async def create_session(self, user_id: str, persona: str) -> dict: ...
+    async def list_sessions(self, user_id: str) -> list: ...
+    async def list_sessions_page(self, user_id: str, columns: str, limit: int,
+                                 after: Optional[tuple] = None) -> list: ...
+
+    # Conversations
+    async def list_conversations(self, session_id: str, columns: str = '*') -> list: ...
+    async def list_conversations_page(self, session_id: str, columns: str, limit: int,
+                                      after: Optional[tuple] = None) -> list: ...
+    async def list_conversations_export(self, columns: str, limit: int, after: Optional[tuple] = None,
+                                        user_id: Optional[str] = None, persona: Optional[str] = None,
+                                        since: Optional[str] = None, until: Optional[str] = None) -> list: ...
+    async def insert_conversation(self, conversation: dict): ...
+    async def insert_conversations(self, conversations: list): ...
+
+    def stats(self) -> dict: ...
+    async def close(self): ...
+
+
+class SupabaseStorage:
+    """Async repository for users, chat_sessions and conversations on Supabase"""
+
+    def __init__(self, client: PostgrestClient):
+        self.client = client
+
+    # Users
+    async def get_user(self, username: str, columns: str = '*') -> Optional[dict]:
+        rows = await self.client.select('users', columns, {'username': username}, limit=1)
+        return rows[0] if rows else None
+
+    async def create_user(self, user: dict) -> dict:
+        rows = await self.client.insert('users', user)
+        return rows[0]
+
+    async def update_user(self, username: str, values: dict):
+        await self.client.update('users', values, {'username': username})
+
+    async def save_user_limits(self, rows: list):
+        """Bulk write daily counters, keyed by username"""
+        await self.client.upsert('users', rows, on_conflict='username')
+
+    async def check_rate_limit(self, username: str, today: str, message_limit: int,
+                               token_limit: int, tokens: int) -> dict:
+        """Atomically count a message against the user's limits (see sql/rate_limits.sql)"""
+        rows = await self.client.rpc('check_rate_limit', {
+            'p_username': username,
+            'p_today': today,
+            'p_message_limit': message_limit,
+            'p_token_limit': token_limit,
+            'p_tokens': tokens
+        })
+        return rows[0]
+
+    async def record_token_usage(self, username: str, today: str, tokens: int):
+        await self.client.rpc('record_token_usage', {
+            'p_username': username,
+            'p_today': today,
+            'p_tokens': tokens
+        })
+
+    async def resolve_request_context(self, username: str, today: str, persona: Optional[str],
+                                      create_user: bool, count_message: bool, message_limit: int,
+                                      token_limit: int, tokens: int, history_turns: int) -> dict:
+        """User, limits, active session and newest turns in one call (see sql/request_context.sql)"""
+        return await self.client.rpc('resolve_request_context', {
+            'p_username': username,
+            'p_today': today,
+            'p_persona': persona,
+            'p_create_user': create_user,
+            'p_count_message': count_message,
+            'p_message_limit': message_limit,
+            'p_token_limit': token_limit,
+            'p_tokens': tokens,
+            'p_history_turns': history_turns
+        })
+
+    # Chat sessions
+    async def get_active_session(self, user_id: str, persona: str) -> Optional[dict]:
+        rows = await self.client.select('chat_sessions', '*', {
+            'user_id': user_id,
+            'persona': persona,
+            'is_active': True
+        }, limit=1)
+        return rows[0] if rows else None
+
+    async def touch_session(self, session_id: str):
+        await self.client.update('chat_sessions', {
+            'last_activity': datetime.now(timezone.utc).isoformat()
+        }, {'id': session_id})
+
+    async def touch_sessions(self, session_ids: list, when: str):
+        """Set last_activity on many sessions in one request"""
+        await self.client.update('chat_sessions', {
+            'last_activity': when
+        }, {'id': ('in', f"({','.join(session_ids)})")})
+
+    async def expire_idle_sessions(self, cutoff: str) -> list:
+        """Mark active sessions with no activity since cutoff inactive; returns their ids"""
+        rows = await self.client.update('chat_sessions', {
+            'is_active': False
+        }, {'is_active': True, 'last_activity': ('lt', cutoff)}, returning=True)
+        return [row['id'] for row in rows]
+
+    async def create_session(self, user_id: str, persona: str) -> dict:
+        rows = await self.client.insert('chat_sessions', {
+            'user_id': user_id,
+            'persona': persona,
+            'is_active': True
+        })
+        return rows[0]
+
+    async def list_sessions(self, user_id: str) -> list:
+        return await self.client.select(
+            'chat_sessions', '*', {'user_id': user_id}, order='last_activity', desc=True
+        )
+
+    async def list_sessions_page(self, user_id: str, columns: str, limit: int,
+                                 after: Optional[tuple] = None) -> list:
+        """Newest sessions first, resuming after a (last_activity, id) cursor"""
+        filters = {'user_id': user_id}
+        if after is not None:
+            filters['or'] = _keyset_filter('last_activity', after, desc=True)
+        return await self.client.select(
+            'chat_sessions', columns, filters, order='last_activity,id', desc=True, limit=limit
+        )
+
+    # Conversations
+    async def list_conversations(self, session_id: str, columns: str = '*') -> list:
+        return await self.client.select(
+            'conversations', columns, {'session_id': session_id}, order='created_at'
+        )
+
+    async def list_conversations_page(self, session_id: str, columns: str, limit: int,
+                                      after: Optional[tuple] = None) -> list:
+        """Oldest turns first, resuming after a (created_at, id) cursor"""
+        filters = {'session_id': session_id}
+        if after is not None:
+            filters['or'] = _keyset_filter('created_at', after, desc=False)
+        return await self.client.select(
+            'conversations', columns, filters, order='created_at,id', limit=limit
+        )
+
+    async def list_conversations_export(self, columns: str, limit: int, after: Optional[tuple] = None,
+                                        user_id: Optional[str] = None, persona: Optional[str] = None,
+                                        since: Optional[str] = None, until: Optional[str] = None) -> list:
+        """Conversations across all sessions, oldest first, resuming after a (created_at, id) cursor"""
+        filters = {}
+        if user_id is not None:
+            filters['user_id'] = user_id
+        if persona is not None:
+            filters['persona'] = persona
+        created_at = [(op, value) for op, value in (('gte', since), ('lt', until)) if value is not None]
+        if created_at:
+            filters['created_at'] = created_at
+        if after is not None:
+            filters['or'] = _keyset_filter('created_at', after, desc=False)
+        return await self.client.select(
+            'conversations', columns, filters, order='created_at,id', limit=limit
+        )
+
+    async def insert_conversation(self, conversation: dict):
+        await self.client.insert('conversations', conversation, returning=False)
+
+    async def insert_conversations(self, conversations: list):
+        await self.client.insert('conversations', conversations, returning=False)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.client.requests,
+            "errors": self.client.errors
+        }
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_storage(name: str) -> Storage:
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    if name == 'supabase':
+        return SupabaseStorage(PostgrestClient(
+            os.environ.get("SUPABASE_URL"),
+            os.environ.get("SUPABASE_KEY"),
+            max_connections=int(os.environ.get("SUPABASE_MAX_CONNECTIONS", "50")),
+            timeout=float(os.environ.get("SUPABASE_TIMEOUT", "10")),
+        ))
+    if name == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(
+            os.environ.get("SQLITE_PATH", "chatbot.db"),
+            synchronous=os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+            readers=int(os.environ.get("SQLITE_READERS", "4"))
+        )
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+# The shared storage; nothing is connected until the first query
+storage: Storage = create_storage(os.environ.get("STORAGE_BACKEND", "supabase"))
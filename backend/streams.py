@@ -0,0 +1,194 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Optional
+
+
+class Generation:
+    """One in-flight or recently finished chat reply, with its numbered events kept for replay"""
+
+    def __init__(self, key: str, max_events: int):
+        self.key = key
+        self.max_events = max_events
+        self.events: list[tuple[int, dict]] = []
+        self.next_id = 1
+        self.done = False
+        self.finished_at = 0.0
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # Merged chunk id -> (id, end offset) of each chunk folded into it, oldest first
+        self._parts: dict[int, list[tuple[int, int]]] = {}
+        self._wake = asyncio.Event()
+
+    def append(self, event: dict):
+        if len(self.events) >= self.max_events:
+            self._merge_oldest_chunks()
+        self.events.append((self.next_id, event))
+        self.next_id += 1
+        self._notify()
+
+    def _merge_oldest_chunks(self):
+        """Fold the two oldest adjacent chunks into one, remembering where each one's text ends"""
+        for i in range(len(self.events) - 1):
+            (first_id, first), (second_id, second) = self.events[i], self.events[i + 1]
+            if first.get('type') == 'chunk' and second.get('type') == 'chunk':
+                offset = len(first['response'])
+                parts = self._parts.pop(first_id, [(first_id, offset)])
+                parts += [(part_id, offset + end) for part_id, end in
+                          self._parts.pop(second_id, [(second_id, len(second['response']))])]
+                # The merged chunk keeps the newer id, so it sorts after everything it covers
+                self.events[i:i + 2] = [(second_id, {**second, 'response': first['response'] + second['response']})]
+                self._parts[second_id] = parts
+                return
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    def _after(self, after: int) -> list[tuple[int, dict]]:
+        """Buffered events numbered above `after`, without text a merged chunk already delivered"""
+        pending = []
+        for event_id, event in self.events:
+            if event_id <= after:
+                continue
+            parts = self._parts.get(event_id)
+            if parts and parts[0][0] <= after:
+                offset = next(end for part_id, end in parts if part_id == after)
+                event = {**event, 'response': event['response'][offset:]}
+            pending.append((event_id, event))
+        return pending
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[tuple[int, dict]]:
+        """Every event numbered above `after`, then live events until the reply is finished"""
+        last = after
+        while True:
+            # A snapshot, as merges may reshape the buffer while an event is being sent
+            for event_id, event in self._after(last):
+                last = event_id
+                yield event_id, event
+            if self.done:
+                return
+            await self._wake.wait()
+
+
+class StreamRegistry:
+    """Keeps chat generations addressable by idempotency key so reconnects can resume them.
+
+    A generation runs in its own task, detached from the connection that
+    started it. A reconnect carrying the same key (and Last-Event-ID) attaches
+    to it and gets the events it missed instead of starting a new model call.
+    If every client goes away, the generation is cancelled after
+    grace_seconds so an abandoned reply stops billing upstream. Finished
+    generations stay replayable for ttl_seconds; keys that were charged
+    against the rate limit are remembered for as long.
+    """
+
+    def __init__(self, max_streams: int = 1000, max_events: int = 256, ttl_seconds: float = 300.0,
+                 grace_seconds: float = 10.0):
+        self.max_streams = max_streams
+        self.max_events = max_events
+        self.ttl_seconds = ttl_seconds
+        self.grace_seconds = grace_seconds
+        self._generations: OrderedDict[str, Generation] = OrderedDict()
+        self._charged: OrderedDict[str, float] = OrderedDict()
+        self.started = 0
+        self.resumed = 0
+        self.abandoned = 0
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        for key in [k for k, g in self._generations.items() if g.done and g.finished_at < cutoff]:
+            del self._generations[key]
+        while len(self._generations) > self.max_streams:
+            key = next((k for k, g in self._generations.items() if g.done), None)
+            if key is None:
+                break
+            del self._generations[key]
+        while self._charged and (
+            next(iter(self._charged.values())) < cutoff or len(self._charged) > self.max_streams * 4
+        ):
+            self._charged.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Generation]:
+        self._expire()
+        return self._generations.get(key)
+
+    def was_charged(self, key: str) -> bool:
+        self._expire()
+        return key in self._charged
+
+    def mark_charged(self, key: str):
+        self._charged[key] = time.monotonic()
+        self._charged.move_to_end(key)
+
+    def reserve(self, key: str) -> Generation:
+        """Register a reply before it starts, so a concurrent retry waits for it instead of racing it"""
+        self._expire()
+        generation = Generation(key, self.max_events)
+        self._generations[key] = generation
+        return generation
+
+    def start(self, generation: Generation, events: AsyncIterator[dict],
+              on_done: Callable[[], None] = lambda: None) -> Generation:
+        """Run a reserved reply's event stream in the background"""
+        self.started += 1
+
+        async def pump():
+            try:
+                async for event in events:
+                    generation.append(event)
+            finally:
+                generation.finish()
+                on_done()
+
+        generation.task = asyncio.get_running_loop().create_task(pump())
+        return generation
+
+    def discard(self, generation: Generation, error: str):
+        """Give up on a reserved reply that never started; a later retry may start afresh"""
+        if generation.task is not None:
+            return
+        generation.append({'error': error, 'type': 'error'})
+        generation.finish()
+        if self._generations.get(generation.key) is generation:
+            del self._generations[generation.key]
+
+    async def attach(self, generation: Generation, after: int = 0, resumed: bool = False) -> AsyncIterator[tuple[int, dict]]:
+        """Subscribe a connection, cancelling the generation if it stays unwatched too long"""
+        if resumed:
+            self.resumed += 1
+        generation.subscribers += 1
+        try:
+            async for item in generation.subscribe(after):
+                yield item
+        finally:
+            generation.subscribers -= 1
+            if generation.subscribers == 0 and not generation.done:
+                asyncio.get_running_loop().call_later(self.grace_seconds, self._abandon_if_unwatched, generation)
+
+    def _abandon_if_unwatched(self, generation: Generation):
+        if generation.subscribers == 0 and not generation.done and generation.task is not None:
+            self.abandoned += 1
+            generation.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self._generations),
+            "in_flight": sum(1 for g in self._generations.values() if not g.done),
+            "started": self.started,
+            "resumed": self.resumed,
+            "abandoned": self.abandoned
+        }
+
+
+stream_registry = StreamRegistry(
+    max_streams=int(os.environ.get("STREAM_RESUME_MAX_STREAMS", "1000")),
+    ttl_seconds=float(os.environ.get("STREAM_RESUME_TTL_SECONDS", "300")),
+    grace_seconds=float(os.environ.get("STREAM_RESUME_GRACE_SECONDS", "10"))
+)
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_postgrest import FakePostgrest  # noqa: E402
+from db import PostgrestClient  # noqa: E402
+from sqlite_storage import SQLiteStorage  # noqa: E402
+from storage import SupabaseStorage  # noqa: E402
+
+
+@pytest.fixture(params=['supabase', 'sqlite'])
+def store(request, tmp_path):
+    """Each storage backend in turn: Supabase against a fake PostgREST, and SQLite in a temp file"""
+    if request.param == 'sqlite':
+        yield SQLiteStorage(str(tmp_path / 'chatbot.db'))
+        return
+    fake = FakePostgrest()
+    yield SupabaseStorage(PostgrestClient(fake.start(), 'test-key'))
+    fake.stop()
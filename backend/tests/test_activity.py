@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timezone
+
+import activity
+from activity import ActivityTracker
+
+
+class RecordingStorage:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.touched = []
+        self.updates = []
+        self.cutoffs = []
+
+    async def touch_session(self, session_id: str):
+        self.touched.append(session_id)
+
+    async def touch_sessions(self, session_ids: list, when: str):
+        if self.fail:
+            raise RuntimeError("storage down")
+        self.updates.append((sorted(session_ids), when))
+
+    async def expire_idle_sessions(self, cutoff: str) -> list:
+        self.cutoffs.append(cutoff)
+        return ['idle']
+
+
+def test_touches_flush_as_one_update_per_window_with_the_newest_time(monkeypatch):
+    store = RecordingStorage()
+    monkeypatch.setattr(activity, 'storage', store)
+    times = iter([1000.0, 1003.0, 1025.0, 1004.0])
+    monkeypatch.setattr(activity.time, 'time', lambda: next(times))
+
+    async def run():
+        tracker = ActivityTracker(flush_interval=60, resolution=10)
+        for session_id in ('a', 'b', 'c', 'a'):
+            await tracker.touch(session_id)
+        merged = tracker.merge([{'id': 'a', 'last_activity': 'stored'}])
+        await tracker.close()
+        return tracker, merged
+
+    tracker, merged = asyncio.run(run())
+    assert merged[0]['last_activity'] == activity._timestamp(1004.0)
+    assert sorted(store.updates) == [(['a', 'b'], activity._timestamp(1004.0)),
+                                     (['c'], activity._timestamp(1025.0))]
+    assert tracker.stats()['written'] == 3
+
+
+def test_failed_flush_keeps_touches_and_skips_the_sweep(monkeypatch):
+    store = RecordingStorage(fail=True)
+    monkeypatch.setattr(activity, 'storage', store)
+
+    async def run():
+        tracker = ActivityTracker()
+        await tracker.touch('a')
+        expired = await tracker.sweep()
+        return tracker, expired
+
+    tracker, expired = asyncio.run(run())
+    assert expired == [] and store.cutoffs == []
+    assert tracker.last_activity('a') is not None
+
+
+def test_without_the_loop_touches_write_through_and_requests_sweep(monkeypatch):
+    store = RecordingStorage()
+    monkeypatch.setattr(activity, 'storage', store)
+
+    async def run():
+        tracker = ActivityTracker(enabled=False, sweep_interval=0.05, idle_seconds=60)
+        await tracker.touch('a')
+        await asyncio.sleep(0.06)
+        await tracker.touch('b')
+        await tracker.touch('c')
+        return tracker
+
+    tracker = asyncio.run(run())
+    assert store.touched == ['a', 'b', 'c']
+    # Only the first touch after the interval sweeps
+    assert len(store.cutoffs) == 1 and tracker.expired == 1
+    cutoff = datetime.fromisoformat(store.cutoffs[0])
+    assert cutoff.utcoffset() == timezone.utc.utcoffset(None)
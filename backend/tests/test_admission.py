@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_released_slot_goes_to_the_longest_waiter():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_per_user=5, queue_timeout=5)
+        first = await controller.acquire('a')
+        order = []
+
+        async def wait(user):
+            ticket = await controller.acquire(user)
+            order.append(user)
+            return ticket
+
+        waiters = [asyncio.ensure_future(wait(user)) for user in ('b', 'c', 'd')]
+        await asyncio.sleep(0)
+        assert controller.stats()['queued'] == 3
+        first.release()
+        first.release()
+        for waiter in waiters:
+            (await waiter).release()
+        return order, controller.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == ['b', 'c', 'd']
+    assert stats['active'] == 0 and stats['queued'] == 0 and stats['admitted'] == 4
+
+
+def test_user_over_their_share_gets_429():
+    async def run():
+        controller = AdmissionController(max_concurrent=10, max_per_user=2)
+        await controller.acquire('a')
+        await controller.acquire('a')
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire('a')
+        # Other users are unaffected
+        await controller.acquire('b')
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.status_code == 429 and rejected.reason == "user_in_flight"
+
+
+def test_full_queue_is_rejected_at_once_with_retry_after():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_per_user=5, max_queue=1, queue_timeout=5)
+        await controller.acquire('a')
+        queued = asyncio.ensure_future(controller.acquire('b'))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire('c')
+        queued.cancel()
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.status_code == 503 and rejected.reason == "queue_full"
+    assert rejected.retry_after >= 1
+
+
+def test_timed_out_and_cancelled_waiters_leave_the_line():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_per_user=1, queue_timeout=0.01)
+        holder = await controller.acquire('a')
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire('b')
+        assert rejected.value.reason == "queue_timeout"
+        cancelled = asyncio.ensure_future(controller.acquire('c'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        holder.release()
+        # Neither left a slot or a per-user count behind
+        (await controller.acquire('b')).release()
+        (await controller.acquire('c')).release()
+        return controller.stats()
+
+    stats = asyncio.run(run())
+    assert stats['active'] == 0 and stats['queued'] == 0
@@ -0,0 +1,42 @@
+import asyncio
+import json
+from contextlib import aclosing
+
+from batch import BatchRunner
+
+
+async def reply(conversation, index):
+    async def events():
+        yield {'response': 'haan bol', 'type': 'chunk'}
+        yield {'type': 'complete', 'token_count': 2}
+    return events()
+
+
+def lines(count: int) -> list:
+    return [json.dumps({'id': f"c{i}", 'persona': 'kabir', 'turns': ['hi', 'aur?']}) + "\n" for i in range(count)]
+
+
+def test_consumer_leaving_early_stops_the_workers():
+    async def run():
+        runner = BatchRunner(reply, concurrency=2)
+        async with aclosing(runner.run(lines(50))) as records:
+            async for record in records:
+                # By now the workers have filled the queue and wait for room
+                await asyncio.sleep(0.05)
+                break
+        # Let the cancelled workers unwind; none may be left waiting on the full queue
+        for _ in range(10):
+            await asyncio.sleep(0)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
+
+
+def test_every_record_arrives_before_the_summary():
+    async def run():
+        return [record async for record in BatchRunner(reply, concurrency=3).run(lines(20))]
+
+    records = asyncio.run(run())
+    assert sum(record['type'] == 'turn' for record in records) == 40
+    assert sum(record['type'] == 'conversation' for record in records) == 20
+    assert records[-1]['type'] == 'summary' and records[-1]['turns'] == 40
@@ -0,0 +1,42 @@
+import asyncio
+
+import llm
+from llm import close_stream
+
+
+class Call:
+    """Stands in for the gRPC call google-api-core wraps"""
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    async def _wrapped_aiter(self):
+        yield 'chunk'
+
+
+class Response:
+    def __init__(self, iterator):
+        self._iterator = iterator
+
+
+def test_cancels_the_call_behind_the_wrapper_generator():
+    call = Call()
+    asyncio.run(close_stream(Response(call._wrapped_aiter())))
+    assert call.cancelled
+
+
+def test_unknown_shape_is_logged_once(capsys, monkeypatch):
+    monkeypatch.setattr(llm, '_upstream_shape_warned', False)
+
+    async def plain():
+        yield 'chunk'
+
+    async def run():
+        await close_stream(Response(plain()))
+        await close_stream(object())
+
+    asyncio.run(run())
+    assert capsys.readouterr().out.count("Upstream cancel unavailable") == 1
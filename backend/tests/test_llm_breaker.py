@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from llm import CircuitBreaker, CircuitOpenError
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0.0, half_open_probes=1)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_cancelled_probe_gives_its_slot_back():
+    breaker = half_open_breaker()
+
+    async def probe():
+        breaker.allow()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            breaker.abandon()
+            raise
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(probe())
+        await asyncio.sleep(0)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert breaker.probes == 0
+    # The next call may probe, and its success closes the breaker
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_probe_slot_is_exclusive_until_released():
+    breaker = half_open_breaker()
+    breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.abandon()
+    breaker.allow()
+
+
+def test_abandon_outside_half_open_is_a_no_op():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.allow()
+    breaker.abandon()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.probes == 0
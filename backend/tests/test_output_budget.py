@@ -0,0 +1,39 @@
+from llm import OutputBudget
+
+
+def feed(budget: OutputBudget, chunks: list) -> str:
+    taken = []
+    for chunk in chunks:
+        taken.append(budget.take(chunk))
+        if budget.exhausted:
+            break
+    return "".join(taken)
+
+
+def test_word_split_across_chunks_counts_once():
+    budget = OutputBudget(10)
+    assert feed(budget, ["bhai kya sce", "ne hai"]) == "bhai kya scene hai"
+    assert budget.words == 4
+    assert not budget.exhausted
+
+
+def test_cap_on_a_split_word_keeps_the_whole_word():
+    budget = OutputBudget(3)
+    assert feed(budget, ["bhai kya sce", "n", "e hai aaj"]) == "bhai kya scene"
+    assert budget.words == 3
+    assert budget.exhausted
+
+
+def test_cap_mid_chunk_cuts_after_the_last_word():
+    budget = OutputBudget(2)
+    assert feed(budget, ["haan bhai sun na"]) == "haan bhai"
+    assert budget.exhausted
+    assert budget.take(" aur") == ""
+
+
+def test_chunking_does_not_change_the_cut():
+    text = "arre yaar aaj toh kamaal ho gaya bro"
+    whole = OutputBudget(5).take(text)
+    for size in range(1, len(text) + 1):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert feed(OutputBudget(5), chunks).rstrip() == whole.rstrip() == "arre yaar aaj toh kamaal"
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from pagination import CONVERSATION_LISTING, SESSION_LISTING, Listing, fetch_page
+
+
+async def walk(listing: Listing, fetch, limit: int) -> tuple[list, int]:
+    """Every row of a listing by following next_cursor, and the number of pages it took"""
+    rows, after, pages = [], None, 0
+    while True:
+        page, cursor = await fetch_page(listing, fetch, after, limit)
+        rows += page
+        pages += 1
+        if cursor is None:
+            return rows, pages
+        after = listing.decode_cursor(cursor)
+
+
+def test_cursor_round_trips_and_rejects_garbage():
+    row = {'created_at': '2025-01-01T00:00:00+00:00', 'id': 'c1'}
+    cursor = CONVERSATION_LISTING.encode_cursor(row)
+    assert CONVERSATION_LISTING.decode_cursor(cursor) == ('2025-01-01T00:00:00+00:00', 'c1')
+    assert CONVERSATION_LISTING.decode_cursor(None) is None
+    with pytest.raises(ValueError):
+        CONVERSATION_LISTING.decode_cursor('not-a-cursor')
+
+
+def test_conversation_pages_cover_every_row_once_across_timestamp_ties(store):
+    async def run():
+        user = await store.create_user({'username': 'priya', 'daily_message_count': 0})
+        session = await store.create_session(user['id'], 'kabir')
+        # Three turns share each timestamp, so the id has to break the ties
+        await store.insert_conversations([{
+            'id': f"c{i:02d}", 'user_id': user['id'], 'session_id': session['id'], 'persona': 'kabir',
+            'message': f"m{i}", 'response': 'ok', 'token_count': 1,
+            'created_at': f"2025-01-01T00:00:{i // 3:02d}+00:00"
+        } for i in range(10)])
+        columns = CONVERSATION_LISTING.select_columns(['message'])
+        result = await walk(CONVERSATION_LISTING, lambda after, limit: store.list_conversations_page(
+            session['id'], columns, limit, after), 3)
+        await store.close()
+        return result
+
+    rows, pages = asyncio.run(run())
+    assert [row['id'] for row in rows] == [f"c{i:02d}" for i in range(10)]
+    assert pages == 4
+
+
+def test_session_pages_run_newest_first(store):
+    async def run():
+        user = await store.create_user({'username': 'priya', 'daily_message_count': 0})
+        for persona in ('kabir', 'raghav', 'kiara'):
+            await store.create_session(user['id'], persona)
+        columns = SESSION_LISTING.select_columns(['persona'])
+        result = await walk(SESSION_LISTING, lambda after, limit: store.list_sessions_page(
+            user['id'], columns, limit, after), 2)
+        await store.close()
+        return result
+
+    rows, pages = asyncio.run(run())
+    assert sorted(row['persona'] for row in rows) == ['kabir', 'kiara', 'raghav']
+    keys = [(row['last_activity'], row['id']) for row in rows]
+    assert keys == sorted(keys, reverse=True)
+    assert pages == 2
@@ -0,0 +1,30 @@
+import asyncio
+
+
+def resolve(store, history_turns: int) -> dict:
+    return store.resolve_request_context(
+        username='priya', today='2025-01-01', persona='kabir', create_user=True, count_message=False,
+        message_limit=100, token_limit=1000, tokens=0, history_turns=history_turns
+    )
+
+
+def test_history_is_complete_only_when_it_was_read(store):
+    async def run():
+        created = await resolve(store, 0)
+        unread = await resolve(store, 0)
+        await store.insert_conversation({
+            'user_id': created['user_id'], 'session_id': created['session_id'], 'persona': 'kabir',
+            'message': 'yo', 'response': 'bol bhai', 'token_count': 3
+        })
+        read = await resolve(store, 5)
+        await store.close()
+        return created, unread, read
+
+    created, unread, read = asyncio.run(run())
+    # A new session has no turns, so its empty history is the whole of it
+    assert created['session_created'] and created['history_complete']
+    assert created['history'] == []
+    assert unread['session_id'] == created['session_id']
+    assert not unread['history_complete']
+    assert read['history_complete']
+    assert [turn['message'] for turn in read['history']] == ['yo']
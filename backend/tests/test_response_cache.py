@@ -0,0 +1,37 @@
+from response_cache import ResponseCache
+
+
+def test_openers_that_read_the_same_share_a_key():
+    cache = ResponseCache()
+    key = cache.key('kabir', 'Heyyy bro!')
+    assert key == ('kabir', 'hey bro')
+    assert cache.key('kabir', 'hey   BRO') == key
+    # The full-width letters NFKC folds to plain ones
+    assert cache.key('kabir', 'ｈｅｙ bro') == key
+
+
+def test_keys_are_per_persona_and_only_for_short_messages():
+    cache = ResponseCache(max_words=3)
+    assert cache.key('kabir', 'hi') != cache.key('raghav', 'hi')
+    assert cache.key('kabir', 'kal exam hai kya karu') is None
+    assert cache.key('kabir', '!!!') is None
+    assert ResponseCache(enabled=False).key('kabir', 'hi') is None
+
+
+def test_hits_only_once_every_variant_is_filled_and_never_repeat_back_to_back():
+    cache = ResponseCache(variants=2)
+    key = cache.key('kabir', 'hi')
+    cache.store(key, ['yo ', 'bhai'])
+    assert cache.lookup(key) is None
+    cache.store(key, ['haan ', 'bol'])
+    served = [cache.lookup(key) for _ in range(6)]
+    assert all(reply in (['yo ', 'bhai'], ['haan ', 'bol']) for reply in served)
+    assert all(a != b for a, b in zip(served, served[1:]))
+
+
+def test_expired_replies_refill_from_the_model():
+    cache = ResponseCache(variants=1, ttl_seconds=-1)
+    key = cache.key('kabir', 'hi')
+    cache.store(key, ['yo'])
+    assert cache.lookup(key) is None
+    assert cache.stats()['expired'] == 1
@@ -0,0 +1,51 @@
+import asyncio
+
+from sse import HEARTBEAT, EventEncoder
+
+
+def chunk(text: str) -> dict:
+    return {'response': text, 'type': 'chunk'}
+
+
+async def source(items: list, delay: float = 0.0):
+    for item in items:
+        if delay:
+            await asyncio.sleep(delay)
+        yield item
+
+
+def coalesce(encoder: EventEncoder, events) -> list:
+    async def run():
+        return [item async for item in encoder.coalesce(events)]
+    return asyncio.run(run())
+
+
+def test_burst_of_chunks_becomes_one_frame_with_the_last_id():
+    encoder = EventEncoder(window=1.0, max_bytes=512)
+    items = [(i, chunk(f"w{i} ")) for i in range(1, 6)] + [(6, {'type': 'complete'})]
+    out = coalesce(encoder, source(items))
+    assert out == [(5, chunk("w1 w2 w3 w4 w5 ")), (6, {'type': 'complete'})]
+    assert encoder.stats()['chunks_per_frame'] == 2.5
+
+
+def test_max_bytes_flushes_before_the_window():
+    encoder = EventEncoder(window=1.0, max_bytes=4)
+    out = coalesce(encoder, source([chunk("ab"), chunk("cd"), chunk("ef")]))
+    assert out == [(None, chunk("abcd")), (None, chunk("ef"))]
+
+
+def test_slow_chunks_go_out_as_the_window_closes():
+    encoder = EventEncoder(window=0.01, max_bytes=512)
+    out = coalesce(encoder, source([(1, chunk("a")), (2, chunk("b"))], delay=0.05))
+    assert out == [(1, chunk("a")), (2, chunk("b"))]
+
+
+def test_idle_stream_gets_heartbeats():
+    encoder = EventEncoder(window=0.01, heartbeat=0.02)
+
+    async def run():
+        return [frame async for frame in encoder.encode(source([(1, {'type': 'complete'})], delay=0.07))]
+
+    frames = asyncio.run(run())
+    assert frames[0] == HEARTBEAT
+    assert frames[-1] == b'id: 1\ndata: {"type":"complete"}\n\n'
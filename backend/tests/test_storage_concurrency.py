@@ -0,0 +1,37 @@
+import asyncio
+
+from bench.bench_storage_concurrency import message_path, seed
+from bench.fake_postgrest import FakePostgrest
+from db import PostgrestClient
+from storage import SupabaseStorage
+
+USERS = 20
+
+
+def test_concurrent_storage_calls_overlap_and_return_their_own_rows():
+    fake = FakePostgrest(latency=0.05)
+    store = SupabaseStorage(PostgrestClient(fake.start(), 'test-key', max_connections=USERS))
+    seed(fake, USERS)
+
+    async def one(i):
+        await message_path(store, i)
+        user = await store.get_user(f"bench{i}", 'id')
+        turns = await store.list_conversations(f"session-{i}", 'id')
+        return user['id'], [turn['id'] for turn in turns]
+
+    async def run():
+        try:
+            return await asyncio.gather(*(one(i) for i in range(USERS)))
+        finally:
+            await store.close()
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        fake.stop()
+    # A blocking client would have served these one at a time
+    assert fake.peak_in_flight > USERS // 2
+    for i, (user_id, turn_ids) in enumerate(results):
+        assert user_id == f"user-{i}"
+        assert sorted(turn_ids) == sorted(f"conv-{i}-{turn}" for turn in range(10))
+    assert fake.request_count == USERS * 6
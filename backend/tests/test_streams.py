@@ -0,0 +1,75 @@
+import asyncio
+
+from streams import Generation
+
+
+def chunk(text: str) -> dict:
+    return {'response': text, 'type': 'chunk'}
+
+
+def collect(generation: Generation, after: int = 0) -> list[tuple[int, dict]]:
+    async def run():
+        return [item async for item in generation.subscribe(after)]
+    return asyncio.run(run())
+
+
+def full_generation(words: int, max_events: int) -> Generation:
+    generation = Generation('key', max_events)
+    generation.append({'type': 'meta'})
+    for i in range(words):
+        generation.append(chunk(f"w{i} "))
+    generation.append({'type': 'complete'})
+    generation.finish()
+    return generation
+
+
+def text(events: list[tuple[int, dict]]) -> str:
+    return "".join(event.get('response', '') for _, event in events)
+
+
+def test_buffer_stays_bounded_and_replays_the_whole_reply():
+    generation = full_generation(100, max_events=8)
+    assert len(generation.events) <= 8
+    events = collect(generation)
+    assert text(events) == "".join(f"w{i} " for i in range(100))
+    assert [event['type'] for _, event in events][0] == 'meta'
+    assert events[-1][1]['type'] == 'complete'
+
+
+def test_resume_inside_a_merged_chunk_sends_only_the_missing_text():
+    generation = full_generation(100, max_events=8)
+    # Id 1 is meta and 2..101 the words; this client saw up to word 39 (id 41)
+    events = collect(generation, after=41)
+    assert text(events) == "".join(f"w{i} " for i in range(40, 100))
+    assert [event_id for event_id, _ in events] == sorted({event_id for event_id, _ in events})
+
+
+def test_every_resume_point_continues_without_repeating_text():
+    generation = full_generation(30, max_events=5)
+    whole = "".join(f"w{i} " for i in range(30))
+    for after in range(1, 32):
+        seen = whole[:sum(len(f"w{i} ") for i in range(after - 1))]
+        assert seen + text(collect(generation, after)) == whole
+
+
+def test_live_subscriber_sees_each_word_once_while_the_buffer_merges():
+    async def run():
+        generation = Generation('key', 4)
+        received = []
+
+        async def follow():
+            async for _, event in generation.subscribe():
+                received.append(event.get('response', ''))
+                # A slow reader lets several chunks land between its reads
+                await asyncio.sleep(0)
+
+        reader = asyncio.ensure_future(follow())
+        for i in range(50):
+            generation.append(chunk(f"w{i} "))
+            if i % 7 == 0:
+                await asyncio.sleep(0)
+        generation.finish()
+        await reader
+        return "".join(received)
+
+    assert asyncio.run(run()) == "".join(f"w{i} " for i in range(50))
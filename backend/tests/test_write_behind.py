@@ -0,0 +1,83 @@
+import asyncio
+
+import persistence
+from persistence import WriteBehindQueue
+
+
+class RecordingStorage:
+    """Keeps inserted batches; fails the first `failures` inserts"""
+
+    def __init__(self, failures: int = 0):
+        self.batches = []
+        self.failures = failures
+        self.gate = None
+
+    async def insert_conversations(self, rows: list):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("storage down")
+        self.batches.append([row['message'] for row in rows])
+
+
+def turn(i: int, session: str = 's1') -> dict:
+    return {'session_id': session, 'message': f"m{i}", 'response': 'ok'}
+
+
+def test_flush_writes_bulk_batches_in_order(monkeypatch):
+    store = RecordingStorage()
+    monkeypatch.setattr(persistence, 'storage', store)
+
+    async def run():
+        queue = WriteBehindQueue(max_batch=3, flush_interval=60)
+        for i in range(7):
+            await queue.add_conversation(turn(i))
+        await queue.close()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert [message for batch in store.batches for message in batch] == [f"m{i}" for i in range(7)]
+    assert all(len(batch) <= 3 for batch in store.batches)
+    assert stats['inserted'] == 7 and stats['queue_depth'] == 0
+
+
+def test_failed_batch_is_retried_ahead_of_newer_rows(monkeypatch):
+    store = RecordingStorage(failures=1)
+    monkeypatch.setattr(persistence, 'storage', store)
+
+    async def run():
+        queue = WriteBehindQueue(max_batch=2, flush_interval=60)
+        for i in range(2):
+            await queue.add_conversation(turn(i))
+        assert not await queue.flush()
+        await queue.add_conversation(turn(2))
+        assert await queue.flush()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert store.batches == [['m0', 'm1'], ['m2']]
+    assert stats['retries'] == 1 and stats['dropped'] == 0
+
+
+def test_rows_stay_readable_until_their_insert_commits(monkeypatch):
+    store = RecordingStorage()
+    monkeypatch.setattr(persistence, 'storage', store)
+
+    async def run():
+        queue = WriteBehindQueue(max_batch=10, flush_interval=60)
+        await queue.add_conversation(turn(0))
+        await queue.add_conversation(turn(1, session='s2'))
+        store.gate = asyncio.Event()
+        flushing = asyncio.ensure_future(queue.flush())
+        await asyncio.sleep(0)
+        pending = queue.pending_conversations('s1')
+        assert [row['message'] for row in pending] == ['m0']
+        assert queue.in_flight(pending[0]['id'])
+        # A read that already sees the in-flight row in storage does not get it twice
+        assert [row['message'] for row in queue.merge_pending('s1', list(pending))] == ['m0']
+        store.gate.set()
+        await flushing
+        assert queue.pending_conversations('s1') == []
+
+    asyncio.run(run())
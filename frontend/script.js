@@ -1,4 +1,5 @@
 const API_BASE_URL = 'https://guardian-ai-wsxi.vercel.app';
+const WS_BASE_URL = API_BASE_URL.replace(/^http/, 'ws');
 
 
 class PersonaChatbot {
@@ -7,6 +8,11 @@ class PersonaChatbot {
         this.currentUser = null;
         this.personas = {};
         this.currentSessionId = null;
+        // One WebSocket per user and persona when the server supports it; EventSource otherwise
+        this.socket = null;
+        this.socketUnavailable = false;
+        this.socketReply = null;
+        this.onSocketReady = null;
         
         this.initializeElements();
         this.setupEventListeners();
@@ -87,6 +93,13 @@ class PersonaChatbot {
             }
         });
         
+        // Escape stops a reply that is still streaming over the WebSocket
+        this.messageInput.addEventListener('keydown', (e) => {
+            if (e.key === 'Escape') {
+                this.cancelReply();
+            }
+        });
+        
         // Character count
         this.messageInput.addEventListener('input', () => {
             this.updateCharCount();
@@ -209,6 +222,23 @@ class PersonaChatbot {
         this.sidebar.classList.remove('open');
         
         // Call backend to register persona selection
+        await this.registerPersona(key);
+        
+        // Add persona introduction
+        setTimeout(() => {
+            this.addBotMessage(this.getPersonaGreeting(key));
+        }, 500);
+        
+        this.showToast(`Started chatting with ${persona.name}!`, 'success');
+    }
+    
+    async registerPersona(key) {
+        // The WebSocket resolves the user and session once for the whole conversation
+        const ready = await this.openSocket(key);
+        if (ready) {
+            this.currentSessionId = ready.session_id;
+            return;
+        }
         try {
             const response = await fetch(`${API_BASE_URL}/persona/select`, {
                 method: 'POST',
@@ -228,13 +258,165 @@ class PersonaChatbot {
         } catch (error) {
             console.error('Failed to register persona selection:', error);
         }
+    }
+    
+    openSocket(persona) {
+        // Resolves with the server's ready frame, or null when WebSockets are not available
+        if (this.socketUnavailable || !('WebSocket' in window)) {
+            return Promise.resolve(null);
+        }
+        if (this.socket && this.socket.readyState === WebSocket.OPEN && this.socket.username === this.currentUser) {
+            return new Promise((resolve) => {
+                this.onSocketReady = resolve;
+                this.socket.send(JSON.stringify({ type: 'persona', persona }));
+            });
+        }
+        this.closeSocket();
         
-        // Add persona introduction
-        setTimeout(() => {
-            this.addBotMessage(this.getPersonaGreeting(key));
-        }, 500);
+        return new Promise((resolve) => {
+            const url = new URL(`${WS_BASE_URL}/ws/chat`);
+            url.searchParams.append('username', this.currentUser);
+            url.searchParams.append('persona', persona);
+            const socket = new WebSocket(url);
+            socket.username = this.currentUser;
+            let ready = false;
+            const timer = setTimeout(() => socket.close(), 5000);
+            
+            this.onSocketReady = (data) => {
+                ready = data !== null;
+                clearTimeout(timer);
+                resolve(data);
+            };
+            socket.onmessage = (event) => {
+                try {
+                    this.handleSocketFrame(JSON.parse(event.data));
+                } catch (parseError) {
+                    console.error('❌ Failed to parse socket frame:', parseError, event.data);
+                }
+            };
+            socket.onclose = () => {
+                clearTimeout(timer);
+                if (this.socket === socket) {
+                    this.socket = null;
+                }
+                if (!ready) {
+                    // e.g. a serverless deployment without WebSockets: stay on EventSource
+                    console.warn('WebSocket unavailable, using EventSource');
+                    this.socketUnavailable = true;
+                    this.onSocketReady = null;
+                    resolve(null);
+                    return;
+                }
+                this.onSocketClosed();
+            };
+            this.socket = socket;
+        });
+    }
+    
+    closeSocket() {
+        if (this.socket) {
+            this.socket.onclose = null;
+            this.socket.close();
+            this.socket = null;
+        }
+        this.socketReply = null;
+    }
+    
+    handleSocketFrame(data) {
+        if (data.type === 'ready' || (data.type === 'error' && !data.request_id)) {
+            // Answer to connecting or switching persona
+            const onReady = this.onSocketReady;
+            this.onSocketReady = null;
+            if (data.type === 'error') {
+                console.error('❌ Socket error:', data.error);
+            }
+            if (onReady) {
+                onReady(data.type === 'ready' ? data : null);
+            }
+            return;
+        }
         
-        this.showToast(`Started chatting with ${persona.name}!`, 'success');
+        const reply = this.socketReply;
+        if (!reply || data.request_id !== reply.requestId) {
+            return;
+        }
+        if (data.id) {
+            reply.lastEventId = data.id;
+        }
+        
+        if (data.type === 'chunk' && data.response) {
+            if (!reply.element) {
+                reply.element = this.addBotMessage("", false);
+            }
+            reply.text += data.response;
+            this.updateBotMessage(reply.element, reply.text);
+            
+        } else if (data.type === 'complete') {
+            console.log('✅ Stream complete:', data);
+            this.socketReply = null;
+            this.updateMessageCountDisplay(data.remaining_messages);
+            this.hideTypingIndicator();
+            if (reply.element) {
+                this.scrollToBottom();
+            }
+            
+        } else if (data.type === 'cancelled') {
+            this.socketReply = null;
+            this.hideTypingIndicator();
+            
+        } else if (data.type === 'error') {
+            console.error('❌ Stream error:', data.error);
+            this.socketReply = null;
+            this.hideTypingIndicator();
+            if (data.status === 429 && data.error.startsWith('Daily')) {
+                this.addBotMessage("Oh no! You've reached your daily message limit! 😅 Come back tomorrow for more amazing conversations! 🌅");
+                this.showToast('Daily message limit reached!', 'warning');
+                this.disableChatInput();
+            } else {
+                this.addBotMessage("Oops! I encountered an error. Please try again! 😅");
+            }
+        }
+    }
+    
+    async onSocketClosed() {
+        // A reply cut off by a dropped connection is resumed once, after the last event received
+        const reply = this.socketReply;
+        if (!reply || !this.currentPersona) {
+            return;
+        }
+        const ready = reply.resumed ? null : await this.openSocket(this.currentPersona);
+        if (!ready || this.socketReply !== reply) {
+            this.socketReply = null;
+            this.hideTypingIndicator();
+            this.addBotMessage("Oops! I'm having trouble responding right now. Please try again! 😅");
+            this.showToast('Connection lost. Please try again.', 'error');
+            return;
+        }
+        reply.resumed = true;
+        this.socket.send(JSON.stringify({
+            type: 'message',
+            message: reply.message,
+            request_id: reply.requestId,
+            last_event_id: reply.lastEventId
+        }));
+    }
+    
+    sendOverSocket(message) {
+        this.socketReply = {
+            requestId: crypto.randomUUID(),
+            message,
+            element: null,
+            text: '',
+            lastEventId: 0,
+            resumed: false
+        };
+        this.socket.send(JSON.stringify({ type: 'message', message, request_id: this.socketReply.requestId }));
+    }
+    
+    cancelReply() {
+        if (this.socketReply && this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify({ type: 'cancel' }));
+        }
     }
     
     getPersonaGreeting(personaKey) {
@@ -275,6 +457,7 @@ class PersonaChatbot {
     }
     
     logout() {
+        this.closeSocket();
         this.currentUser = null;
         this.currentPersona = null;
         this.currentSessionId = null;
@@ -440,6 +623,10 @@ class PersonaChatbot {
     async sendMessage() {
         const message = this.messageInput.value.trim();
         if (!message || !this.currentUser || !this.currentPersona) return;
+        if (this.socketReply) {
+            this.showToast('Still replying… press Esc to stop it.', 'warning');
+            return;
+        }
         
         // Add user message and clear input
         this.addUserMessage(message);
@@ -450,23 +637,38 @@ class PersonaChatbot {
         this.showTypingIndicator();
 
         try {
+            if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+                this.sendOverSocket(message);
+                return;
+            }
+            
             const url = new URL(`${API_BASE_URL}/chat`);
             url.searchParams.append('message', message);
             url.searchParams.append('persona', this.currentPersona);
             url.searchParams.append('username', this.currentUser);
+            // Idempotency key: when EventSource reconnects after a network blip it resends
+            // this URL with Last-Event-ID, and the server resumes the same reply
+            url.searchParams.append('request_id', crypto.randomUUID());
 
             const eventSource = new EventSource(url);
             let botMessageElement = null;
             let finalDataReceived = false;
             let fullResponse = '';
+            let reconnects = 0;
+            const MAX_RECONNECTS = 3;
+            // While the browser is retrying on its own, errors are not final
+            const isReconnecting = () => !finalDataReceived
+                && eventSource.readyState === EventSource.CONNECTING
+                && reconnects < MAX_RECONNECTS;
 
+            // Keep-alive comments from the server never reach onmessage
             eventSource.onmessage = (event) => {
                 try {
                     const data = JSON.parse(event.data);
                     console.log('📡 Received data:', data);
 
                     if (data.type === 'chunk' && data.response) {
-                        // This is a streaming chunk
+                        // A streaming chunk; the server may merge several model chunks into one
                         if (!botMessageElement) {
                             botMessageElement = this.addBotMessage("", false); // Don't scroll yet
                         }
@@ -474,8 +676,11 @@ class PersonaChatbot {
                         this.updateBotMessage(botMessageElement, fullResponse);
                         
                     } else if (data.type === 'complete') {
-                        // This is the final complete message
+                        // Metadata only: the reply text was already assembled from the chunks
                         console.log('✅ Stream complete:', data);
+                        if (!botMessageElement && data.response) {
+                            botMessageElement = this.addBotMessage(data.response, false);
+                        }
                         this.updateMessageCountDisplay(data.remaining_messages);
                         this.hideTypingIndicator();
                         if (botMessageElement) {
@@ -504,6 +709,11 @@ class PersonaChatbot {
             };
 
             eventSource.onerror = (error) => {
+                if (isReconnecting()) {
+                    reconnects++;
+                    console.warn(`🔁 Stream interrupted, resuming (attempt ${reconnects})`);
+                    return;
+                }
                 console.error("EventSource failed:", error);
                 this.hideTypingIndicator();
                 if (!finalDataReceived) {
@@ -514,6 +724,10 @@ class PersonaChatbot {
             };
 
             eventSource.addEventListener('error', (event) => {
+                if (eventSource.readyState === EventSource.CONNECTING && !finalDataReceived
+                        && reconnects <= MAX_RECONNECTS) {
+                    return;
+                }
                 // Handle rate limit or other server errors
                 if (event.status === 429) {
                     this.addBotMessage("Oh no! You've reached your daily message limit! 😅 Come back tomorrow for more amazing conversations! 🌅");